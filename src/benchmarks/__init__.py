@@ -0,0 +1,10 @@
+"""
+Benchmarks for the co-simulation hot paths.
+
+:mod:`benchmarks.micro` times ``step``/``get_data`` of each simulator in
+isolation with synthetic inputs, :mod:`benchmarks.end_to_end` times a full
+``config_cosimul()`` run over a fixed window. Run ``python -m benchmarks``
+(or ``tsre bench``) from ``src`` to write the results as JSON, so that they
+can be compared between commits.
+
+"""
@@ -0,0 +1,38 @@
+"""
+End-to-end benchmark: build the scenario with ``config_cosimul()`` and run
+it over a fixed window, writing the results to a temporary file.
+
+"""
+import tempfile
+import time
+
+from pathlib import Path
+
+from scenarios import base_scenario
+
+
+def bench_cosimul(ctrl=None, start=base_scenario.START, end=30*60, **kwargs):
+    """Time the setup and the run of the base scenario over *end* seconds.
+
+    Returns ``{'skipped': reason}`` if the grid file is not available.
+
+    """
+    grid_file = kwargs.get('grid_file', base_scenario.GRID_FILE)
+    if not Path(grid_file).exists():
+        return {'skipped': 'grid file not found: %s' % grid_file}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        t0 = time.perf_counter()
+        world = base_scenario.config_cosimul(ctrl=ctrl, start=start,
+                                             output_file=Path(tmp) / 'results.csv',
+                                             **kwargs)
+        t1 = time.perf_counter()
+        world.run(until=end, print_progress=False)
+        t2 = time.perf_counter()
+
+    return {
+        'setup_s': t1 - t0,
+        'run_s': t2 - t1,
+        'steps': end // 60,
+        'per_step_ms': (t2 - t1) / (end // 60) * 1e3,
+    }
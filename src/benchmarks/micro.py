@@ -0,0 +1,150 @@
+"""
+Isolated benchmarks of the simulators, driven directly through their
+mosaik API methods with synthetic inputs (no mosaik world involved).
+
+Each benchmark does one untimed warm-up step and then times ``steps`` calls
+of ``step`` and ``get_data``. Irradiance values come from the bundled Bremen
+data, voltages and PV powers from a seeded random generator.
+
+"""
+import importlib
+import tempfile
+import time
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from scenarios.base_scenario import CONTROLLERS, PV_DATA, START
+from simulators.collector import Collector
+from simulators.csv_sim_pandas import CSV, load_data
+from simulators.pv_simulator import PvAdapter
+
+STEP_SIZE = 60
+
+
+class Timer:
+    """Accumulates the wall time and the number of calls of one method."""
+
+    def __init__(self):
+        self.total = 0.
+        self.calls = 0
+
+    def __call__(self, func, *args):
+        t0 = time.perf_counter()
+        result = func(*args)
+        self.total += time.perf_counter() - t0
+        self.calls += 1
+        return result
+
+    def result(self):
+        return {'total_s': self.total, 'calls': self.calls,
+                'per_call_us': self.total / self.calls * 1e6 if self.calls else None}
+
+
+def dni_series(steps, start=START):
+    """Measured DNI [W/m2] for *steps* minutes from *start*."""
+    index, values, _ = load_data(PV_DATA, header=0)
+    i = int(np.searchsorted(index, np.datetime64(pd.Timestamp(start), 'ns')))
+    return np.asarray(values[i:i + steps + 1, 0], dtype=float)
+
+
+def bench_pv(n_agents, steps, model='PV'):
+    """``PvAdapter`` with *n_agents* single panels, or with one fleet of
+    *n_agents* panels for *model* ``'PVFleet'``."""
+    dni = dni_series(steps)
+    sim = PvAdapter()
+    sim.init('PV', 1., start_date=START, gen_neg=False)
+    if model == 'PVFleet':
+        entities = sim.create(1, 'PVFleet', lat=53.07, area=3e4 / 48, n_panels=n_agents)
+        eids = [child['eid'] for child in entities[0]['children']]
+        targets = [entities[0]['eid']]
+    else:
+        entities = sim.create(n_agents, 'PV', lat=53.07, area=3e4 / 48)
+        eids = targets = [e['eid'] for e in entities]
+    outputs = {eid: ['P_gen'] for eid in eids}
+
+    step, get_data = Timer(), Timer()
+    for k in range(steps + 1):
+        inputs = {eid: {'DNI': {'CSV-0.csv-0': dni[k]}} for eid in targets}
+        if k == 0:
+            sim.step(0, inputs, np.inf)
+            sim.get_data(outputs)
+            continue
+        step(sim.step, k * STEP_SIZE, inputs, np.inf)
+        get_data(sim.get_data, outputs)
+    return {'step': step.result(), 'get_data': get_data.result()}
+
+
+def load_class(path):
+    """Return the class named by a ``'module:Class'`` *path*."""
+    module, _, name = path.partition(':')
+    return getattr(importlib.import_module(module), name)
+
+
+def bench_ctrl(n_agents, steps, variant='VV', seed=0):
+    """Controller *variant* (a key of ``base_scenario.CONTROLLERS``) with
+    *n_agents* agents."""
+    rng = np.random.default_rng(seed)
+    sim = load_class(CONTROLLERS[variant])()
+    sim.init('Ctrl', 1., output_delay=5)
+    eids = [e['eid'] for e in sim.create(n_agents, 'Ctrl')]
+    outputs = {eid: ['mod', 'pot'] for eid in eids}
+
+    step, get_data = Timer(), Timer()
+    for k in range(steps + 1):
+        val_in = rng.uniform(0.98, 1.08, n_agents)
+        p_dc = rng.uniform(0., 0.04, n_agents)
+        inputs = {eid: {'val_in': {'Grid-0.bus': val_in[i]}, 'p_dc': {'PV-0.PV_0': p_dc[i]}}
+                  for i, eid in enumerate(eids)}
+        if k == 0:
+            sim.step(0, inputs, np.inf)
+            sim.get_data(outputs)
+            continue
+        step(sim.step, k * STEP_SIZE, inputs, np.inf)
+        get_data(sim.get_data, outputs)
+    return {'step': step.result(), 'get_data': get_data.result()}
+
+
+def bench_collector(n_agents, steps, output_format='csv', seed=0):
+    """``Collector`` receiving three attributes from each of *n_agents*
+    sources, written to a temporary file."""
+    rng = np.random.default_rng(seed)
+    sources = ['Grid-0.bus-%d' % i for i in range(n_agents)]
+    suffix = {'csv': '.csv', 'parquet': '.parquet', 'hdf5': '.h5'}[output_format]
+
+    step, finalize = Timer(), Timer()
+    with tempfile.TemporaryDirectory() as tmp:
+        sim = Collector()
+        sim.init('Collector', 1., start_date=START,
+                 output_file=Path(tmp) / ('results' + suffix))
+        sim.create(1, 'Monitor')
+        for k in range(steps + 1):
+            values = rng.random((3, n_agents))
+            inputs = {'Monitor': {attr: dict(zip(sources, values[j]))
+                                  for j, attr in enumerate(('vm_pu', 'p_mw', 'q_mvar'))}}
+            if k == 0:
+                sim.step(0, inputs, np.inf)
+                continue
+            step(sim.step, k * STEP_SIZE, inputs, np.inf)
+        finalize(sim.finalize)
+    return {'step': step.result(), 'finalize': finalize.result()}
+
+
+def bench_csv(steps, use_cache=True):
+    """``CSV`` simulator serving the Bremen DNI data. The data has a single
+    entity, so this benchmark does not depend on the number of agents."""
+    init = Timer()
+    sim = CSV()
+    init(sim.init, 'CSV', 1., START, PV_DATA, None, True, use_cache)
+    sim.create(1, 'Data')
+    outputs = {'csv-0': ['DNI']}
+
+    step, get_data = Timer(), Timer()
+    time_ = sim.step(0, {}, np.inf)
+    sim.get_data(outputs)
+    for k in range(steps):
+        time_ = step(sim.step, time_, {}, np.inf)
+        get_data(sim.get_data, outputs)
+    return {'init': init.result(), 'step': step.result(), 'get_data': get_data.result()}
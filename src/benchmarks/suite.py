@@ -0,0 +1,94 @@
+"""
+Benchmark suite: runs the micro and end-to-end benchmarks and writes the
+results as JSON::
+
+    python -m benchmarks --sizes 48 500 --output bench.json
+
+"""
+import argparse
+import datetime
+import json
+import platform
+import subprocess
+import sys
+
+import numpy as np
+import pandas as pd
+
+from benchmarks import end_to_end, micro
+
+SIZES = [48, 500, 5000]
+VARIANTS = list(micro.CONTROLLERS)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True, cwd=micro.PV_DATA.parent).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(sizes=SIZES, steps=20, variants=VARIANTS, end_to_end_window=30*60,
+              log=print):
+    """Run all benchmarks and return the results as a JSON-serializable dict."""
+    benchmarks = []
+
+    def record(name, agents, func, *args, **kwargs):
+        log('%-22s %6s agents ...' % (name, agents if agents is not None else '-'))
+        result = func(*args, **kwargs)
+        benchmarks.append({'name': name, 'agents': agents, 'steps': steps, **result})
+
+    for n in sizes:
+        record('pv.PV', n, micro.bench_pv, n, steps)
+        record('pv.PVFleet', n, micro.bench_pv, n, steps, model='PVFleet')
+        for variant in variants:
+            record('ctrl.%s' % variant, n, micro.bench_ctrl, n, steps, variant)
+        record('collector.csv', n, micro.bench_collector, n, steps)
+    record('csv', None, micro.bench_csv, steps)
+    record('csv.no_cache', None, micro.bench_csv, steps, use_cache=False)
+
+    if end_to_end_window:
+        log('%-22s %6s ...' % ('end_to_end', '48'))
+        result = end_to_end.bench_cosimul(end=end_to_end_window)
+        benchmarks.append({'name': 'end_to_end', 'agents': 48, **result})
+
+    return {
+        'meta': {
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'commit': git_commit(),
+            'python': sys.version.split()[0],
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'platform': platform.platform(),
+        },
+        'benchmarks': benchmarks,
+    }
+
+
+def build_parser(parser=None):
+    parser = parser or argparse.ArgumentParser(prog='python -m benchmarks',
+                                               description='Benchmarks dos simuladores')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES,
+                        help='números de agentes')
+    parser.add_argument('--steps', type=int, default=20, help='passos medidos por benchmark')
+    parser.add_argument('--ctrl', nargs='+', default=VARIANTS, choices=VARIANTS,
+                        help='variantes de controlador')
+    parser.add_argument('--window', type=int, default=30*60,
+                        help='janela da execução completa em segundos (0 desativa)')
+    parser.add_argument('--output', help='arquivo JSON de resultados (padrão: saída padrão)')
+    return parser
+
+
+def main(args=None):
+    if args is None or isinstance(args, list):
+        args = build_parser().parse_args(args)
+    log = print if args.output else (lambda *a: print(*a, file=sys.stderr))
+    results = run_suite(args.sizes, args.steps, args.ctrl, args.window, log)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
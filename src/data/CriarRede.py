@@ -1,11 +1,25 @@
+import sys
+
+from pathlib import Path
+
 import pandapower as pp
 import simbench as sb
-# Criar o arquivo .json da rede 1-LV-rural2--0-sw
-net = sb.get_simbench_net('1-LV-rural2--0-sw')
 
-output_file = 'rede_1-LV-rural2--0-sw.json'
+current_dir = Path(__file__).resolve().parent
+sys.path.insert(0, str(current_dir.parent))
+
+from simulators.grid_sim import build_cache
+
+# Cria o arquivo .json de uma rede SimBench e o cache da rede carregada
+# (ver simulators.grid_sim). Uso: python data/CriarRede.py [código SimBench]
+code = sys.argv[1] if len(sys.argv) > 1 else '1-LV-rural2--0-sw'
+net = sb.get_simbench_net(code)
+
+output_file = current_dir / ('rede_%s.json' % code)
 
 # # # Salvar a rede em JSON
 pp.to_json(net, output_file)
 
-
+index = build_cache(output_file)
+print('%s: %s' % (output_file.name, ', '.join('%d %s' % (len(eids), group)
+                                               for group, eids in index.items())))
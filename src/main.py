@@ -1,7 +1,314 @@
-from scenarios.base_scenario import run_cosimul
+import argparse
 
-def main():
-    run_cosimul()
+from pathlib import Path
+
+import pandas as pd
+
+from scenarios import base_scenario
+from scenarios.base_scenario import resume_cosimul, run_cosimul
+
+
+def timestamp(value):
+    # Aceita datas em qualquer formato reconhecido pelo pandas ('2016-01-02 10:00')
+    try:
+        return pd.Timestamp(value).strftime('%Y-%m-%d %H:%M:%S')
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid date "%s"' % value) from None
+
+
+def parse_params(items):
+    # Converte argumentos 'chave=v1,v2' em {'chave': [v1, v2]}
+    values = {}
+    for item in items or []:
+        key, _, raw = item.partition('=')
+        if not raw:
+            raise argparse.ArgumentTypeError('invalid --param "%s" (expected key=v1,v2)' % item)
+        values[key] = [float(v) for v in raw.split(',')]
+    return values
+
+
+def parse_deadband(items):
+    # Converte argumentos 'atributo=abs[,rel]' em {'atributo': {'abs': ..., 'rel': ...}}
+    if not items:
+        return None
+    deadband = {}
+    for item in items:
+        attr, _, raw = item.partition('=')
+        try:
+            values = [float(v) for v in raw.split(',')]
+        except ValueError:
+            values = []
+        if not 1 <= len(values) <= 2:
+            raise argparse.ArgumentTypeError('invalid --deadband "%s" (expected attr=abs[,rel])'
+                                             % item)
+        deadband[attr] = dict(zip(('abs', 'rel'), values))
+    return deadband
+
+
+def cmd_run(args):
+    # Os argumentos informados na linha de comando substituem os do arquivo de cenário
+    kwargs = {}
+    if args.scenario:
+        from scenarios.scenario_file import load_scenario
+        kwargs = load_scenario(args.scenario)
+    options = {'end': args.end, 'ctrl': args.ctrl, 'start': args.start,
+               'output_file': args.output, 'pv_tolerance': args.pv_tolerance,
+               'ctrl_deadband': parse_deadband(args.deadband), 'ctrl_shards': args.ctrl_shards,
+               'checkpoint_every': args.checkpoint_every, 'checkpoint_dir': args.checkpoint_dir}
+    kwargs.update({key: value for key, value in options.items() if value is not None})
+    if args.night_skip:
+        kwargs['pv_night_skip'] = True
+    if args.fleet_ctrl:
+        kwargs['fleet_ctrl'] = True
+    if args.feeder:
+        kwargs['feeder'] = True
+    if args.pf_report:
+        kwargs['pf_report'] = True
+    if args.pf_inputs:
+        kwargs['pf_inputs'] = True
+    if args.der_table:
+        kwargs['der_table'] = True
+    if args.linear_check:
+        kwargs['linear_pf'] = {'check_every': args.linear_check}
+    elif args.linear_pf:
+        kwargs['linear_pf'] = True
+    if args.cache or args.cache_dir:
+        from scenarios import run_cache
+        kwargs['cache_dir'] = args.cache_dir or run_cache.CACHE_DIR
+        if args.cache_size:
+            kwargs['max_bytes'] = int(args.cache_size * 1024**2)
+        run_cache.cached_cosimul(profile=args.profile or None, profile_dump=args.profile_dump,
+                                 **kwargs)
+    else:
+        run_cosimul(profile=args.profile or None, profile_dump=args.profile_dump, **kwargs)
+
+
+def cmd_resume(args):
+    resume_cosimul(args.checkpoint_dir, end=args.end, profile=args.profile or None,
+                   profile_dump=args.profile_dump)
+
+
+def cmd_sweep(args):
+    from scenarios import sweep
+
+    windows = [(start, int(duration)) for start, duration in args.window or []]
+    if args.days:
+        windows += sweep.daily_windows(args.days[0], int(args.days[1]))
+    if not windows:
+        windows = [(base_scenario.START, base_scenario.END)]
+
+    param_sets = sweep.param_grid(**parse_params(args.param))
+    summary = sweep.run_sweep(args.ctrl, windows, param_sets, args.workers, args.output_dir)
+    print(summary.to_string(index=False))
+
+
+def cmd_chunked(args):
+    from scenarios import chunking
+
+    n_rows = chunking.run_chunked(args.start, args.end, args.ctrl, window=args.window,
+                                  warmup=args.warmup, workers=args.workers,
+                                  output_file=args.output, keep_parts=args.keep_parts)
+    print('%d rows written to %s' % (n_rows, args.output))
+
+
+def cmd_hosting(args):
+    from scenarios import hosting_capacity
+
+    limits = {'vm_min': args.vm_min, 'vm_max': args.vm_max, 'loading_max': args.loading_max}
+    summary = hosting_capacity.run_hosting_capacity(
+        args.ctrl, start=args.start, end=args.end, per_bus=args.per_bus, high=args.high,
+        tol=args.tol, points=args.points, workers=args.workers,
+        limits={key: value for key, value in limits.items() if value is not None},
+        output_file=args.output)
+    print(summary.to_string(index=False))
+
+
+def cmd_montecarlo(args):
+    from scenarios import monte_carlo
+
+    distribution = {'n_min': args.n_min, 'n_max': args.n_max, 'area_min': args.area_min,
+                    'area_max': args.area_max}
+    summary = monte_carlo.run_monte_carlo(
+        args.samples, seed=args.seed, ctrl=args.ctrl, start=args.start, end=args.end,
+        distribution={key: value for key, value in distribution.items() if value is not None},
+        workers=args.workers, output_dir=args.output_dir)
+    print(summary.describe().to_string())
+
+
+def cmd_store(args):
+    from simulators import results_store
+
+    output = args.output or str(Path(args.csv_file).with_suffix('.store'))
+    n_rows = results_store.convert(args.csv_file, output,
+                                   results_store.grid_groups(args.grid_file))
+    print('%d rows written to %s' % (n_rows, output))
+
+
+def cmd_bench(args):
+    from benchmarks import suite
+
+    suite.main(args)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='tsre', description='Co-simulação de GD com mosaik')
+    commands = parser.add_subparsers(dest='command')
+
+    run = commands.add_parser('run', help='executa um cenário')
+    run.add_argument('--scenario', metavar='FILE',
+                     help='arquivo de cenário TOML/YAML (ver scenarios.scenario_file)')
+    run.add_argument('--ctrl', choices=list(base_scenario.CONTROLLERS),
+                     help='controlador (padrão: o definido em sim_config)')
+    run.add_argument('--start', type=timestamp,
+                     help='início da simulação (padrão: %s)' % base_scenario.START)
+    run.add_argument('--end', type=int, help='duração em segundos (padrão: %d)' % base_scenario.END)
+    run.add_argument('--output', help='arquivo de resultados (padrão: src/output/results.csv)')
+    run.add_argument('--night-skip', action='store_true',
+                     help='não executa o simulador FV durante a noite')
+    run.add_argument('--pv-tolerance', type=float, metavar='MW',
+                     help='variação mínima de P_gen para enviar um novo valor')
+    run.add_argument('--fleet-ctrl', action='store_true',
+                     help='uma única entidade controla todos os geradores (variante _batch)')
+    run.add_argument('--feeder', action='store_true',
+                     help='coleta os resultados da rede como vetores de uma entidade Feeder')
+    run.add_argument('--ctrl-shards', type=int, metavar='K',
+                     help='divide os controladores entre K processos executados em paralelo')
+    run.add_argument('--der-table', action='store_true',
+                     help='controladores VV/VW usam uma tabela de respostas do OpenDER')
+    run.add_argument('--deadband', action='append', metavar='ATTR=ABS[,REL]',
+                     help='banda morta de uma saída dos controladores (mod ou pot)')
+    run.add_argument('--pf-inputs', action='store_true',
+                     help='a rede calcula o fluxo de potência também nos passos com setpoints')
+    run.add_argument('--pf-report', action='store_true',
+                     help='imprime quantos fluxos de potência foram calculados ou reaproveitados')
+    run.add_argument('--linear-pf', action='store_true',
+                     help='fluxo de potência linearizado, para estudos de triagem')
+    run.add_argument('--linear-check', type=int, metavar='N',
+                     help='com o fluxo linearizado, compara um a cada N passos com o cálculo completo')
+    run.add_argument('--checkpoint-every', type=int, metavar='S',
+                     help='grava um checkpoint a cada S segundos simulados')
+    run.add_argument('--checkpoint-dir', metavar='DIR',
+                     help='pasta dos checkpoints (padrão: <arquivo de resultados>.ckpt)')
+    run.add_argument('--cache', action='store_true',
+                     help='reaproveita os resultados de execuções com a mesma configuração')
+    run.add_argument('--cache-dir', metavar='DIR',
+                     help='pasta do cache de execuções (padrão: src/output/runcache)')
+    run.add_argument('--cache-size', type=float, metavar='MB',
+                     help='tamanho máximo do cache de execuções (padrão: 2048 MB)')
+    run.add_argument('--profile', action='store_true',
+                     help='mede o tempo de cada simulador e imprime um resumo')
+    run.add_argument('--profile-dump', metavar='FILE', help='grava um perfil cProfile em FILE')
+    run.set_defaults(func=cmd_run)
+
+    resume = commands.add_parser('resume', help='retoma uma execução a partir do último checkpoint')
+    resume.add_argument('checkpoint_dir', metavar='DIR', help='pasta dos checkpoints')
+    resume.add_argument('--end', type=int,
+                        help='duração em segundos (padrão: a da execução original)')
+    resume.add_argument('--profile', action='store_true',
+                        help='mede o tempo de cada simulador e imprime um resumo')
+    resume.add_argument('--profile-dump', metavar='FILE', help='grava um perfil cProfile em FILE')
+    resume.set_defaults(func=cmd_resume)
+
+    sweep = commands.add_parser('sweep', help='executa uma varredura de cenários em paralelo')
+    sweep.add_argument('--ctrl', nargs='+', default=['SEM', 'NO', 'VV', 'VW'],
+                       choices=list(base_scenario.CONTROLLERS), help='controladores')
+    sweep.add_argument('--window', nargs=2, action='append', metavar=('START', 'DURATION'),
+                       help='janela de simulação (pode ser repetido)')
+    sweep.add_argument('--days', nargs=2, metavar=('FIRST_DAY', 'N'),
+                       help='N janelas diárias a partir de FIRST_DAY')
+    sweep.add_argument('--param', action='append', metavar='KEY=V1,V2',
+                       help='valores de um parâmetro FV (produto cartesiano entre parâmetros)')
+    sweep.add_argument('--workers', type=int, help='número de processos (padrão: nº de CPUs)')
+    sweep.add_argument('--output-dir', default=base_scenario.parent_dir / 'output' / 'sweep',
+                       help='pasta dos resultados e do resumo')
+    sweep.set_defaults(func=cmd_sweep)
+
+    chunked = commands.add_parser('chunked', help='executa um período longo em janelas paralelas')
+    chunked.add_argument('--ctrl', choices=list(base_scenario.CONTROLLERS),
+                         help='controlador (padrão: o definido em sim_config)')
+    chunked.add_argument('--start', default=base_scenario.START, type=timestamp,
+                         help='início da simulação')
+    chunked.add_argument('--end', type=int, default=base_scenario.END, help='duração em segundos')
+    chunked.add_argument('--window', type=int, default=24*60*60,
+                         help='duração de cada janela em segundos')
+    chunked.add_argument('--warmup', type=int, default=60*60,
+                         help='aquecimento antes de cada janela em segundos (descartado)')
+    chunked.add_argument('--workers', type=int, help='número de processos (padrão: nº de CPUs)')
+    chunked.add_argument('--output', default=base_scenario.OUTPUT_FILE, help='arquivo de resultados')
+    chunked.add_argument('--keep-parts', action='store_true',
+                         help='mantém os arquivos de cada janela')
+    chunked.set_defaults(func=cmd_chunked)
+
+    from scenarios import hosting_capacity
+    hosting = commands.add_parser('hosting',
+                                  help='busca a capacidade de hospedagem FV de cada controlador')
+    hosting.add_argument('--ctrl', nargs='+', default=['NO', 'VV', 'VW'],
+                         choices=list(base_scenario.CONTROLLERS), help='controladores')
+    hosting.add_argument('--start', default=base_scenario.START, type=timestamp,
+                         help='início da janela avaliada')
+    hosting.add_argument('--end', type=int, default=base_scenario.END,
+                         help='duração da janela em segundos')
+    hosting.add_argument('--per-bus', action='store_true',
+                         help='avalia cada gerador separadamente (os demais sem FV)')
+    hosting.add_argument('--high', type=float, default=hosting_capacity.HIGH, metavar='M2',
+                         help='maior área FV por gerador avaliada')
+    hosting.add_argument('--tol', type=float, default=hosting_capacity.TOLERANCE,
+                         help='precisão relativa da capacidade')
+    hosting.add_argument('--points', type=int,
+                         help='tamanhos simulados em paralelo por rodada de cada busca')
+    hosting.add_argument('--workers', type=int, help='número de processos (padrão: nº de CPUs)')
+    hosting.add_argument('--vm-min', type=float, help='tensão mínima em p.u. (padrão: 0.95)')
+    hosting.add_argument('--vm-max', type=float, help='tensão máxima em p.u. (padrão: 1.05)')
+    hosting.add_argument('--loading-max', type=float,
+                         help='carregamento máximo das linhas em %% (padrão: 100)')
+    hosting.add_argument('--output', default=hosting_capacity.OUTPUT_FILE,
+                         help='arquivo do resumo')
+    hosting.set_defaults(func=cmd_hosting)
+
+    from scenarios import monte_carlo
+    montecarlo = commands.add_parser('montecarlo',
+                                     help='simula alocações e tamanhos FV sorteados')
+    montecarlo.add_argument('--samples', type=int, default=100, help='número de amostras')
+    montecarlo.add_argument('--seed', type=int, default=0, help='semente do sorteio')
+    montecarlo.add_argument('--ctrl', choices=list(base_scenario.CONTROLLERS),
+                            help='controlador (padrão: o definido em sim_config)')
+    montecarlo.add_argument('--start', default=base_scenario.START, type=timestamp,
+                            help='início da simulação')
+    montecarlo.add_argument('--end', type=int, default=base_scenario.END,
+                            help='duração em segundos')
+    montecarlo.add_argument('--n-min', type=int,
+                            help='menor número de geradores com FV (padrão: 1)')
+    montecarlo.add_argument('--n-max', type=int,
+                            help='maior número de geradores com FV (padrão: todos)')
+    montecarlo.add_argument('--area-min', type=float, metavar='M2',
+                            help='menor área FV por gerador (padrão: 1000)')
+    montecarlo.add_argument('--area-max', type=float, metavar='M2',
+                            help='maior área FV por gerador (padrão: 30000)')
+    montecarlo.add_argument('--workers', type=int, help='número de processos (padrão: nº de CPUs)')
+    montecarlo.add_argument('--output-dir', default=monte_carlo.OUTPUT_DIR,
+                            help='pasta do estudo (amostras e configuração)')
+    montecarlo.set_defaults(func=cmd_montecarlo)
+
+    store = commands.add_parser('store', help='converte resultados em CSV para o formato .store')
+    store.add_argument('csv_file', metavar='CSV', help='arquivo de resultados')
+    store.add_argument('--output', help='pasta do resultado (padrão: <CSV>.store)')
+    store.add_argument('--grid-file', default=base_scenario.GRID_FILE,
+                       help='rede dos resultados, que define os grupos das entidades')
+    store.set_defaults(func=cmd_store)
+
+    from benchmarks import suite
+    bench = commands.add_parser('bench', help='mede o desempenho dos simuladores')
+    suite.build_parser(bench)
+    bench.set_defaults(func=cmd_bench)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command is None:
+        run_cosimul()
+    else:
+        args.func(args)
 
 if __name__ == "__main__":
     main()
@@ -1,9 +1,21 @@
 # Importa pacotes necessários
+import importlib.metadata
+import warnings
+
 import mosaik
 from mosaik.util import connect_many_to_one
 
+from contextlib import ExitStack
+from functools import partial
 from pathlib import Path
 
+from scenarios.placement import resolve_placement
+from simulators.checkpoint import Checkpoint, default_directory, load_latest
+from simulators.grid_sim import grid_index, load_net
+from simulators.instrumentation import from_environment
+from simulators.limits import Limits
+from simulators.remote import command
+
 current_dir = Path(__file__).resolve().parent
 parent_dir = current_dir.parent
 
@@ -13,87 +25,331 @@ parent_dir = current_dir.parent
 # - 'controller_des_NO': com GD adicional, sem controle
 # - 'controller_des_VV': com GD adicional, com controle Volt-Var
 # - 'controller_des_VW': com GD adicional, com controle Volt-Watt
+# As mesmas variantes, avaliadas de forma vetorizada para todos os agentes de uma vez
+# (indicado para redes com milhares de GDs), estão em 'controller_batch':
+# - 'simulators.controller_batch:ControllerSEM', '...:ControllerNO',
+#   '...:ControllerVV' e '...:ControllerVW'
 sim_config = {
-    'Grid': {'python': 'mosaik_pandapower.simulator:Pandapower'},
+    'Grid': {'python': 'simulators.grid_sim:Pandapower'},  # mosaik_pandapower com cache da rede
     'CSV': {'python': 'simulators.csv_sim_pandas:CSV'},
     'PV': {'python': 'simulators.pv_simulator:PvAdapter'},
     'Ctrl': {'python': 'simulators.controller_des_SEM:Controller'},
     'Collector': {'python': 'simulators.collector:Collector'},
+    'Limits': {'python': 'simulators.limits:Limits'},  # só com config_cosimul(limits=...)
 }# - 'controller_des_VV': com GD adicional, com controle Volt-Var
 
+# Nomes curtos das variantes de controlador, usados para selecioná-las sem editar
+# o sim_config (por exemplo em config_cosimul(ctrl='VV') ou em 'tsre sweep')
+CONTROLLERS = {
+    'SEM': 'simulators.controller_des_SEM:Controller',
+    'NO': 'simulators.controller_des_NO:Controller',
+    'VV': 'simulators.controller_des_VV:Controller',
+    'VW': 'simulators.controller_des_VW:Controller',
+    'SEM_batch': 'simulators.controller_batch:ControllerSEM',
+    'NO_batch': 'simulators.controller_batch:ControllerNO',
+    'VV_batch': 'simulators.controller_batch:ControllerVV',
+    'VW_batch': 'simulators.controller_batch:ControllerVW',
+}
+
+
+# Versões do mosaik cujo escalonador relê world.until antes de cada passo
+# (mosaik/scheduler.py, sim_process), do que end_run depende; conferir ao atualizar
+# o mosaik (a versão é fixada no pyproject.toml)
+MOSAIK_UNTIL = ('3.2.',)
 
 # Parâmetros da simulação
 END =   1*60*60  # duração da simulação 
 START = '2016-01-01 11:00:00'  # horário de início da simulação
 GRID_FILE = parent_dir / 'data' / 'rede_1-LV-rural2--0-sw.json'  # arquivo da rede elétrica
 PV_DATA = parent_dir / 'data' / 'solar_data_Bremen_minutes.csv'  # dados de irradiância solar
+PV_PARAMS = {'lat': 53.07, 'area': 3e4}  # parâmetros do sistema FV único
+OUTPUT_FILE = parent_dir / 'output' / 'results.csv'  # arquivo de resultados
+
+# Alocação dos geradores fotovoltaicos: índices das barras (na lista de barras da
+# rede) onde estão alocados; outras regras em scenarios.placement
+PLACEMENT = {'rule': 'positions',
+             'positions': [2, 4, 5, 10, 12, 15, 16, 21, 22, 24, 25, 27, 28, 30, 31, 34, 35, 37,
+                           32, 40, 44, 45, 46, 43, 49, 51, 52, 53, 56, 57, 59, 63, 65, 66, 68,
+                           69, 71, 72, 74, 76, 79, 80, 84, 86, 88, 91, 92, 93]}
+
+def fleet_controller(ctrl):
+    # Variante vetorizada do controlador, a única com o modelo FleetCtrl
+    if ctrl is None:
+        ctrl = next(name for name, path in CONTROLLERS.items()
+                    if path == sim_config['Ctrl']['python'])
+    if ctrl in CONTROLLERS and not ctrl.endswith('_batch'):
+        ctrl += '_batch'
+    return ctrl
+
+def controller_class(ctrl=None, fleet_ctrl=False):
+    # Caminho 'modulo:Classe' do controlador escolhido (ver config_cosimul)
+    if fleet_ctrl:
+        ctrl = fleet_controller(ctrl)
+    if ctrl is None:
+        return sim_config['Ctrl']['python']
+    return CONTROLLERS.get(ctrl, ctrl)
+
+def config_cosimul(pv_fleet=None, ctrl=None, start=START, pv_params=None,
+                   output_file=OUTPUT_FILE, mosaik_config=None, pv_night_skip=False,
+                   pv_tolerance=None, ctrl_deadband=None, grid_file=GRID_FILE,
+                   placement=None, fleet_ctrl=False, feeder=False, pf_reuse=True,
+                   pf_report=False, linear_pf=None, der_table=False,
+                   ctrl_shards=1, pf_inputs=False, limits=None) -> mosaik.World:
+    # pv_fleet: parâmetros por barra geradora (lat, area, efficiency, el_tilt, az_tilt,
+    # escalares ou listas com um valor por gerador). Se None, um único sistema FV
+    # alimenta todos os controladores.
+    # ctrl: nome curto (ver CONTROLLERS) ou caminho 'modulo:Classe' do controlador;
+    # se None, usa o definido em sim_config.
+    # pv_params: substitui valores de PV_PARAMS (por exemplo {'area': 1e4}).
+    # mosaik_config: configuração do mosaik, ex.: {'addr': ('127.0.0.1', 5556)} para
+    # executar vários mundos em paralelo.
+    # pv_night_skip: o simulador FV avança sozinho a cada 60 s e pula a noite,
+    # acordando no próximo nascer do sol (a rede e os controladores continuam avançando
+    # a cada minuto, acionados pelas cargas e tensões); pv_tolerance: variação mínima de P_gen [MW]
+    # para que um novo valor seja enviado aos controladores e ao coletor.
+    # ctrl_deadband: banda morta das saídas dos controladores por atributo, ex.:
+    # {'mod': 1e-5, 'pot': {'abs': 1e-5, 'rel': 0.01}} (ver simulators.deadband).
+    # grid_file: arquivo da rede; placement: regra de alocação dos geradores (ver
+    # PLACEMENT e scenarios.placement).
+    # fleet_ctrl: todos os geradores são controlados por uma única entidade FleetCtrl,
+    # ligada a uma entidade GenFleet da rede, com entradas e saídas vetoriais; usa a
+    # variante vetorizada do controlador (ver simulators.controller_batch).
+    # feeder: as tensões e potências das barras e o carregamento das linhas chegam ao
+    # coletor como vetores de uma única entidade Feeder da rede, com as mesmas colunas.
+    # pf_reuse: o fluxo de potência não é recalculado quando as entradas da rede não
+    # mudaram e parte da solução anterior; pf_report: imprime as contagens ao final
+    # (ver simulators.grid_sim).
+    # linear_pf: estudos de triagem com o fluxo de potência linearizado em torno da
+    # última solução completa, True ou {'trust_band': ..., 'check_every': ...} (ver
+    # simulators.linear_pf e grid_sim.LINEAR_PF); como pf_reuse, só atua nos passos em
+    # que a rede calcula o fluxo de potência (ver pf_inputs).
+    # der_table: os controladores VV e VW por agente consultam uma tabela pré-calculada
+    # das respostas do OpenDER em vez de executá-lo em todos os passos; os resultados
+    # diferem dos do OpenDER em até cerca de 1 W/var (ver simulators.der_table).
+    # ctrl_shards: número de processos entre os quais os controladores por agente são
+    # divididos; com mais de um, cada parte roda em um processo iniciado pelo mosaik
+    # (ver simulators.remote) e o mosaik executa os passos das partes em paralelo.
+    # output_file: None não cria o coletor.
+    # pf_inputs: a rede calcula o fluxo de potência também nos passos com entradas
+    # (os setpoints dos controladores); sem ela, os resultados desses passos são os
+    # do último passo sem entradas, como no adaptador original.
+    # limits: interrompe a execução na primeira violação dos limites de tensão e
+    # carregamento, True ou {'vm_max': ..., 'loading_max': ..., 'stop': ...} (ver
+    # simulators.limits); run_cosimul levanta então simulators.limits.LimitViolation.
+    config = dict(sim_config)
+    if fleet_ctrl and ctrl_shards > 1:
+        raise ValueError('ctrl_shards applies to the per-agent controllers, '
+                         'not to fleet_ctrl')
+    ctrl_class = controller_class(ctrl, fleet_ctrl)
+    config['Ctrl'] = {'python': ctrl_class}
+    if ctrl_shards > 1:
+        config['Ctrl'] = {'cmd': command(ctrl_class), 'cwd': str(parent_dir)}
+    pv_params = {**PV_PARAMS, **(pv_params or {})}
+
+    # Geradores escolhidos pela regra de alocação, resolvida sobre as tabelas da rede
+    generators = resolve_placement(load_net(grid_file), placement or PLACEMENT)
 
-def config_cosimul() -> mosaik.World:
     # Cria o "mundo" da simulação com base na configuração dos simuladores
-    world = mosaik.World(sim_config)
+    world = mosaik.World(config, mosaik_config=mosaik_config)
 
     # Inicializa os simuladores
-    gridsim = world.start('Grid', step_size=60, mode='pf_timeseries')  # simulador da rede elétrica
-    DNIdata = world.start('CSV', sim_start=START, datafile=PV_DATA)  # simulador csv
-    pvsim = world.start('PV', start_date=START, gen_neg=False)  # simulador da geração fotovoltaica
-    ctrlsim = world.start('Ctrl', output_delay=5)  # controlador (substituído conforme o cenário)
-    grid = gridsim.Grid(gridfile=GRID_FILE, sim_start=START).children  # elementos da rede elétrica
+    gridsim = world.start('Grid', step_size=60, mode='pf_timeseries',  # simulador da rede elétrica
+                          pf_reuse=pf_reuse, warm_start=pf_reuse, pf_report=pf_report,
+                          linear_pf=linear_pf, pf_inputs=pf_inputs)
+    DNIdata = world.start('CSV', sim_start=start, datafile=PV_DATA)  # simulador csv
+    pvsim = world.start('PV', start_date=start, gen_neg=False,  # simulador da geração fotovoltaica
+                        step_size=60 if pv_night_skip else None,
+                        night_skip=pv_night_skip, tolerance=pv_tolerance)
+    ctrl_params = {'deadband': ctrl_deadband}
+    if ctrl_class in (CONTROLLERS['VV'], CONTROLLERS['VW']):
+        ctrl_params['der_table'] = der_table
+    ctrlsims = [world.start('Ctrl', output_delay=5,  # controlador (substituído conforme o cenário)
+                            **ctrl_params) for _ in range(ctrl_shards)]
+    grid = gridsim.Grid(gridfile=grid_file, sim_start=start).children  # elementos da rede elétrica
     solar_data = DNIdata.Data.create(1)  # entidade de dados solares
-    pv = pvsim.PV(lat=53.07, area=3e4)  # entidade de geração FV 
+    if pv_fleet is None:
+        pv = pvsim.PV(**pv_params)  # entidade de geração FV 
+    else:
+        pv = pvsim.PVFleet(**{'n_panels': len(generators), **pv_fleet})  # um painel por gerador
 
-    # Criação dos 48 controladores para as unidades geradoras
-    controllers = [ctrlsim.Ctrl() for _ in range(48)]
+    # Criação de um controlador para cada unidade geradora, em uma única chamada,
+    # ou de um único controlador para toda a frota
+    if fleet_ctrl:
+        controllers = [ctrlsims[0].FleetCtrl(n_agents=len(generators))]
+        gen_fleet = gridsim.GenFleet(generators=list(generators.gen_eid))
+    else:
+        # Com ctrl_shards > 1, cada processo recebe um bloco contíguo de geradores
+        bounds = [len(generators) * k // ctrl_shards for k in range(ctrl_shards + 1)]
+        controllers = [controller for ctrlsim, first, last in zip(ctrlsims, bounds, bounds[1:])
+                       for controller in ctrlsim.Ctrl.create(last - first)]
 
-    # Filtragem das entidades da rede para facilitar as conexões
-    nodes_gen = [element for element in grid if 'ext_gen' in element.eid]  # geradores externos
-    nodes = [e for e in grid if e.type in 'Bus']  # barras da rede
-    lines = [e for e in grid if e.type in 'Line']  # linhas da rede
-    loads = [e for e in grid if e.type in 'Load']  # cargas
+    # Filtragem das entidades da rede para facilitar as conexões; os índices ficam
+    # guardados no cache da rede (ver simulators.grid_sim)
+    entities = {e.eid: e for e in grid}
+    index = grid_index(grid_file)
+    if index is not None:
+        nodes_gen, nodes, lines, loads = ([entities[eid] for eid in index[group]]
+                                          for group in ('ext_gen', 'Bus', 'Line', 'Load'))
+    else:
+        nodes_gen = [element for element in grid if 'ext_gen' in element.eid]  # geradores externos
+        nodes = [e for e in grid if e.type in 'Bus']  # barras da rede
+        lines = [e for e in grid if e.type in 'Line']  # linhas da rede
+        loads = [e for e in grid if e.type in 'Load']  # cargas
 
     # Conecta a irradiância solar à geração fotovoltaica
     world.connect(solar_data[0], pv, 'DNI')
 
-    # Índices das barras onde estão alocados os geradores fotovoltaicos
-    indices_nodes_gen = [2, 4, 5, 10, 12, 15, 16, 21, 22, 24, 25, 27, 28, 30, 31, 34, 35, 37,
-                        32, 40, 44, 45, 46, 43, 49, 51, 52, 53, 56, 57, 59, 63, 65, 66, 68,
-                        69, 71, 72, 74, 76, 79, 80, 84, 86, 88, 91, 92, 93]
+    # Fonte de potência FV de cada controlador
+    if pv_fleet is None:
+        pv_sources = [pv] * len(generators)
+    else:
+        pv_sources = pv.children
 
-    # Conexão dos controladores aos nós da rede
-    generated_nodes = []
-    for i, idx in enumerate(indices_nodes_gen):
-        # Entrada dos controladores: potência FV e tensão da barra
-        world.connect(pv, controllers[i], ('P_gen', 'p_dc'))
-        world.connect(nodes[idx], controllers[i], ('vm_pu', 'val_in'))
+    if fleet_ctrl:
+        # Frota: vetores de potência FV e tensões entram no controlador, e os vetores
+        # de setpoints voltam à rede em uma única conexão
+        world.connect(pv, controllers[0], ('P_gen', 'p_dc'))
+        world.connect(gen_fleet, controllers[0], ('vm_pu', 'val_in'))
+        world.connect(controllers[0], gen_fleet, ('mod', 'q_mvar'), ('pot', 'p_mw'), weak=True)
+    else:
+        # Conexão dos controladores aos nós da rede
+        generated_nodes = [entities[eid] for eid in generators.gen_eid]
+        generator_buses = [entities[eid] for eid in generators.bus_eid]
+        for pv_source, controller, bus, gen in zip(pv_sources, controllers, generator_buses,
+                                                   generated_nodes):
+            # Entrada dos controladores: potência FV e tensão da barra
+            world.connect(pv_source, controller, ('P_gen', 'p_dc'))
+            world.connect(bus, controller, ('vm_pu', 'val_in'))
 
-        # Saídas dos controladores: potência reativa (q) e ativa (p) para os geradores
-        world.connect(controllers[i], nodes_gen[idx], ('mod', 'q_mvar'), ('pot', 'p_mw'), weak=True)
+            # Saídas dos controladores: potência reativa (q) e ativa (p) para os geradores
+            world.connect(controller, gen, ('mod', 'q_mvar'), ('pot', 'p_mw'), weak=True)
 
-        generated_nodes.append(nodes_gen[idx])
+    bus_ids = [e.full_id for e in nodes]
+    line_ids = [e.full_id for e in lines]
+    if feeder or limits:
+        grid_feeder = gridsim.Feeder()  # vetores da rede inteira
+
+    if limits:
+        # Verificação dos limites de tensão e carregamento em todas as barras e linhas
+        if not importlib.metadata.version('mosaik').startswith(MOSAIK_UNTIL):
+            warnings.warn('end_run was only checked with mosaik %s; with mosaik %s, runs '
+                          'may continue to the end after a limit violation'
+                          % (', '.join(v + 'x' for v in MOSAIK_UNTIL),
+                             importlib.metadata.version('mosaik')))
+        limits_sim = world.start('Limits', end_run=partial(end_run, world),
+                                 **(limits if isinstance(limits, dict) else {}))
+        limits_check = limits_sim.Limits(labels={'vm_pu': bus_ids, 'loading_percent': line_ids})
+        world.connect(grid_feeder, limits_check, 'vm_pu', 'loading_percent')
+
+    if output_file is None:
+        return world
 
     # Inicializa o coletor de dados
-    collector = world.start('Collector', start_date=START, print_results=False)
-    monitor = collector.Monitor()
+    collector = world.start('Collector', start_date=start, output_file=output_file,
+                            print_results=False)
+    # Grupo de cada entidade, pelo qual os resultados em .store são particionados
+    groups = {**dict.fromkeys(bus_ids, 'bus'), **dict.fromkeys(line_ids, 'line'),
+              **dict.fromkeys((e.full_id for e in nodes_gen), 'gen'),
+              **dict.fromkeys((source.full_id for source in pv_sources), 'gen')}
+    if feeder:
+        # Vetores da rede inteira, com colunas nomeadas pelas barras e linhas
+        monitor = collector.Monitor(groups=groups, labels={grid_feeder.full_id: {
+            'vm_pu': bus_ids, 'p_mw': bus_ids, 'loading_percent': line_ids}})
+    else:
+        monitor = collector.Monitor(groups=groups)
 
     # Coleta de dados específicos
-    world.connect(pv, monitor, 'P_gen')  # geração FV total
+    if pv_fleet is None:
+        world.connect(pv, monitor, 'P_gen')  # geração FV total
+    else:
+        connect_many_to_one(world, pv_sources, monitor, 'P_gen')  # geração de cada painel
     world.connect(nodes_gen[14], monitor, 'q_mvar', 'p_mw')  # potência em um dos geradores
     world.connect(nodes[24], monitor, 'p_mw', 'vm_pu', 'q_mvar')  # potência e tensão em uma barra
 
-    # Coleta de dados em todas as linhas: carregamento percentual
-    connect_many_to_one(world, lines, monitor, 'loading_percent')
+    if feeder:
+        # Carregamento de todas as linhas e tensão e potência de todas as barras
+        world.connect(grid_feeder, monitor, 'loading_percent', 'vm_pu', 'p_mw')
+    else:
+        # Coleta de dados em todas as linhas: carregamento percentual
+        connect_many_to_one(world, lines, monitor, 'loading_percent')
 
-    # Coleta de tensão e potência em todas as barras
-    connect_many_to_one(world, nodes, monitor, 'vm_pu')
-    connect_many_to_one(world, nodes, monitor, 'p_mw')
+        # Coleta de tensão e potência em todas as barras
+        connect_many_to_one(world, nodes, monitor, 'vm_pu')
+        connect_many_to_one(world, nodes, monitor, 'p_mw')
 
     return world
 
-def run_cosimul() -> None:
-    
-    world = config_cosimul()
-    
+def end_run(world, time) -> None:
+    # Encerra world.run() depois do passo time, sem exceção no laço do mosaik: cada
+    # simulador termina o seu processo antes do primeiro passo a partir de until.
+    # Depende de o escalonador reler world.until a cada passo, como o do mosaik 3.2
+    # (scheduler.sim_process: "if sim.next_steps[0] >= world.until: break"), e não só
+    # o until recebido por world.run(); se deixar de reler, a execução vai até o fim
+    # e só então levanta a violação (ver MOSAIK_UNTIL)
+    world.until = min(world.until, time + 1)
+
+def limits_error(world):
+    # LimitViolation ou RunStopped que encerrou a execução (ver config_cosimul), ou None
+    for runner in world.sims.values():
+        sim = getattr(runner.proxy, 'sim', None)
+        if isinstance(sim, Limits):
+            return sim.error
+    return None
+
+def run_cosimul(end=END, print_progress=True, profile=None, profile_dump=None,
+                checkpoint_every=None, checkpoint_dir=None, resume=None, **kwargs) -> None:
+    # profile: mede o tempo de step/get_data de cada simulador e imprime um resumo;
+    # profile_dump: grava também um perfil cProfile neste arquivo. Se não forem
+    # informados, valem as variáveis de ambiente TSRE_PROFILE e TSRE_PROFILE_DUMP.
+    # checkpoint_every: grava o estado da simulação a cada checkpoint_every segundos
+    # simulados em checkpoint_dir (padrão: pasta '.ckpt' ao lado do arquivo de
+    # resultados), de onde resume_cosimul retoma a execução; resume: checkpoint a
+    # partir do qual a execução continua (ver simulators.checkpoint).
+    # Os demais argumentos (ctrl, start, pv_params, ...) são repassados a config_cosimul
+    world = config_cosimul(**kwargs)
+    instrumentation = from_environment(world.sim_config, profile, profile_dump)
+    checkpoint = None
+    if checkpoint_every:
+        checkpoint = Checkpoint(world, checkpoint_dir or default_directory(
+                                    kwargs.get('output_file', OUTPUT_FILE)),
+                                checkpoint_every, meta={'end': end, 'kwargs': kwargs})
+        if resume is not None:
+            checkpoint.restore(resume)
+
     # Executa a simulação
-    world.run(until=END, print_progress=True)
+    with ExitStack() as stack:
+        if instrumentation is not None:
+            stack.enter_context(instrumentation)
+        if checkpoint is not None:
+            stack.enter_context(checkpoint)
+        world.run(until=end, print_progress=print_progress)
+
+    # A execução interrompida pelos limites (ver config_cosimul) termina normalmente
+    # no mosaik; a violação é levantada aqui
+    error = limits_error(world)
+    if error is not None:
+        raise error
+
+
+def resume_cosimul(checkpoint_dir, end=None, **kwargs) -> None:
+    # Retoma a execução interrompida a partir do último checkpoint de checkpoint_dir,
+    # com os argumentos da execução original; end permite estender a duração.
+    # Os demais argumentos (print_progress, profile, ...) são repassados a run_cosimul;
+    # os do cenário gravados com o checkpoint só podem ser repetidos, não alterados,
+    # pois o estado restaurado é o do cenário original.
+    data = load_latest(checkpoint_dir)
+    changed = sorted(key for key, value in kwargs.items()
+                     if key in data['kwargs'] and value != data['kwargs'][key])
+    if changed:
+        raise ValueError('Cannot change %s when resuming: the checkpoint holds the state '
+                         'of the original run' % ', '.join(changed))
+    end = data['end'] if end is None else end
+    if end <= data['time']:
+        raise ValueError('The checkpoint is at %d s, after the end of the run (%d s)'
+                         % (data['time'], end))
+    print('Resuming from the checkpoint at %d s of %d s' % (data['time'], end))
+    run_cosimul(end=end, checkpoint_every=data['every'], checkpoint_dir=checkpoint_dir,
+                resume=data, **{**data['kwargs'], **kwargs})
 
 
 if __name__ == "__main__":
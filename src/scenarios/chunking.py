@@ -0,0 +1,93 @@
+# Execução em janelas: divide um horizonte longo em janelas simuladas em paralelo
+# e junta os resultados em um único arquivo.
+#
+# Cada janela começa 'warmup' segundos antes do seu início efetivo, para que os
+# estados internos (suavização da potência reativa e rampa de potência dos
+# controladores, modos dos sistemas FV) atinjam o regime antes do período que é
+# mantido. As linhas do aquecimento são descartadas na junção.
+#
+# Observação: o adaptador do pandapower só executa o fluxo de potência em
+# 'pf_timeseries' nos passos sem entradas, e os controladores enviam entradas a
+# cada passo. Assim, os resultados da rede são os do primeiro passo de cada
+# execução, e na execução em janelas são recalculados no início de cada janela.
+import shutil
+
+from pathlib import Path
+
+import pandas as pd
+
+from scenarios import base_scenario
+from scenarios.sweep import run_jobs
+
+WINDOW = 24*60*60  # duração de cada janela (um dia)
+WARMUP = 60*60  # sobreposição de aquecimento antes de cada janela
+
+
+def make_windows(start, end, window=WINDOW, warmup=WARMUP) -> list:
+    # Divide [start, start + end) em janelas de 'window' segundos.
+    # Retorna tuplas (início da execução, duração da execução, início mantido)
+    start = pd.Timestamp(start)
+    windows = []
+    for offset in range(0, end, window):
+        keep_from = start + pd.Timedelta(seconds=offset)
+        run_start = max(start, keep_from - pd.Timedelta(seconds=warmup))
+        duration = int((keep_from - run_start).total_seconds()) + min(window, end - offset)
+        windows.append((run_start, duration, keep_from))
+    return windows
+
+
+def make_chunk_jobs(windows, ctrl, pv_params, parts_dir) -> list:
+    jobs = []
+    for k, (run_start, duration, keep_from) in enumerate(windows):
+        jobs.append({
+            'name': 'part_%04d' % k,
+            'ctrl': ctrl,
+            'start': run_start.strftime('%Y-%m-%d %H:%M:%S'),
+            'end': duration,
+            'pv_params': dict(pv_params or {}),
+            'output_file': str(Path(parts_dir) / ('part_%04d.csv' % k)),
+            'keep_from': keep_from,
+        })
+    return jobs
+
+
+def stitch(jobs, output_file) -> int:
+    # Junta os arquivos das janelas, sem as linhas de aquecimento, uma janela por vez
+    n_rows = 0
+    columns = None
+    for k, job in enumerate(jobs):
+        df = pd.read_csv(job['output_file'], index_col=0, parse_dates=True)
+        df = df[df.index >= job['keep_from']]
+        if columns is None:
+            columns = df.columns
+        elif not df.columns.equals(columns):
+            df = df.reindex(columns=columns)
+        df.to_csv(output_file, mode='w' if k == 0 else 'a', header=k == 0)
+        n_rows += len(df)
+    return n_rows
+
+
+def run_chunked(start=base_scenario.START, end=base_scenario.END, ctrl=None, pv_params=None,
+                window=WINDOW, warmup=WARMUP, workers=None,
+                output_file=base_scenario.OUTPUT_FILE, keep_parts=False) -> int:
+    # Executa o horizonte [start, start + end) em janelas paralelas e grava o
+    # resultado contínuo em output_file. Retorna o número de linhas gravadas.
+    output_file = Path(output_file)
+    parts_dir = output_file.with_name(output_file.stem + '.parts')
+    parts_dir.mkdir(parents=True, exist_ok=True)
+
+    windows = make_windows(start, end, window, warmup)
+    jobs = make_chunk_jobs(windows, ctrl, pv_params, parts_dir)
+    rows = run_jobs(jobs, workers)
+
+    failed = [row for row in rows if row['error']]
+    if failed:
+        raise RuntimeError('%d of %d windows failed: %s'
+                           % (len(failed), len(jobs),
+                              '; '.join('%s (%s)' % (row['start'], row['error'])
+                                        for row in failed)))
+
+    n_rows = stitch(jobs, output_file)
+    if not keep_parts:
+        shutil.rmtree(parts_dir)
+    return n_rows
@@ -0,0 +1,211 @@
+# Capacidade de hospedagem: maior tamanho dos sistemas FV (área por gerador, como
+# em PV_PARAMS['area']) que a rede recebe sem violar os limites de tensão e de
+# carregamento (ver simulators.limits), para cada variante de controlador.
+#
+# A busca é uma bisseção em paralelo. A primeira rodada simula 'points' tamanhos
+# até o limite superior 'high', ao mesmo tempo; as seguintes dividem o intervalo
+# entre o maior tamanho viável e o menor inviável em points + 1 partes, até que ele
+# fique menor que 'tol' (relativo). Cada execução para na primeira violação, e uma
+# execução cujo tamanho não é menor que um tamanho já inviável da mesma busca é
+# interrompida (supõe-se que as violações só aumentam com o tamanho).
+#
+# Com per_bus, cada gerador é avaliado separadamente: o seu tamanho varia e os demais
+# ficam com o tamanho 'others' (por padrão, zero). As execuções usam pf_inputs, para
+# que a rede calcule o fluxo de potência com os setpoints dos controladores.
+import math
+import os
+import time
+import traceback
+
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import Manager
+from pathlib import Path
+
+import pandas as pd
+
+from scenarios import base_scenario
+from scenarios.placement import resolve_placement
+from scenarios.sweep import free_port
+from simulators.grid_sim import load_net
+from simulators.limits import LIMITS, LimitViolation, RunStopped
+
+HIGH = 3e5  # maior tamanho avaliado (m² por gerador)
+TOLERANCE = 0.02  # largura final do intervalo, relativa ao seu limite superior
+OUTPUT_FILE = base_scenario.parent_dir / 'output' / 'hosting_capacity.csv'
+
+
+class Search:
+    # Intervalo da capacidade de uma busca (controlador e, com per_bus, gerador)
+
+    def __init__(self, name, ctrl, low=0., high=HIGH, tol=TOLERANCE, generator=None, bus=None):
+        self.name = name
+        self.ctrl = ctrl
+        self.generator = generator
+        self.bus = bus
+        self.low = low  # maior tamanho viável (o limite inferior é suposto viável)
+        self.high = high  # menor tamanho inviável, ou o limite superior
+        self.tol = tol
+        self.bounded = False  # algum tamanho violou os limites
+        self.violation = None  # violação no menor tamanho inviável
+        self.round = 0
+        self.pending = 0
+        self.runs = 0
+        self.pruned = 0
+        self.runtime_s = 0.
+        self.error = ''
+
+    @property
+    def done(self):
+        if self.pending:
+            return False
+        if self.error or (self.round and not self.bounded):
+            return True
+        return self.bounded and self.high - self.low <= self.tol * self.high
+
+    def next_round(self, points) -> list:
+        # Tamanhos da próxima rodada; a primeira inclui o limite superior
+        last = points if self.round == 0 else points + 1
+        sizes = [self.low + (self.high - self.low) * i / last for i in range(1, points + 1)]
+        self.round += 1
+        self.pending = len(sizes)
+        return sizes
+
+    def update(self, row):
+        self.pending -= 1
+        self.runs += 1
+        self.runtime_s += row['runtime_s']
+        if row['error']:
+            self.error = row['error']
+        elif row['pruned']:
+            self.pruned += 1
+        elif row['feasible']:
+            if row['size'] < self.high or not self.bounded:
+                self.low = max(self.low, row['size'])
+        elif row['size'] < self.high or not self.bounded:
+            self.high = row['size']
+            self.bounded = True
+            self.violation = row['violation']
+
+    def summary(self) -> dict:
+        violation = self.violation or {}
+        return {
+            'ctrl': self.ctrl,
+            'generator': self.generator,
+            'bus': self.bus,
+            'capacity_m2': self.low,
+            'first_violation_m2': self.high if self.bounded else None,
+            'constraint': violation.get('constraint'),
+            'element': violation.get('element'),
+            'value': violation.get('value'),
+            'time_s': violation.get('time'),
+            'runs': self.runs,
+            'pruned': self.pruned,
+            'runtime_s': self.runtime_s,
+            'error': self.error,
+        }
+
+
+def run_candidate(job) -> dict:
+    # Executa um tamanho de uma busca (no processo de um worker) até o fim da janela,
+    # até a primeira violação ou até que um tamanho menor da busca se mostre inviável
+    cutoffs, name, size = job['cutoffs'], job['search'], job['size']
+
+    def stop(time):
+        return cutoffs.get(name, math.inf) <= size
+
+    row = {'search': name, 'size': size, 'feasible': False, 'violation': None,
+           'pruned': False, 'error': ''}
+    t0 = time.perf_counter()
+    try:
+        base_scenario.run_cosimul(end=job['end'], print_progress=False, output_file=None,
+                                  pf_inputs=True, limits=dict(job['limits'], stop=stop),
+                                  mosaik_config={'addr': ('127.0.0.1', free_port())},
+                                  **job['kwargs'])
+        row['feasible'] = True
+    except LimitViolation as e:
+        row['violation'] = {'constraint': e.constraint, 'element': e.element,
+                            'value': e.value, 'time': e.time}
+    except RunStopped:
+        row['pruned'] = True
+    except Exception:
+        row['error'] = traceback.format_exc(limit=1).strip().splitlines()[-1]
+    row['runtime_s'] = time.perf_counter() - t0
+    return row
+
+
+def make_searches(ctrls, per_bus=False, generators=None, low=0., high=HIGH,
+                  tol=TOLERANCE) -> list:
+    if not per_bus:
+        return [Search(ctrl, ctrl, low, high, tol) for ctrl in ctrls]
+    return [Search('%s/%s' % (ctrl, bus), ctrl, low, high, tol, generator=k, bus=bus)
+            for ctrl in ctrls for k, bus in enumerate(generators.bus_eid)]
+
+
+def candidate_kwargs(search, size, n_generators, start, pv_params, others, **kwargs) -> dict:
+    # Argumentos de config_cosimul de um tamanho da busca
+    pv_params = {**base_scenario.PV_PARAMS, **(pv_params or {})}
+    kwargs = dict(kwargs, ctrl=search.ctrl, start=start)
+    if search.generator is None:
+        kwargs['pv_params'] = dict(pv_params, area=size)
+    else:
+        areas = [others] * n_generators
+        areas[search.generator] = size
+        kwargs['pv_fleet'] = dict(pv_params, area=areas)
+    return kwargs
+
+
+def run_hosting_capacity(ctrls, start=base_scenario.START, end=base_scenario.END, per_bus=False,
+                         low=0., high=HIGH, tol=TOLERANCE, points=None, workers=None,
+                         limits=None, pv_params=None, others=0., placement=None,
+                         grid_file=base_scenario.GRID_FILE,
+                         output_file=OUTPUT_FILE) -> pd.DataFrame:
+    # Capacidade de hospedagem de cada controlador (e gerador, com per_bus) na janela
+    # [start, start + end). points: tamanhos simulados por rodada de cada busca (padrão:
+    # os workers divididos entre as buscas). Grava o resumo em output_file e o retorna.
+    workers = workers or os.cpu_count() or 1
+    limits = dict(LIMITS, **(limits or {}))
+    generators = resolve_placement(load_net(grid_file), placement or base_scenario.PLACEMENT)
+    searches = make_searches(ctrls, per_bus, generators, low, high, tol)
+    points = points or max(1, -(-workers // len(searches)))
+
+    with Manager() as manager, ProcessPoolExecutor(max_workers=workers) as pool:
+        cutoffs = manager.dict()  # busca -> menor tamanho inviável
+        futures = {}
+
+        def submit(search):
+            for size in search.next_round(points):
+                kwargs = candidate_kwargs(search, size, len(generators), start, pv_params,
+                                          others, placement=placement, grid_file=grid_file)
+                job = {'search': search.name, 'size': size, 'end': end, 'limits': limits,
+                       'cutoffs': cutoffs, 'kwargs': kwargs}
+                futures[pool.submit(run_candidate, job)] = search
+
+        for search in searches:
+            submit(search)
+        while futures:
+            finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in finished:
+                search = futures.pop(future)
+                row = future.result()
+                search.update(row)
+                if search.bounded:
+                    cutoffs[search.name] = search.high
+                if row['error']:
+                    status = 'ERRO: %s' % row['error']
+                elif row['pruned']:
+                    status = 'interrompida'
+                elif row['feasible']:
+                    status = 'ok'
+                else:
+                    status = '%(constraint)s em %(element)s (t = %(time)d s)' % row['violation']
+                print('%s: %.4g m² (%.1f s) %s' % (search.name, row['size'], row['runtime_s'],
+                                                   status))
+                if not search.pending and not search.done:
+                    submit(search)
+
+    summary = pd.DataFrame([search.summary() for search in searches])
+    if not per_bus:
+        summary = summary.drop(columns=['generator', 'bus'])
+    Path(output_file).parent.mkdir(parents=True, exist_ok=True)
+    summary.to_csv(output_file, index=False)
+    return summary
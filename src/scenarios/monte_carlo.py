@@ -0,0 +1,207 @@
+# Estudos de Monte Carlo da alocação dos geradores distribuídos: cada amostra sorteia
+# quantos e quais geradores virtuais (ext_gen, ver scenarios.placement) recebem um
+# sistema FV e a área de cada um, e é simulada com um controlador por gerador.
+#
+# O sorteio de cada amostra usa um gerador aleatório criado a partir da semente e do
+# número da amostra, de modo que a amostra k é a mesma em qualquer execução, com
+# qualquer número de processos e em qualquer ordem. Distribuição (DISTRIBUTION):
+#
+#   n_min, n_max          número de geradores com FV, uniforme entre os dois
+#                         (n_max None: todos os candidatos)
+#   area_min, area_max    área FV de cada gerador em m², uniforme entre as duas
+#
+# Os candidatos são os geradores escolhidos por uma regra de alocação (por padrão,
+# todos). As amostras são executadas em um pool de processos; cada processo carrega
+# a rede uma única vez (grid_sim.preload) e os dados de irradiância são lidos por
+# mapeamento de memória (ver simulators.csv_sim_pandas). O resumo de cada amostra
+# (sweep.summarize) é acrescentado a samples.csv assim que ela termina; executar o
+# mesmo estudo novamente na mesma pasta simula apenas as amostras que faltam.
+import gc
+import json
+import os
+import tempfile
+import time
+import traceback
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from scenarios import base_scenario
+from scenarios.placement import generator_table, resolve_placement
+from scenarios.sweep import free_port, summarize
+from simulators.grid_sim import file_hash, load_net, preload
+
+DISTRIBUTION = {'n_min': 1, 'n_max': None, 'area_min': 1e3, 'area_max': 3e4}
+OUTPUT_DIR = base_scenario.parent_dir / 'output' / 'monte_carlo'
+SAMPLES_FILE = 'samples.csv'
+CONFIG_FILE = 'config.json'
+
+COLUMNS = ['sample', 'n_generators', 'total_area_m2', 'positions', 'areas_m2', 'steps',
+           'vm_pu_max', 'vm_pu_min', 'loading_percent_max', 'pv_energy_mwh', 'error',
+           'runtime_s']
+
+
+def candidate_positions(net, candidates=None) -> np.ndarray:
+    # Posições, na lista de geradores da rede, dos geradores escolhidos pela regra
+    # 'candidates'; são as posições da regra 'positions' de scenarios.placement
+    table = generator_table(net)
+    chosen = resolve_placement(net, candidates or {'rule': 'all'})
+    return np.flatnonzero(table.gen_eid.isin(chosen.gen_eid).to_numpy())
+
+
+def check_distribution(distribution, n_candidates) -> dict:
+    distribution = dict(DISTRIBUTION, **(distribution or {}))
+    unknown = set(distribution) - set(DISTRIBUTION)
+    if unknown:
+        raise ValueError('Unknown distribution keys: %s' % ', '.join(sorted(unknown)))
+    if distribution['n_max'] is None:
+        distribution['n_max'] = n_candidates
+    if not 1 <= distribution['n_min'] <= distribution['n_max'] <= n_candidates:
+        raise ValueError('Need 1 <= n_min <= n_max <= %d (the number of candidate generators)'
+                         % n_candidates)
+    if not 0 <= distribution['area_min'] <= distribution['area_max']:
+        raise ValueError('Need 0 <= area_min <= area_max')
+    return distribution
+
+
+def draw_sample(seed, sample, candidates, distribution) -> dict:
+    # Alocação e áreas da amostra 'sample', determinadas só pela semente e pelo número
+    rng = np.random.default_rng([seed, sample])
+    n = int(rng.integers(distribution['n_min'], distribution['n_max'] + 1))
+    positions = np.sort(rng.choice(candidates, size=n, replace=False))
+    areas = rng.uniform(distribution['area_min'], distribution['area_max'], size=n)
+    return {'sample': sample, 'positions': positions.tolist(), 'areas': areas.tolist()}
+
+
+def init_worker(grid_file):
+    # Executado uma vez em cada processo do pool
+    preload(grid_file)
+
+
+def run_sample(job) -> dict:
+    # Executa uma amostra (no processo de um worker) e resume os seus resultados
+    row = {
+        'sample': job['sample'],
+        'n_generators': len(job['positions']),
+        'total_area_m2': sum(job['areas']),
+        'positions': ' '.join(str(position) for position in job['positions']),
+        'areas_m2': ' '.join('%.2f' % area for area in job['areas']),
+    }
+    t0 = time.perf_counter()
+    fd, output_file = tempfile.mkstemp(prefix='sample_', suffix='.csv', dir=job['output_dir'])
+    os.close(fd)
+    try:
+        base_scenario.run_cosimul(end=job['end'], print_progress=False, ctrl=job['ctrl'],
+                                  start=job['start'], grid_file=job['grid_file'],
+                                  placement={'rule': 'positions', 'positions': job['positions']},
+                                  pv_fleet=dict(job['pv_params'], area=job['areas']),
+                                  pf_inputs=True, output_file=output_file,
+                                  mosaik_config={'addr': ('127.0.0.1', free_port())})
+        row.update(summarize(output_file))
+        row['error'] = ''
+    except Exception:
+        row['error'] = traceback.format_exc(limit=1).strip().splitlines()[-1]
+    finally:
+        os.remove(output_file)
+        # O mundo do mosaik e os simuladores formam ciclos; sem a coleta, a memória
+        # de várias amostras se acumula no worker até a próxima coleta completa
+        gc.collect()
+    row['runtime_s'] = time.perf_counter() - t0
+    return row
+
+
+def study_config(seed, ctrl, start, end, distribution, candidates, pv_params,
+                 grid_file) -> dict:
+    # Tudo o que determina as amostras e os seus resultados, exceto o número de amostras
+    return {
+        'seed': seed,
+        'ctrl': base_scenario.controller_class(ctrl),
+        'start': pd.Timestamp(start).strftime('%Y-%m-%d %H:%M:%S'),
+        'end': end,
+        'distribution': distribution,
+        'candidates': candidates or {'rule': 'all'},
+        'pv_params': pv_params,
+        'grid_file': file_hash(grid_file),
+    }
+
+
+def check_config(output_dir, config):
+    # Grava a configuração do estudo ou verifica se é a das amostras já gravadas
+    path = Path(output_dir) / CONFIG_FILE
+    config = json.loads(json.dumps(config, default=str))
+    if path.exists():
+        with open(path) as f:
+            if json.load(f) != config:
+                raise ValueError('%s holds samples of a different study; use another '
+                                 'output directory' % output_dir)
+    else:
+        with open(path, 'w') as f:
+            json.dump(config, f, indent=1, sort_keys=True)
+
+
+def done_samples(samples_file) -> set:
+    # Amostras já gravadas sem erro (as com erro são executadas novamente); uma linha
+    # incompleta (execução interrompida durante a escrita) é descartada
+    path = Path(samples_file)
+    if not path.exists() or path.stat().st_size == 0:
+        return set()
+    with open(path, 'rb+') as f:
+        data = f.read()
+        if not data.endswith(b'\n'):
+            f.truncate(data.rfind(b'\n') + 1)
+    try:
+        rows = pd.read_csv(path, usecols=['sample', 'error'])
+    except pd.errors.EmptyDataError:
+        return set()
+    return set(rows['sample'][rows['error'].isna()])
+
+
+def run_monte_carlo(n_samples, seed=0, ctrl=None, start=base_scenario.START,
+                    end=base_scenario.END, distribution=None, candidates=None, pv_params=None,
+                    workers=None, grid_file=base_scenario.GRID_FILE,
+                    output_dir=OUTPUT_DIR) -> pd.DataFrame:
+    # Executa as amostras 0 a n_samples - 1 que ainda não estão em output_dir e
+    # retorna o resumo de todas, ordenado pelo número da amostra.
+    # candidates: regra de alocação dos geradores que podem receber FV (ver
+    # scenarios.placement); pv_params: demais parâmetros FV (ver PV_PARAMS).
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    grid_file = str(grid_file)
+    candidate_list = candidate_positions(load_net(grid_file), candidates)
+    distribution = check_distribution(distribution, len(candidate_list))
+    pv_params = {**base_scenario.PV_PARAMS, **(pv_params or {})}
+    pv_params.pop('area')  # sorteada por gerador
+    check_config(output_dir, study_config(seed, ctrl, start, end, distribution, candidates,
+                                          pv_params, grid_file))
+
+    samples_file = output_dir / SAMPLES_FILE
+    done = done_samples(samples_file)
+    jobs = [dict(draw_sample(seed, sample, candidate_list, distribution), ctrl=ctrl,
+                 start=start, end=end, pv_params=pv_params, grid_file=grid_file,
+                 output_dir=str(output_dir))
+            for sample in range(n_samples) if sample not in done]
+    print('Monte Carlo: %d of %d samples done, %d to run'
+          % (n_samples - len(jobs), n_samples, len(jobs)))
+
+    if jobs:
+        workers = min(workers or os.cpu_count() or 1, len(jobs))
+        with open(samples_file, 'a', newline='') as f, \
+                ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                    initargs=(grid_file,)) as pool:
+            futures = [pool.submit(run_sample, job) for job in jobs]
+            for k, future in enumerate(as_completed(futures), 1):
+                row = future.result()
+                f.write(pd.DataFrame([row], columns=COLUMNS).to_csv(header=f.tell() == 0,
+                                                                     index=False))
+                f.flush()
+                status = 'ERRO: %s' % row['error'] if row['error'] else 'ok'
+                print('[%d/%d] amostra %d, %d geradores (%.1f s) %s'
+                      % (k, len(jobs), row['sample'], row['n_generators'], row['runtime_s'],
+                         status))
+
+    summary = pd.read_csv(samples_file).drop_duplicates('sample', keep='last')
+    summary = summary[summary['sample'] < n_samples]
+    return summary.sort_values('sample', ignore_index=True)
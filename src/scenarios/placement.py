@@ -0,0 +1,85 @@
+# Alocação dos geradores distribuídos na rede a partir de regras sobre as tabelas
+# do pandapower.
+#
+# O mosaik_pandapower cria um gerador virtual ('ext_gen_at_bus-<barra>') em cada
+# barra exceto a de referência; a alocação escolhe quais desses geradores recebem
+# um sistema FV e um controlador. As regras são avaliadas com filtros vetorizados
+# do pandas, de modo que redes com milhares de barras são resolvidas em milissegundos:
+#
+#   {'rule': 'all'}                                  todas as barras
+#   {'rule': 'every_nth', 'n': 2, 'offset': 0}       uma a cada n barras
+#   {'rule': 'load_class', 'profiles': ['H0-*']}     barras com cargas desses perfis
+#   {'rule': 'positions', 'positions': [2, 4, 5]}    posições na lista de geradores
+#
+# As barras seguem a ordem das entidades 'Bus'/'ext_gen' da rede (nomes ordenados),
+# a mesma de grid_index, de modo que 'positions' usa os índices de base_scenario.
+import fnmatch
+
+import pandas as pd
+
+EXT_GEN_PREFIX = 'ext_gen_at_bus-'
+
+RULES = {
+    'all': (),
+    'every_nth': ('n', 'offset'),
+    'load_class': ('profiles',),
+    'positions': ('positions',),
+}
+
+
+def generator_table(net, grid_idx=0) -> pd.DataFrame:
+    # Um gerador virtual por barra, com os IDs das entidades do mosaik da barra e
+    # do gerador, na ordem das entidades da rede
+    sgen = net.sgen[net.sgen.name.str.startswith(EXT_GEN_PREFIX, na=False)]
+    bus_names = net.bus.name.loc[sgen.bus].to_numpy()
+    prefix = '%s-' % grid_idx
+    table = pd.DataFrame({
+        'bus': sgen.bus.to_numpy(),
+        'bus_eid': prefix + pd.Series(bus_names, dtype=str),
+        'gen_eid': prefix + sgen.name.reset_index(drop=True),
+    })
+    return table.sort_values('gen_eid', ignore_index=True)
+
+
+def load_class_buses(net, profiles) -> pd.Index:
+    # Barras com pelo menos uma carga cujo perfil corresponde a um dos padrões
+    # ('H0-*', 'G?-A', ...); as cargas virtuais do adaptador não têm perfil
+    if isinstance(profiles, str):
+        profiles = [profiles]
+    pattern = '|'.join(fnmatch.translate(p) for p in profiles)
+    if 'profile' not in net.load or not pattern:
+        return pd.Index([])
+    mask = net.load.profile.astype(str).str.match(pattern) & net.load.profile.notna()
+    return pd.Index(net.load.bus[mask].unique())
+
+
+def resolve_placement(net, placement, grid_idx=0) -> pd.DataFrame:
+    # Linhas de generator_table dos geradores escolhidos pela regra 'placement'
+    placement = dict(placement)
+    rule = placement.pop('rule', 'all')
+    if rule not in RULES:
+        raise ValueError('Unknown placement rule "%s" (expected one of %s)'
+                         % (rule, ', '.join(RULES)))
+    unknown = set(placement) - set(RULES[rule])
+    if unknown:
+        raise ValueError('Unknown keys for placement rule "%s": %s'
+                         % (rule, ', '.join(sorted(unknown))))
+
+    table = generator_table(net, grid_idx)
+    if rule == 'every_nth':
+        n = int(placement.get('n', 1))
+        if n < 1:
+            raise ValueError('Placement rule "every_nth" needs n >= 1')
+        table = table.iloc[int(placement.get('offset', 0))::n]
+    elif rule == 'load_class':
+        table = table[table.bus.isin(load_class_buses(net, placement.get('profiles', [])))]
+    elif rule == 'positions':
+        positions = list(placement.get('positions', []))
+        if positions and not -len(table) <= min(positions) <= max(positions) < len(table):
+            raise ValueError('Placement positions out of range (the grid has %d generators)'
+                             % len(table))
+        table = table.iloc[positions]
+
+    if table.empty:
+        raise ValueError('Placement rule "%s" selects no generator' % rule)
+    return table.reset_index(drop=True)
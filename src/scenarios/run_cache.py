@@ -0,0 +1,299 @@
+# Cache de execuções: guarda os resultados de run_cosimul identificados por um hash
+# da configuração completa, para que execuções repetidas (por exemplo, para refazer
+# gráficos) não simulem novamente.
+#
+# A chave (run_key) combina o sim_config efetivo, todos os argumentos de
+# config_cosimul (com os valores padrão), o conteúdo da rede e dos dados de
+# irradiância, o código dos simuladores (controladores inclusive) e do cenário e as
+# versões das bibliotecas. O início faz parte da chave, mas o fim não: os resultados
+# de cada chave são guardados num segmento [início, fim) de datas absolutas, em
+# <pasta do cache>/<chave>/. Como a co-simulação não depende do fim, as linhas de
+# [início, t) de uma execução até fim > t são as mesmas de uma execução até t, e um
+# pedido contido no segmento é lido dele.
+#
+# Junto de cada segmento fica um checkpoint (simulators.checkpoint) do estado da
+# simulação no fim dele (<segmento>.ckpt). Um pedido mais longo que o segmento
+# retoma a execução desse checkpoint e simula apenas [fim do segmento, fim do
+# pedido), com os mesmos resultados de uma execução contínua; as linhas novas são
+# acrescentadas ao segmento, que passa a terminar no fim do pedido. Sem checkpoint
+# (por exemplo com ctrl_shards > 1, cujos controladores rodam em outros processos),
+# o período pedido é simulado por inteiro.
+#
+# O tamanho total do cache é limitado a max_bytes: os segmentos usados há mais tempo
+# (data de modificação, atualizada a cada leitura) são removidos.
+import hashlib
+import importlib.metadata
+import inspect
+import json
+import os
+import pickle
+import tempfile
+
+from pathlib import Path
+
+import pandas as pd
+
+from scenarios import base_scenario
+from scenarios.sweep import free_port
+from simulators.checkpoint import checkpoint_files, load
+from simulators.grid_sim import file_hash
+from simulators.results_store import column_groups, grid_groups
+from simulators.writers import make_writer
+
+CACHE_DIR = base_scenario.parent_dir / 'output' / 'runcache'
+MAX_BYTES = 2 * 1024**3  # tamanho máximo do cache (2 GB)
+CACHE_VERSION = 3
+STEP = 60  # passo dos resultados em segundos
+
+# Código que determina os resultados: todos os simuladores e o cenário
+SOURCES = (sorted((base_scenario.parent_dir / 'simulators').glob('*.py'))
+           + [base_scenario.current_dir / 'base_scenario.py',
+              base_scenario.current_dir / 'placement.py'])
+LIBRARIES = ('mosaik', 'mosaik-api-v3', 'mosaik-pandapower', 'pandapower', 'opender',
+             'numpy', 'pandas')
+
+# Argumentos de config_cosimul que não alteram os resultados
+UNKEYED = ('output_file', 'mosaik_config', 'pf_report', 'ctrl_shards')
+
+DATE_FORMAT = '%Y%m%dT%H%M%S'
+
+
+def library_version(name):
+    try:
+        return importlib.metadata.version(name)
+    except importlib.metadata.PackageNotFoundError:
+        return None
+
+
+def run_config(start=base_scenario.START, **kwargs) -> dict:
+    # Tudo o que determina os resultados de config_cosimul(start=start, **kwargs),
+    # exceto o fim
+    params = inspect.signature(base_scenario.config_cosimul).bind(start=start, **kwargs)
+    params.apply_defaults()
+    params = dict(params.arguments)
+    for key in UNKEYED:
+        params.pop(key)
+    start = pd.Timestamp(params.pop('start'))
+    ctrl = base_scenario.controller_class(params.pop('ctrl'), params['fleet_ctrl'])
+    grid_file = params.pop('grid_file')
+    params['pv_params'] = {**base_scenario.PV_PARAMS, **(params['pv_params'] or {})}
+    params['placement'] = params['placement'] or base_scenario.PLACEMENT
+    return {
+        'version': CACHE_VERSION,
+        'sim_config': {**base_scenario.sim_config, 'Ctrl': {'python': ctrl}},
+        'params': params,
+        # O estado inicial dos controladores e da rede é o do início da execução
+        'start': start.isoformat(),
+        'grid_file': file_hash(grid_file),
+        'pv_data': file_hash(base_scenario.PV_DATA),
+        'sources': {path.name: file_hash(path) for path in SOURCES},
+        'libraries': {name: library_version(name) for name in LIBRARIES},
+    }
+
+
+def run_key(config) -> str:
+    return hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class Segment:
+    def __init__(self, path):
+        self.path = Path(path)
+        first, last = self.path.stem.split('_')
+        self.start = pd.Timestamp(first)
+        self.end = pd.Timestamp(last)
+        self.checkpoint = self.path.with_suffix('.ckpt')  # estado da simulação em end
+
+    @staticmethod
+    def name(start, end):
+        return '%s_%s.pkl' % (start.strftime(DATE_FORMAT), end.strftime(DATE_FORMAT))
+
+
+class RunCache:
+    # Segmentos de resultados por chave em directory, com no máximo max_bytes
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=MAX_BYTES):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+
+    def segments(self, key) -> list:
+        return sorted((Segment(path) for path in (self.directory / key).glob('*_*.pkl')),
+                      key=lambda segment: segment.start)
+
+    def lookup(self, key, start):
+        # Segmento mais longo da chave com as linhas de uma execução a partir de start,
+        # ou None
+        segments = [segment for segment in self.segments(key) if segment.start == start]
+        return max(segments, key=lambda segment: segment.end, default=None)
+
+    def read(self, key, start, end) -> pd.DataFrame:
+        # Linhas de [start, end) guardadas nos segmentos da chave
+        frames = []
+        for segment in self.segments(key):
+            if segment.end <= start or segment.start >= end:
+                continue
+            os.utime(segment.path)  # usado agora (ver evict)
+            df = pd.read_pickle(segment.path)
+            frames.append(df[(df.index >= start) & (df.index < end)])
+        if not frames:
+            return pd.DataFrame()
+        df = pd.concat(frames)
+        return df[~df.index.duplicated()]
+
+    def store(self, key, start, end, df, config=None, checkpoint=None):
+        # Guarda as linhas df de uma execução de start até end, com o arquivo checkpoint
+        # do estado em end (movido para o cache), no lugar dos segmentos da chave (de
+        # execuções mais curtas)
+        directory = self.directory / key
+        directory.mkdir(parents=True, exist_ok=True)
+        if config is not None and not (directory / 'config.json').exists():
+            with open(directory / 'config.json', 'w') as f:
+                json.dump(config, f, indent=1, sort_keys=True, default=str)
+
+        replaced = self.segments(key)
+        path = directory / Segment.name(start, end)
+        tmp = path.with_name('%s.%d.tmp' % (path.name, os.getpid()))
+        df.to_pickle(tmp)
+        os.replace(tmp, path)
+        segment = Segment(path)
+        if checkpoint is not None:
+            os.replace(checkpoint, segment.checkpoint)
+        else:
+            segment.checkpoint.unlink(missing_ok=True)
+        for old in replaced:
+            if old.path != path:
+                old.path.unlink(missing_ok=True)
+                old.checkpoint.unlink(missing_ok=True)
+        self.evict(keep=path)
+
+    def resume_data(self, segment):
+        # Checkpoint do fim do segmento, ou None se não houver um válido
+        if not segment.checkpoint.exists():
+            return None
+        os.utime(segment.checkpoint)
+        return load(segment.checkpoint)
+
+    def evict(self, keep=None):
+        # Remove os segmentos usados há mais tempo até o cache caber em max_bytes
+        # O checkpoint de cada segmento conta no tamanho e é removido com ele
+        files = [(path.stat().st_mtime, path.stat().st_size + checkpoint_size(path), path)
+                 for path in self.directory.glob('*/*_*.pkl')]
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files, key=lambda item: item[0]):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            path.unlink(missing_ok=True)
+            path.with_suffix('.ckpt').unlink(missing_ok=True)
+            total -= size
+            if not any(path.parent.glob('*_*.pkl')):
+                for other in path.parent.iterdir():
+                    other.unlink()
+                path.parent.rmdir()
+
+
+def checkpoint_size(path):
+    checkpoint = path.with_suffix('.ckpt')
+    return checkpoint.stat().st_size if checkpoint.exists() else 0
+
+
+def new_output(data):
+    # Checkpoint data em que o coletor grava um arquivo novo, só com as linhas a partir
+    # do checkpoint, em vez de continuar o arquivo da execução original
+    sims = dict(data['sims'])
+    for sid, blob in sims.items():
+        if sid.split('-')[0] == 'Collector':
+            saved = pickle.loads(blob)
+            saved['state'] = dict(saved['state'], position=0)
+            sims[sid] = pickle.dumps(saved, protocol=pickle.HIGHEST_PROTOCOL)
+    return dict(data, sims=sims)
+
+
+def simulate(start, end, directory, resume=None, **kwargs):
+    # Resultados de uma execução de start até end e o arquivo do checkpoint do estado
+    # em end (ou None). Com resume (o checkpoint data de um segmento), a execução
+    # continua dele e os resultados começam no checkpoint.
+    length = int((end - start).total_seconds())
+    first = resume['time'] if resume is not None else 0
+    fd, output_file = tempfile.mkstemp(suffix='.csv', dir=directory)
+    os.close(fd)
+    checkpoint_dir = tempfile.mkdtemp(suffix='.ckpt', dir=directory)
+    checkpoint = None
+    try:
+        kwargs.setdefault('mosaik_config', {'addr': ('127.0.0.1', free_port())})
+        if kwargs.get('ctrl_shards', 1) <= 1:
+            # Um checkpoint em length, o primeiro depois de first; a execução vai um
+            # passo além do fim para que todos os simuladores cheguem a ele
+            kwargs.update(checkpoint_every=length - first, checkpoint_dir=checkpoint_dir,
+                          resume=new_output(resume) if resume is not None else None)
+        base_scenario.run_cosimul(end=length + STEP, start=start.strftime('%Y-%m-%d %H:%M:%S'),
+                                  output_file=output_file, **kwargs)
+        try:
+            df = pd.read_csv(output_file, index_col=0, parse_dates=True,
+                             float_precision='round_trip')
+        except pd.errors.EmptyDataError:  # intervalo menor que um passo
+            df = pd.DataFrame(index=pd.DatetimeIndex([], name='date'))
+        for path in checkpoint_files(checkpoint_dir):
+            data = load(path)
+            if data is not None and data['time'] == length:
+                checkpoint = Path(directory) / ('%s.%d.tmp' % (path.name, os.getpid()))
+                os.replace(path, checkpoint)
+    finally:
+        os.remove(output_file)
+        for path in Path(checkpoint_dir).iterdir():
+            path.unlink()
+        os.rmdir(checkpoint_dir)
+    return df[df.index < end], checkpoint
+
+
+def write_results(df, output_file, groups=None):
+    # Grava as linhas no arquivo de resultados, no formato da extensão (ver writers);
+    # groups: grupo de cada entidade, para resultados em .store (ver results_store)
+    if df.empty:
+        return
+    Path(output_file).parent.mkdir(parents=True, exist_ok=True)
+    writer = make_writer(output_file, df.columns, df.index[0], 1,
+                         groups=column_groups(df.columns, groups or {}))
+    writer.write_frame(df.rename_axis('date'))
+    writer.close()
+
+
+def cached_cosimul(end=base_scenario.END, start=base_scenario.START,
+                   output_file=base_scenario.OUTPUT_FILE, cache_dir=CACHE_DIR,
+                   max_bytes=MAX_BYTES, print_progress=True, profile=None, profile_dump=None,
+                   **kwargs) -> pd.DataFrame:
+    # Como base_scenario.run_cosimul, mas com os resultados lidos do cache quando
+    # possível (o mesmo início e um fim até o do segmento guardado); um período mais
+    # longo continua do checkpoint do segmento, e só o que falta é simulado. Grava
+    # output_file e retorna os resultados. Os demais argumentos são os de
+    # config_cosimul.
+    if kwargs.get('checkpoint_every') or kwargs.get('resume') is not None:
+        raise ValueError('Cached runs do not support checkpoints')
+    kwargs.pop('checkpoint_every', None)
+    kwargs.pop('checkpoint_dir', None)
+    cache = RunCache(cache_dir, max_bytes)
+    config = run_config(start=start, **kwargs)
+    key = run_key(config)
+    first = pd.Timestamp(start)
+    last = first + pd.Timedelta(seconds=end)
+
+    segment = cache.lookup(key, first)
+    if segment is not None and segment.end >= last:
+        print('Cached results: %d s reused' % end)
+    else:
+        resume = cache.resume_data(segment) if segment is not None else None
+        reused = resume['time'] if resume is not None else 0
+        print('Cached results: %d of %d s reused, %d s to simulate'
+              % (reused, end, end - reused))
+        (cache.directory / key).mkdir(parents=True, exist_ok=True)
+        df, checkpoint = simulate(first, last, cache.directory / key, resume=resume,
+                                  print_progress=print_progress, profile=profile,
+                                  profile_dump=profile_dump, **kwargs)
+        if resume is not None:
+            df = pd.concat([cache.read(key, first, segment.end), df])
+        cache.store(key, first, last, df, config, checkpoint)
+
+    df = cache.read(key, first, last)
+    groups = grid_groups(kwargs.get('grid_file', base_scenario.GRID_FILE))
+    write_results(df, output_file, groups)
+    return df
@@ -0,0 +1,120 @@
+# Cenários declarativos: lê um arquivo TOML (ou YAML) com a rede, o período, o
+# controlador, os parâmetros FV e a regra de alocação dos geradores, e devolve os
+# argumentos de base_scenario.run_cosimul / config_cosimul.
+#
+#   [grid]
+#   file = "../data/rede_1-LV-rural2--0-sw.json"   # relativo ao arquivo do cenário
+#   feeder = true                                   # resultados da rede como vetores
+#   linear = { trust_band = 0.02, check_every = 60 } # fluxo linearizado (ou true)
+#   pf_inputs = true                                # fluxo também nos passos com setpoints
+#
+#   [simulation]
+#   start = "2016-01-01 11:00:00"
+#   end = 3600                                      # duração em segundos
+#   output = "../output/results.csv"
+#   checkpoint = 3600                               # checkpoint a cada hora simulada
+#
+#   [controller]
+#   variant = "VV_batch"                            # ver base_scenario.CONTROLLERS
+#   deadband = { mod = 1e-4 }
+#   fleet = true                                    # uma entidade para todos os GDs
+#   der_table = true                                # tabela de respostas do OpenDER
+#   shards = 4                                      # controladores em 4 processos
+#
+#   [pv]
+#   lat = 53.07
+#   area = 3e4
+#   fleet = true                                    # um painel por gerador
+#
+#   [placement]
+#   rule = "every_nth"                              # ver scenarios.placement
+#   n = 2
+#
+# Todas as seções e chaves são opcionais; o que não for informado usa os valores de
+# base_scenario. Arquivos YAML (.yaml/.yml) têm a mesma estrutura e exigem o PyYAML.
+from pathlib import Path
+
+import pandas as pd
+
+# Chaves de cada seção e o argumento de config_cosimul correspondente
+SECTIONS = {
+    'grid': {'file': 'grid_file', 'feeder': 'feeder', 'linear': 'linear_pf',
+             'pf_inputs': 'pf_inputs'},
+    'simulation': {'start': 'start', 'end': 'end', 'output': 'output_file',
+                   'checkpoint': 'checkpoint_every'},
+    'controller': {'variant': 'ctrl', 'deadband': 'ctrl_deadband', 'fleet': 'fleet_ctrl',
+                   'der_table': 'der_table', 'shards': 'ctrl_shards'},
+    'pv': {'fleet': None, 'night_skip': 'pv_night_skip', 'tolerance': 'pv_tolerance'},
+    'placement': {},
+}
+PV_KEYS = ('lat', 'area', 'efficiency', 'el_tilt', 'az_tilt')
+PATH_KEYS = ('grid_file', 'output_file')
+
+
+def read_file(path) -> dict:
+    # Conteúdo do arquivo como dicionário, conforme a extensão
+    path = Path(path)
+    if path.suffix in ('.yaml', '.yml'):
+        try:
+            import yaml
+        except ImportError:
+            raise ImportError('Reading YAML scenarios requires "PyYAML" '
+                              '(pip install pyyaml)') from None
+        with open(path) as f:
+            return yaml.safe_load(f) or {}
+
+    try:
+        import tomllib
+    except ImportError:  # Python < 3.11
+        try:
+            import tomli as tomllib
+        except ImportError:
+            raise ImportError('Reading TOML scenarios on Python < 3.11 requires "tomli" '
+                              '(pip install tomli)') from None
+    with open(path, 'rb') as f:
+        return tomllib.load(f)
+
+
+def parse_scenario(data, base_dir='.') -> dict:
+    # Converte o conteúdo de um arquivo de cenário nos argumentos de config_cosimul;
+    # caminhos relativos são resolvidos a partir de base_dir
+    unknown = set(data) - set(SECTIONS)
+    if unknown:
+        raise ValueError('Unknown scenario sections: %s' % ', '.join(sorted(unknown)))
+
+    kwargs = {}
+    for section, keys in SECTIONS.items():
+        values = dict(data.get(section) or {})
+        if section == 'placement':
+            if values:
+                kwargs['placement'] = values
+            continue
+        if section == 'pv':
+            keys = {**keys, **{key: None for key in PV_KEYS}}
+        unknown = set(values) - set(keys)
+        if unknown:
+            raise ValueError('Unknown keys in [%s]: %s' % (section, ', '.join(sorted(unknown))))
+        kwargs.update({keys[key]: value for key, value in values.items() if keys[key]})
+
+    pv = data.get('pv') or {}
+    pv_params = {key: pv[key] for key in PV_KEYS if key in pv}
+    if pv.get('fleet'):
+        # Frota FV: um painel por gerador, com os parâmetros (escalares ou listas) da seção
+        from scenarios.base_scenario import PV_PARAMS
+        kwargs['pv_fleet'] = {**PV_PARAMS, **pv_params}
+    elif pv_params:
+        kwargs['pv_params'] = pv_params
+
+    if 'start' in kwargs:
+        kwargs['start'] = pd.Timestamp(kwargs['start']).strftime('%Y-%m-%d %H:%M:%S')
+    if 'end' in kwargs:
+        kwargs['end'] = int(kwargs['end'])
+    for key in PATH_KEYS:
+        if key in kwargs:
+            kwargs[key] = (Path(base_dir) / kwargs[key]).resolve()
+    return kwargs
+
+
+def load_scenario(path) -> dict:
+    # Argumentos de base_scenario.run_cosimul definidos no arquivo de cenário
+    return parse_scenario(read_file(path), Path(path).resolve().parent)
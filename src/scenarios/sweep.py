@@ -0,0 +1,122 @@
+# Varredura de cenários: executa combinações de controlador, janela de tempo e
+# parâmetros, cada mundo mosaik em um processo próprio
+import itertools
+import os
+import socket
+import time
+import traceback
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import pandas as pd
+
+from scenarios import base_scenario
+
+SUMMARY_FILE = 'summary.csv'
+
+
+def make_jobs(ctrls, windows, param_sets=None, output_dir='sweep') -> list:
+    # Uma tarefa para cada combinação (controlador, janela, conjunto de parâmetros).
+    # windows: lista de pares (início, duração em segundos)
+    # param_sets: lista de dicionários de parâmetros do sistema FV (ver PV_PARAMS)
+    param_sets = param_sets or [{}]
+    output_dir = Path(output_dir)
+    jobs = []
+    for ctrl, (start, duration), (k, params) in itertools.product(
+            ctrls, windows, enumerate(param_sets)):
+        start = pd.Timestamp(start)
+        name = '%s_%s_%ds_p%d' % (ctrl, start.strftime('%Y%m%d%H%M'), duration, k)
+        jobs.append({
+            'name': name,
+            'ctrl': ctrl,
+            'start': start.strftime('%Y-%m-%d %H:%M:%S'),
+            'end': int(duration),
+            'pv_params': dict(params),
+            'output_file': str(output_dir / ('%s.csv' % name)),
+        })
+    return jobs
+
+
+def daily_windows(first_day, n_days) -> list:
+    # Janelas de um dia a partir de first_day
+    first_day = pd.Timestamp(first_day).normalize()
+    return [(first_day + pd.Timedelta(days=d), 24*60*60) for d in range(n_days)]
+
+
+def param_grid(**values) -> list:
+    # Produto cartesiano dos valores de cada parâmetro, ex.: area=[1e4, 3e4]
+    keys = list(values)
+    return [dict(zip(keys, combo)) for combo in itertools.product(*values.values())]
+
+
+def summarize(output_file) -> dict:
+    # Estatísticas principais de um arquivo de resultados do Collector
+    df = pd.read_csv(output_file, index_col=0, parse_dates=True)
+    vm = df.filter(regex='-vm_pu$')
+    loading = df.filter(regex='-loading_percent$')
+    p_gen = df.filter(regex='-P_gen$')
+    dt_h = (df.index[1] - df.index[0]).total_seconds() / 3600 if len(df) > 1 else 0.
+    return {
+        'steps': len(df),
+        'vm_pu_max': vm.max().max(),
+        'vm_pu_min': vm.min().min(),
+        'loading_percent_max': loading.max().max(),
+        'pv_energy_mwh': p_gen.sum().sum() * dt_h,
+    }
+
+
+def free_port() -> int:
+    # Porta livre para o servidor do mosaik; cada mundo em execução precisa da sua
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def run_job(job) -> dict:
+    # Executa uma tarefa da varredura (no processo de um worker)
+    row = {key: job[key] for key in ('name', 'ctrl', 'start', 'end')}
+    row.update({'pv_%s' % key: value for key, value in job['pv_params'].items()})
+    row['output_file'] = job['output_file']
+    t0 = time.perf_counter()
+    try:
+        Path(job['output_file']).parent.mkdir(parents=True, exist_ok=True)
+        base_scenario.run_cosimul(end=job['end'], print_progress=False, ctrl=job['ctrl'],
+                                  start=job['start'], pv_params=job['pv_params'],
+                                  output_file=job['output_file'],
+                                  mosaik_config={'addr': ('127.0.0.1', free_port())})
+        row.update(summarize(job['output_file']))
+        row['error'] = ''
+    except Exception:
+        row['error'] = traceback.format_exc(limit=1).strip().splitlines()[-1]
+    row['runtime_s'] = time.perf_counter() - t0
+    return row
+
+
+def run_jobs(jobs, workers=None) -> list:
+    # Distribui as tarefas entre processos e devolve uma linha de resumo por tarefa
+    workers = min(workers or os.cpu_count() or 1, len(jobs)) or 1
+    rows = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(run_job, job): job for job in jobs}
+        for future in as_completed(futures):
+            row = future.result()
+            status = 'ERRO: %s' % row['error'] if row['error'] else 'ok'
+            print('[%d/%d] %s (%.1f s) %s' % (len(rows) + 1, len(jobs), row['name'],
+                                             row['runtime_s'], status))
+            rows.append(row)
+    return rows
+
+
+def run_sweep(ctrls, windows, param_sets=None, workers=None,
+              output_dir=base_scenario.parent_dir / 'output' / 'sweep') -> pd.DataFrame:
+    # Executa a varredura completa e grava o resumo consolidado em output_dir
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    jobs = make_jobs(ctrls, windows, param_sets, output_dir)
+    rows = run_jobs(jobs, workers)
+
+    order = {job['name']: i for i, job in enumerate(jobs)}
+    summary = pd.DataFrame(sorted(rows, key=lambda row: order[row['name']]))
+    summary.to_csv(output_dir / SUMMARY_FILE, index=False)
+    return summary
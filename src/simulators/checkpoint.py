@@ -0,0 +1,218 @@
+"""
+Periodic checkpoints of a running co-simulation and resuming from them.
+
+:class:`Checkpoint` wraps ``step`` of every simulator of a world (like
+:mod:`simulators.instrumentation`, but on the instances). At its first step
+at or after each checkpoint time ``T`` (a multiple of ``every``), before the
+step runs, a simulator's state is pickled together with the inputs of that
+step and the scheduling state mosaik keeps for it. Simulators are not in
+lockstep (a simulator without inputs may run ahead, a sleeping one may step
+much later), so each one is saved at its own first step from ``T`` on; once
+every simulator has been saved for ``T``, the checkpoint is written to
+``<directory>/checkpoint_<T>.pkl`` and the older ones beyond ``keep`` are
+removed::
+
+    with Checkpoint(world, 'results.csv.ckpt', every=3600, meta={'end': END}):
+        world.run(until=END)
+
+To resume, the same world is built again and :meth:`Checkpoint.restore`
+sets the state of every simulator and its mosaik runner to the one stored in
+the checkpoint from :func:`load_latest`, so ``world.run()`` continues from
+there. The collector truncates its output file to what had been written at
+the checkpoint and appends to it.
+
+Every simulator needs ``get_state()``/``set_state(state)`` methods with the
+state that is carried from one step to the next, and has to run in-process
+(``'python'`` entries of ``sim_config``).
+
+"""
+import heapq
+import itertools
+import os
+import pickle
+
+from pathlib import Path
+
+from mosaik.proxies import LocalProxy
+
+VERSION = 1
+KEEP = 2  # checkpoints kept on disk
+MAX_PENDING = 48  # incomplete checkpoints kept in memory
+PATTERN = 'checkpoint_*.pkl'
+
+
+def default_directory(output_file):
+    """Default checkpoint directory of a run writing to *output_file*."""
+    return Path(str(output_file) + '.ckpt')
+
+
+def checkpoint_files(directory):
+    """Checkpoint files in *directory*, oldest first."""
+    return sorted(Path(directory).glob(PATTERN))
+
+
+def load(path):
+    """Content of the checkpoint file *path*, or None if it cannot be read
+    or was written by another version."""
+    try:
+        with open(path, 'rb') as f:
+            data = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None
+    return data if data.get('version') == VERSION else None
+
+
+def load_latest(directory):
+    """Content of the latest readable checkpoint in *directory*."""
+    for path in reversed(checkpoint_files(directory)):
+        data = load(path)
+        if data is not None:
+            return data
+    raise FileNotFoundError('No checkpoint found in %s' % directory)
+
+
+def runner_state(runner, time):
+    """Scheduling state of the mosaik runner of a simulator that is about
+    to step at *time* (the step was already taken from ``next_steps``)."""
+    return {
+        'next_steps': sorted(runner.next_steps + [time]),
+        'next_self_step': runner.next_self_step,
+        'progress': runner.progress,
+        'input_memory': runner.input_memory,
+        'timed_inputs': runner.timed_input_buffer.input_queue,
+    }
+
+
+def restore_runner(runner, time, state, inputs):
+    runner.next_steps = list(state['next_steps'])
+    heapq.heapify(runner.next_steps)
+    runner.next_self_step = state['next_self_step']
+    runner.progress = state['progress']
+    runner.last_step = time - 1
+    runner.input_memory = state['input_memory']
+    # As entradas do passo são devolvidas pelo buffer; as que o mosaik produzir
+    # novamente ao retomar prevalecem sobre elas
+    runner.input_buffer = inputs
+    queue = list(state['timed_inputs'])
+    runner.timed_input_buffer.input_queue = queue
+    runner.timed_input_buffer.counter = itertools.count(max((entry[1] for entry in queue),
+                                                            default=-1) + 1)
+
+
+class Checkpoint:
+    """Write a checkpoint of *world* to *directory* every *every* seconds of
+    simulated time; *meta* is stored along (e.g. the arguments of the run)."""
+
+    def __init__(self, world, directory, every, meta=None, keep=KEEP):
+        if not every or every <= 0:
+            raise ValueError('every must be a positive number of seconds')
+        self.world = world
+        self.directory = Path(directory)
+        self.every = int(every)
+        self.meta = dict(meta or {})
+        self.keep = keep
+        self.written = []  # times of the checkpoints written in this run
+
+        self._sims = {}
+        for sid, runner in world.sims.items():
+            if not isinstance(runner.proxy, LocalProxy):
+                raise ValueError('Checkpoints need in-process simulators, but "%s" '
+                                 'runs as a separate process' % sid)
+            sim = runner.proxy.sim
+            if not (hasattr(sim, 'get_state') and hasattr(sim, 'set_state')):
+                raise ValueError('Simulator "%s" (%s) does not support checkpoints'
+                                 % (sid, type(sim).__name__))
+            self._sims[sid] = sim
+        self._next = dict.fromkeys(self._sims, self.every)
+        self._pending = {}  # checkpoint time -> {sid: pickled state}
+        self._last = {}  # sid -> (first checkpoint, time, pickled state) of the last save
+        self._installed = []
+        self._resumed = False
+
+    def restore(self, data):
+        """Set every simulator of the world to its state in the checkpoint
+        *data* (see :func:`load_latest`); call before ``world.run()``."""
+        missing = set(self._sims) - set(data['sims'])
+        if missing:
+            raise ValueError('The checkpoint does not match the scenario (no state for %s)'
+                             % ', '.join(sorted(missing)))
+        for sid, sim in self._sims.items():
+            saved = pickle.loads(data['sims'][sid])
+            sim.set_state(saved['state'])
+            restore_runner(self.world.sims[sid], saved['time'], saved['runner'],
+                           saved['inputs'])
+        self._next = dict.fromkeys(self._sims, data['time'] + self.every)
+        self._resumed = True
+
+    def install(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        if not self._resumed:
+            # Checkpoints de uma execução anterior não valem para esta
+            for old in checkpoint_files(self.directory):
+                old.unlink()
+        for sid, sim in self._sims.items():
+            sim.step = self._wrap(sid, sim.step)
+            self._installed.append(sim)
+
+    def uninstall(self):
+        for sim in self._installed:
+            del sim.step
+        self._installed = []
+
+    def __enter__(self):
+        self.install()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.uninstall()
+
+    def _wrap(self, sid, step):
+        def wrapper(time, inputs, max_advance):
+            if time >= self._next[sid]:
+                self._save(sid, time, inputs)
+            return step(time, inputs, max_advance)
+        return wrapper
+
+    def _save(self, sid, time, inputs):
+        runner = self.world.sims[sid]
+        # Serializado já aqui: o estado muda assim que o passo é executado
+        blob = pickle.dumps({'time': time, 'state': self._sims[sid].get_state(),
+                             'inputs': inputs, 'runner': runner_state(runner, time)},
+                            protocol=pickle.HIGHEST_PROTOCOL)
+
+        # Este é o primeiro passo do simulador a partir de cada checkpoint entre
+        # first e time; o último estado de cada simulador também vale para os
+        # checkpoints que outros simuladores só alcançarem depois
+        first = self._next[sid]
+        self._last[sid] = (first, time, blob)
+        for t, blobs in self._pending.items():
+            if first <= t <= time:
+                blobs[sid] = blob
+        checkpoint = time // self.every * self.every
+        if checkpoint not in self._pending:
+            self._pending[checkpoint] = {s: b for s, (f, t, b) in self._last.items()
+                                         if f <= checkpoint <= t}
+        self._next[sid] = checkpoint + self.every
+
+        complete = [t for t, blobs in self._pending.items() if len(blobs) == len(self._sims)]
+        if complete:
+            t = max(complete)
+            self._write(t, self._pending[t])
+            self._pending = {k: v for k, v in self._pending.items() if k > t}
+        while len(self._pending) > MAX_PENDING:
+            del self._pending[min(self._pending)]
+
+    def _write(self, time, blobs):
+        data = dict(self.meta, version=VERSION, time=time, every=self.every, sims=blobs)
+        path = self.directory / ('checkpoint_%012d.pkl' % time)
+        tmp = path.with_name('%s.%d.tmp' % (path.name, os.getpid()))
+        with open(tmp, 'wb') as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+        self.written.append(time)
+
+        for old in checkpoint_files(self.directory)[:-self.keep]:
+            try:
+                old.unlink()
+            except OSError:
+                pass
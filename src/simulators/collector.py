@@ -1,12 +1,33 @@
 """
 A simple data collector that saves all input into a csv file.
 
+Rows are buffered and written in chunks (see :mod:`simulators.writers`), as
+CSV, Parquet, HDF5 or a results store. The column schema is fixed on the
+first step. The ``groups`` of the ``Monitor``, ``{src: group}`` (full IDs or
+entity IDs, e.g. ``{'0-Bus 1': 'bus'}``), give the entity group of the
+columns of each source, by which a store is partitioned (see
+:mod:`simulators.results_store`); other sources are in the ``other`` group.
+
+For checkpoints (see :mod:`simulators.checkpoint`), the buffered rows are
+flushed and the length of the output file is saved with the column schema;
+on resume, the file is cut back to that length and appended to.
+
+Vector inputs (e.g. from the ``Feeder`` of :mod:`simulators.grid_sim`) are
+spread over one column per element. The ``labels`` of the ``Monitor`` name
+those columns like scalar inputs, ``{src: {attr: [name, ...]}}`` giving
+``<name>-<attr>``; without a label they are ``<src>.<i>-<attr>``.
+
 """
 import collections
+import warnings
+
+import numpy as np
 import pandas as pd
 
 import mosaik_api
 
+from simulators.writers import entity_group, make_writer
+
 from pathlib import Path
 
 current_dir = Path(__file__).resolve().parent
@@ -18,7 +39,7 @@ META = {
         'Monitor': {
             'public': True,
             'any_inputs': True,
-            'params': [],
+            'params': ['labels', 'groups'],
             'attrs': [],
         },
     },
@@ -31,47 +52,122 @@ class Collector(mosaik_api.Simulator):
         self.eid = None
         self.data = collections.defaultdict(lambda:
                                             collections.defaultdict(dict))
+        self.writer = None
+        self.columns = None
+        self.vectors = None
+        self.labels = {}
+        self.groups = {}
 
     def init(self, sid, time_resolution, start_date,
              date_format='%Y-%m-%d %H:%M:%S', output_file= parent_dir / 'output' / 'results.csv',
-             print_results=False):
+             print_results=False, output_format=None, buffer_size=1440,
+             keep_data=False):
         self.time_resolution = time_resolution
         self.start_date = pd.to_datetime(start_date, format=date_format)
         self.output_file = output_file
+        self.output_format = output_format
+        self.buffer_size = buffer_size
         self.print_results = print_results
+        # The in-memory copy of all values is only needed to print them
+        self.keep_data = keep_data or print_results
         return self.meta
 
-    def create(self, num, model):
+    def create(self, num, model, labels=None, groups=None):
         if num > 1 or self.eid is not None:
             raise RuntimeError('Can only create one instance of Monitor.')
 
         self.eid = 'Monitor'
+        self.labels = labels or {}
+        self.groups = groups or {}
 
         return [{'eid': self.eid, 'type': model}]
 
     def step(self, time, inputs, max_advance):
-        # print(inputs)
-        current_date = (self.start_date
-                        + pd.Timedelta(time * self.time_resolution, unit='seconds'))
-
-        df_dict = {'date': current_date}
-
         data = inputs.get(self.eid, {})
+        if self.writer is None:
+            self._create_writer(data)
+
+        row = np.full(len(self.columns), np.nan)
         for attr, values in data.items():
             for src, value in values.items():
-                self.data[src][attr][time] = value
-                df_dict[f'{src}-{attr}'] = [value]
-
-        df = pd.DataFrame.from_dict(df_dict)
-        df = df.set_index('date')
-        if time == 0:
-            df.to_csv(self.output_file, mode='w', header=True)
-        else:
-            df.to_csv(self.output_file, mode='a', header=False)
+                if self.keep_data:
+                    self.data[src][attr][time] = value
+                cols = self.vectors.get((src, attr))
+                if cols is not None:
+                    if value is not None:
+                        row[cols] = value
+                    continue
+                col = self.columns.get((src, attr))
+                if col is None:
+                    self._unknown_column(src, attr)
+                elif value is not None:
+                    row[col] = value
+
+        self.writer.append(time, row)
 
         return None
 
+    def _create_writer(self, data):
+        """Fix the column schema from the inputs of the first step."""
+        self.columns = {}
+        self.vectors = {}
+        for attr, values in data.items():
+            for src, value in values.items():
+                if np.ndim(value) == 0:
+                    self.columns.setdefault((src, attr), len(self.columns))
+                    continue
+                # Um vetor ocupa uma coluna por elemento; elementos rotulados como
+                # uma entrada escalar compartilham a coluna dela
+                names = self.labels.get(src, {}).get(attr)
+                if names is None:
+                    names = ['%s.%d' % (src, i) for i in range(len(value))]
+                elif len(names) != len(value):
+                    raise ValueError('Collector: %d labels for the %d values of "%s-%s"'
+                                     % (len(names), len(value), src, attr))
+                self.vectors[(src, attr)] = np.array(
+                    [self.columns.setdefault((name, attr), len(self.columns)) for name in names],
+                    dtype=int)
+        self._unknown = set()
+        self._open_writer()
+
+    def _open_writer(self):
+        names = ['%s-%s' % key for key in self.columns]
+        groups = [entity_group(src, self.groups) for src, _ in self.columns]
+        self.writer = make_writer(self.output_file, names, self.start_date,
+                                  self.time_resolution, self.output_format,
+                                  self.buffer_size, groups)
+
+    def _unknown_column(self, src, attr):
+        if (src, attr) not in self._unknown:
+            self._unknown.add((src, attr))
+            warnings.warn('Collector: "%s-%s" was not present in the first step '
+                          'and is not written to %s' % (src, attr, self.output_file))
+
+    def get_state(self):
+        """State for a checkpoint, after writing the buffered rows."""
+        return {
+            'columns': self.columns,
+            'vectors': self.vectors,
+            'unknown': getattr(self, '_unknown', set()),
+            'position': self.writer.position() if self.writer is not None else None,
+            'data': {src: dict(attrs) for src, attrs in self.data.items()},
+        }
+
+    def set_state(self, state):
+        """Continue the output file of the run that saved *state*."""
+        self.columns = state['columns']
+        self.vectors = state['vectors']
+        self._unknown = state['unknown']
+        for src, attrs in state['data'].items():
+            self.data[src].update(attrs)
+        if self.columns is not None:
+            self._open_writer()
+            self.writer.resume(state['position'])
+
     def finalize(self):
+        if self.writer is not None:
+            self.writer.close()
+
         if self.print_results:
             #print('Collected data:')
             for sim, sim_data in sorted(self.data.items()):
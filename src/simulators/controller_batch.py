@@ -0,0 +1,422 @@
+# - 'controller_batch': mesmos controladores SEM/NO/VV/VW, avaliados para
+#   todos os agentes de uma vez com operações vetorizadas do NumPy
+"""
+Vectorized variants of the DER controllers.
+
+Instead of calling OpenDER once per agent, the steady-state response of the
+configured ``DER_PV`` (volt-var / volt-watt curves, reactive power capability
+and apparent power limit) is evaluated for every agent in a single NumPy pass.
+The curve settings are read from the same ``_create_der()`` used by the
+per-agent controllers, so both implementations always share one configuration.
+
+Select one of ``ControllerSEM``, ``ControllerNO``, ``ControllerVV`` or
+``ControllerVW`` in the ``'Ctrl'`` entry of ``sim_config``.
+
+Besides one ``Ctrl`` entity per agent, the same simulator offers a
+``FleetCtrl`` model: a single entity that controls *n_agents* DERs and whose
+inputs (``val_in``, ``p_dc``) and outputs (``mod``, ``pot``) are vectors with
+one element per DER, in the order of the generators it is connected to (see
+the ``GenFleet`` model of :mod:`simulators.grid_sim`). Mosaik then routes one
+value per attribute and step instead of one per agent. Output elements that
+are ``nan`` carry no setpoint.
+
+"""
+import numpy as np
+
+import mosaik_api
+
+import simulators.controller_des_NO as controller_NO
+import simulators.controller_des_SEM as controller_SEM
+import simulators.controller_des_VV as controller_VV
+import simulators.controller_des_VW as controller_VW
+
+from simulators.deadband import ArrayDeadband
+
+META = {
+    'type': 'event-based',
+    'models': {
+        'Ctrl': {
+            'public': True,
+            'params': [],
+            'attrs': ['val_in', 'p_dc', 'mod', 'pot'],
+        },
+        'FleetCtrl': {
+            'public': True,
+            'params': ['n_agents'],  # number of DERs controlled by the entity
+            'attrs': ['val_in', 'p_dc', 'mod', 'pot'],
+        },
+    },
+}
+
+REFERENCE_CONTROLLERS = {
+    'SEM': controller_SEM.Controller,
+    'NO': controller_NO.Controller,
+    'VV': controller_VV.Controller,
+    'VW': controller_VW.Controller,
+}
+
+
+class DERCurves:
+    """Steady-state response of a configured OpenDER ``DER_PV`` as arrays."""
+
+    def __init__(self, der_file):
+        self.p_max = der_file.NP_P_MAX
+        self.va_max = der_file.NP_VA_MAX
+        self.efficiency = der_file.NP_EFFICIENCY
+        self.pv_enable = bool(der_file.PV_MODE_ENABLE)
+        self.pv_v = np.array([der_file.PV_CURVE_V1, der_file.PV_CURVE_V2], dtype=float)
+        self.pv_p = np.array([der_file.PV_CURVE_P1, der_file.PV_CURVE_P2], dtype=float)
+        self.qv_enable = bool(der_file.QV_MODE_ENABLE)
+        self.qv_v = np.array([der_file.QV_CURVE_V1, der_file.QV_CURVE_V2,
+                              der_file.QV_CURVE_V3, der_file.QV_CURVE_V4], dtype=float)
+        self.qv_q = np.array([der_file.QV_CURVE_Q1, der_file.QV_CURVE_Q2,
+                              der_file.QV_CURVE_Q3, der_file.QV_CURVE_Q4], dtype=float)
+        capability = der_file.NP_Q_CAPABILITY_BY_P_CURVE
+        self.q_inj_p = np.array(capability['P_Q_INJ_PU'], dtype=float)
+        self.q_inj_q = np.array(capability['Q_MAX_INJ_PU'], dtype=float)
+        self.q_abs_p = np.array(capability['P_Q_ABS_PU'], dtype=float)
+        self.q_abs_q = np.array(capability['Q_MAX_ABS_PU'], dtype=float)
+        self.v_trip_high = der_file.OV1_TRIP_V
+        self.v_trip_low = der_file.UV1_TRIP_V
+
+    def response(self, v_pu, p_dc_w):
+        """Return the active [W] and reactive [var] output of every DER for
+        the applied voltages *v_pu* and available DC powers *p_dc_w*."""
+        v_pu = np.asarray(v_pu, dtype=float)
+        p_dc_w = np.asarray(p_dc_w, dtype=float)
+
+        # Potência desejada: disponível, limitada pela curva Volt-Watt e pela nominal
+        p_pu = np.minimum(p_dc_w / self.p_max * self.efficiency, 1.)
+        if self.pv_enable:
+            p_pu = np.minimum(p_pu, np.interp(v_pu, self.pv_v, self.pv_p))
+
+        # Potência reativa desejada pela curva Volt-VAR, limitada pela capacidade em P
+        if self.qv_enable:
+            q_var = np.interp(v_pu, self.qv_v, self.qv_q) * self.va_max
+            q_var = np.clip(q_var,
+                            -self.va_max * np.interp(p_pu, self.q_abs_p, self.q_abs_q),
+                            self.va_max * np.interp(p_pu, self.q_inj_p, self.q_inj_q))
+        else:
+            q_var = np.zeros_like(v_pu)
+
+        # Prioridade à potência reativa quando a potência aparente é excedida
+        p_w = p_pu * self.p_max
+        over = p_w**2 + q_var**2 >= self.va_max**2
+        p_w = np.where(over, np.sqrt(np.maximum(self.va_max**2 - q_var**2, 0.)) * np.sign(p_w), p_w)
+
+        # Desligamento por sobretensão/subtensão
+        tripped = (v_pu > self.v_trip_high) | (v_pu < self.v_trip_low)
+        p_w = np.where(tripped, 0., p_w)
+        q_var = np.where(tripped, 0., q_var)
+
+        return p_w, q_var
+
+
+class Controller(mosaik_api.Simulator):
+    mode = None
+
+    def __init__(self):
+        super().__init__(META)
+        self.agents = []
+        self.index = {}
+        self.fleets = {}  # agents of each FleetCtrl entity, as a slice of the arrays
+        self.output_delay = None
+        self.deadband = None
+        self.time = 0
+
+        reference = REFERENCE_CONTROLLERS[self.mode]()
+        self.curves = DERCurves(reference._create_der().der_file)
+
+        # Estados e saídas de todos os agentes, um elemento por agente
+        self.smoothed_Q = np.zeros(0)
+        self.outputs = {'mod': np.zeros(0), 'pot': np.zeros(0)}
+
+    def init(self, sid, time_resolution, output_delay=None, deadband=None):
+        self.sid = sid
+        self.output_delay = output_delay
+        self.deadband = ArrayDeadband(deadband) if deadband is not None else None
+        return self.meta
+
+    def create(self, num, model, n_agents=None):
+        if model == 'FleetCtrl':
+            return [self._create_fleet(n_agents) for _ in range(num)]
+
+        n = len(self.agents)
+        entities = []
+        for i in range(n, n + num):
+            eid = 'Agent_%d' % i
+            self.index[eid] = i
+            self.agents.append(eid)
+            entities.append({'eid': eid, 'type': model})
+        self._grow(num)
+        return entities
+
+    def _create_fleet(self, n_agents):
+        if not n_agents or n_agents < 1:
+            raise ValueError('FleetCtrl needs n_agents >= 1')
+        eid = 'Fleet_%d' % len(self.fleets)
+        start = len(self.agents)
+        self.fleets[eid] = slice(start, start + n_agents)
+        # Os agentes da frota ocupam posições nos vetores, mas não são entidades
+        self.agents.extend('%s-%d' % (eid, i) for i in range(n_agents))
+        self._grow(n_agents)
+        return {'eid': eid, 'type': 'FleetCtrl'}
+
+    def _grow(self, num):
+        # Acrescenta num agentes aos estados e saídas
+        self.smoothed_Q = np.append(self.smoothed_Q, np.zeros(num))
+        # NaN representa saída ainda não definida (None para o mosaik)
+        self.outputs['pot'] = np.append(self.outputs['pot'], np.full(num, np.nan))
+        self.outputs['mod'] = np.append(self.outputs['mod'],
+                                        np.zeros(num) if self.mode == 'VW' else np.full(num, np.nan))
+        if self.deadband is not None:
+            self.deadband.resize(len(self.agents))
+
+    def step(self, time, inputs, max_advance):
+        self.time = time
+
+        # Empilha as entradas de todos os agentes em vetores
+        fleet_inputs = [(eid, attrs) for eid, attrs in inputs.items() if eid in self.fleets]
+        n = len(inputs) - len(fleet_inputs)
+        idx = np.empty(n, dtype=int)
+        val_in = np.full(n, np.nan)
+        p_dc = np.full(n, np.nan)
+        k = 0
+        for agent_eid, attrs in inputs.items():
+            if agent_eid in self.fleets:
+                continue
+            idx[k] = self.index[agent_eid]
+            val_in_dict = attrs.get('val_in')
+            p_dc_dict = attrs.get('p_dc')
+            if val_in_dict and p_dc_dict:
+                val_in[k] = next(iter(val_in_dict.values()))
+                p_dc[k] = next(iter(p_dc_dict.values()))
+            k += 1
+
+        if fleet_inputs:
+            idx, val_in, p_dc = self._stack_fleet_inputs(fleet_inputs, idx, val_in, p_dc)
+
+        valid = ~(np.isnan(val_in) | np.isnan(p_dc))
+        idx, val_in, p_dc = idx[valid], val_in[valid], p_dc[valid]
+        p_dc_w = p_dc * 1000000  # Converte MW para W
+
+        if self.mode == 'VW':
+            self._step_vw(idx, val_in, p_dc_w)
+        else:
+            # As saídas dos demais controladores valem apenas para o passo atual
+            self.outputs['mod'][:] = np.nan
+            self.outputs['pot'][:] = np.nan
+            active = val_in > 1.00
+            self._step_vv(idx[active], val_in[active], p_dc_w[active])
+
+        return None
+
+    def _stack_fleet_inputs(self, fleet_inputs, idx, val_in, p_dc):
+        # Acrescenta os vetores de entrada das frotas aos dos agentes; uma fonte
+        # escalar (um único sistema FV) vale para todos os agentes da frota
+        idx, val_in, p_dc = [idx], [val_in], [p_dc]
+        for eid, attrs in fleet_inputs:
+            agents = self.fleets[eid]
+            n = agents.stop - agents.start
+            val_in_dict = attrs.get('val_in')
+            p_dc_dict = attrs.get('p_dc')
+            if not (val_in_dict and p_dc_dict):
+                continue
+            idx.append(np.arange(agents.start, agents.stop))
+            for values, source in ((val_in, val_in_dict), (p_dc, p_dc_dict)):
+                value = np.asarray(next(iter(source.values())), dtype=float)
+                if value.ndim and value.shape != (n,):
+                    raise ValueError('%s expects %d values per input, got %d'
+                                     % (eid, n, value.size))
+                values.append(np.broadcast_to(value, (n,)))
+        return np.concatenate(idx), np.concatenate(val_in), np.concatenate(p_dc)
+
+    def _step_vv(self, idx, val_in, p_dc_w):
+        P, Q_novo = self.curves.response(val_in, p_dc_w)
+        P_novo_mw = P * 0.000001  # Converte W para MW
+        Q_novo_mvar = Q_novo * 0.000001  # Converte VAR para MVAR
+
+        if self.mode == 'VV':
+            # Suavização exponencial da potência reativa
+            alpha = 0.2
+            self.smoothed_Q[idx] = alpha * Q_novo_mvar + (1 - alpha) * self.smoothed_Q[idx]
+            self.outputs['mod'][idx] = self.smoothed_Q[idx]
+            self.outputs['pot'][idx] = P_novo_mw
+        elif self.mode == 'NO':
+            self.outputs['mod'][idx] = 0
+            self.outputs['pot'][idx] = P_novo_mw
+        else:
+            # Controle desativado: força Q e P a zero
+            self.outputs['mod'][idx] = 0
+            self.outputs['pot'][idx] = 0
+
+    def _step_vw(self, idx, val_in, p_dc_w):
+        P_calculated_w, _ = self.curves.response(val_in, p_dc_w)
+        P_calculated_mw = P_calculated_w * 0.000001  # Converte para MW
+        p_dc_mw = p_dc_w * 0.000001  # Potência disponível (FV) em MW
+
+        P_anterior = self.outputs['pot'][idx]
+        P_anterior = np.where(np.isnan(P_anterior), P_calculated_mw, P_anterior)
+
+        alpha = 0.05  # Fator de suavização para descida da potência
+
+        # Rampa de descida quando o Volt-Watt corta potência, de subida caso contrário
+        P_novo = np.where(P_calculated_mw < (p_dc_mw * 0.999),
+                          P_anterior + alpha * (P_calculated_mw - P_anterior),
+                          P_anterior + 0.5 * (p_dc_mw - P_anterior))
+        P_novo = np.minimum(P_novo, p_dc_mw)
+
+        self.outputs['pot'][idx] = P_novo
+        self.outputs['mod'][idx] = 0
+
+    def get_state(self):
+        # Estado levado de um passo ao outro, gravado nos checkpoints (ver simulators.checkpoint)
+        return {'smoothed_Q': self.smoothed_Q, 'outputs': self.outputs,
+                'deadband': self.deadband}
+
+    def set_state(self, state):
+        self.smoothed_Q = state['smoothed_Q']
+        self.outputs = state['outputs']
+        self.deadband = state['deadband']
+
+    def get_data(self, outputs):
+        data = {}
+        for eid, attrs in outputs.items():
+            if eid not in self.index and eid not in self.fleets:
+                raise ValueError('Unknown entity ID "%s"' % eid)
+            for attr in attrs:
+                if attr not in self.outputs:
+                    raise ValueError('Unknown attribute "%s" for %s' % (attr, eid))
+
+        agent_outputs = {eid: attrs for eid, attrs in outputs.items() if eid in self.index}
+        if self.deadband is not None:
+            data = self._changed_outputs(agent_outputs)
+        else:
+            for eid, attrs in agent_outputs.items():
+                i = self.index[eid]
+                data[eid] = {}
+                for attr in attrs:
+                    value = self.outputs[attr][i]
+                    data[eid][attr] = None if np.isnan(value) else float(value)
+
+        for eid, attrs in outputs.items():
+            if eid in self.fleets:
+                values = self._fleet_outputs(eid, attrs)
+                if values:
+                    data[eid] = values
+
+        if data and self.output_delay:
+            data['time'] = self.time + self.output_delay
+
+        return data
+
+
+    def _changed_outputs(self, outputs):
+        # Apenas os valores que saíram da banda morta, avaliados para todos os agentes
+        data = {}
+        for attr in self.outputs:
+            eids = [eid for eid, attrs in outputs.items() if attr in attrs]
+            if not eids:
+                continue
+            idx = np.array([self.index[eid] for eid in eids], dtype=int)
+            values = self.outputs[attr][idx]
+            for k in np.flatnonzero(self.deadband.changed(attr, idx, values)):
+                data.setdefault(eids[k], {})[attr] = float(values[k])
+        return data
+
+    def _fleet_outputs(self, eid, attrs):
+        # Vetores de saída da frota; com banda morta, os elementos que não saíram
+        # dela viram NaN e o vetor só é enviado se algum elemento mudou
+        agents = self.fleets[eid]
+        data = {}
+        for attr in attrs:
+            values = self.outputs[attr][agents].copy()
+            if self.deadband is not None:
+                changed = self.deadband.changed(attr, np.arange(agents.start, agents.stop),
+                                                values)
+                if not changed.any():
+                    continue
+                values[~changed] = np.nan
+            data[attr] = values
+        return data
+
+
+class ControllerSEM(Controller):
+    mode = 'SEM'
+
+
+class ControllerNO(Controller):
+    mode = 'NO'
+
+
+class ControllerVV(Controller):
+    mode = 'VV'
+
+
+class ControllerVW(Controller):
+    mode = 'VW'
+
+
+def verify(mode, n_agents=48, n_steps=30, tol=1e-9, seed=0, fleet=False):
+    """Run the per-agent OpenDER controller and its vectorized counterpart on
+    the same random inputs and check that their outputs agree within *tol*.
+    With *fleet*, the vectorized controller is a single ``FleetCtrl`` entity.
+
+    Voltages are kept below the OpenDER trip limit, where the per-agent model
+    would carry a trip state between steps. Returns the largest deviation.
+
+    """
+    rng = np.random.default_rng(seed)
+    reference = REFERENCE_CONTROLLERS[mode]()
+    batch = {'SEM': ControllerSEM, 'NO': ControllerNO,
+             'VV': ControllerVV, 'VW': ControllerVW}[mode]()
+    # A referência é o próprio OpenDER, sem a tabela de respostas (ver simulators.der_table)
+    reference.init('Ctrl', 1., **({'der_table': False} if mode in ('VV', 'VW') else {}))
+    reference.create(n_agents, 'Ctrl')
+    batch.init('Ctrl', 1.)
+    if fleet:
+        batch.create(1, 'FleetCtrl', n_agents=n_agents)
+    else:
+        batch.create(n_agents, 'Ctrl')
+
+    max_error = 0.
+    for step in range(n_steps):
+        val_in = rng.uniform(0.95, 1.09, n_agents)
+        p_dc = rng.uniform(0, 0.04, n_agents)
+        inputs = {'Agent_%d' % i: {'val_in': {'Grid': val_in[i]}, 'p_dc': {'PV': p_dc[i]}}
+                  for i in range(n_agents)}
+        outputs = {'Agent_%d' % i: ['mod', 'pot'] for i in range(n_agents)}
+
+        reference.step(step * 60, inputs, None)
+        expected_data = reference.get_data(outputs)
+        if fleet:
+            batch.step(step * 60, {'Fleet_0': {'val_in': {'Grid': val_in},
+                                               'p_dc': {'PV': p_dc}}}, None)
+            vectors = batch.get_data({'Fleet_0': ['mod', 'pot']})['Fleet_0']
+            actual_data = {'Agent_%d' % i: {attr: None if np.isnan(values[i]) else values[i]
+                                            for attr, values in vectors.items()}
+                           for i in range(n_agents)}
+        else:
+            batch.step(step * 60, inputs, None)
+            actual_data = batch.get_data(outputs)
+
+        for eid, attrs in expected_data.items():
+            for attr, expected in attrs.items():
+                actual = actual_data[eid][attr]
+                if (expected is None) != (actual is None):
+                    raise AssertionError('%s.%s: %s != %s' % (eid, attr, expected, actual))
+                if expected is not None:
+                    max_error = max(max_error, abs(expected - actual))
+
+    if max_error > tol:
+        raise AssertionError('Vectorized %s controller deviates from OpenDER by %g'
+                             % (mode, max_error))
+    return max_error
+
+
+def main():
+    return mosaik_api.start_simulation(ControllerVV())
+
+
+if __name__ == '__main__':
+    main()
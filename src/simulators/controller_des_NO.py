@@ -3,6 +3,8 @@
 import mosaik_api
 from opender import DER_PV
 
+from simulators.deadband import Deadband
+
 META = {
     'type': 'event-based',
     'models': {
@@ -19,10 +21,13 @@ class Controller(mosaik_api.Simulator):
     def __init__(self):
         super().__init__(META)
         self.agents = []
+        self.der_objs = {}  # Um objeto DER_PV configurado por agente
 
-    def init(self, sid, time_resolution, output_delay=None):
+    def init(self, sid, time_resolution, output_delay=None, deadband=None):
         self.sid = sid
         self.output_delay = output_delay
+        # Banda morta das saídas (ver simulators.deadband); None envia todos os valores
+        self.deadband = Deadband(deadband) if deadband is not None else None
         return self.meta
 
     def create(self, num, model):
@@ -31,9 +36,20 @@ class Controller(mosaik_api.Simulator):
         for i in range(n_agents, n_agents + num):
             eid = f'Agent_{i}'
             self.agents.append(eid)
+            self.der_objs[eid] = self._create_der()
             entities.append({'eid': eid, 'type': model})
         return entities
 
+    def _create_der(self):
+        # Cria e configura o modelo OpenDER do agente uma única vez; o mesmo
+        # objeto é reutilizado em todos os passos, preservando seus estados internos
+        der_obj = DER_PV()
+        der_obj.der_file.NP_P_MAX = 7500
+        der_obj.der_file.NP_VA_MAX = 7500
+        der_obj.der_file.NP_Q_MAX_ABS = 4500
+        der_obj.der_file.NP_Q_MAX_INJ = 4500
+        return der_obj
+
     def step(self, time, inputs, max_advance):
         self.time = time
         cache = self.cache = {}
@@ -42,11 +58,7 @@ class Controller(mosaik_api.Simulator):
             val_in = list(attrs.get('val_in', {}).values())[0]
             p_dc = list(attrs.get('p_dc', {}).values())[0] * 1_000_000
 
-            der_obj = DER_PV()
-            der_obj.der_file.NP_P_MAX = 7500
-            der_obj.der_file.NP_VA_MAX = 7500
-            der_obj.der_file.NP_Q_MAX_ABS = 4500
-            der_obj.der_file.NP_Q_MAX_INJ = 4500
+            der_obj = self.der_objs[agent_eid]
 
             if val_in > 1.00:
                 der_obj.update_der_input(v_pu=val_in, f=60, p_dc_w=p_dc)
@@ -63,6 +75,14 @@ class Controller(mosaik_api.Simulator):
 
         return None
 
+    def get_state(self):
+        # Estado levado de um passo ao outro, gravado nos checkpoints (ver simulators.checkpoint)
+        return {'der_objs': self.der_objs, 'deadband': self.deadband}
+
+    def set_state(self, state):
+        self.der_objs = state['der_objs']
+        self.deadband = state['deadband']
+
     def get_data(self, outputs):
         data = {}
         for eid, attrs in outputs.items():
@@ -75,6 +95,10 @@ class Controller(mosaik_api.Simulator):
                     raise ValueError(f'Unknown attribute "{attr}"')
                 data[eid][attr] = self.cache.get(eid, {}).get(attr)
 
+        # Envia apenas os valores que saíram da banda morta
+        if self.deadband is not None:
+            data = self.deadband.filter(data)
+
         if data and self.output_delay:
             data['time'] = self.time + self.output_delay
 
@@ -3,6 +3,9 @@
 import mosaik_api
 from opender import DER, DER_PV
 
+from simulators.deadband import Deadband
+from simulators.der_table import DERResponse, load_table
+
 META = {
     'type': 'event-based',
     'models': {
@@ -20,10 +23,16 @@ class Controller(mosaik_api.Simulator):
         super().__init__(META)
         self.agents = []
         self.smoothed_Q = {} 
+        self.der_objs = {}  # Um objeto DER_PV configurado por agente
 
-    def init(self, sid, time_resolution, output_delay=None):
+    def init(self, sid, time_resolution, output_delay=None, deadband=None, der_table=False):
         self.sid = sid
         self.output_delay = output_delay
+        # Banda morta das saídas (ver simulators.deadband); None envia todos os valores
+        self.deadband = Deadband(deadband) if deadband is not None else None
+        # Respostas do OpenDER lidas de uma tabela pré-calculada (ver simulators.der_table);
+        # sem der_table o OpenDER é executado em todos os passos
+        self.response = DERResponse(load_table(self._create_der) if der_table else None)
 
         return self.meta
 
@@ -35,50 +44,72 @@ class Controller(mosaik_api.Simulator):
             self.agents.append(eid)
             entities.append({'eid': eid, 'type': model})
             self.smoothed_Q[eid] = 0.0 
+            self.der_objs[eid] = self._create_der()
 
         return entities
 
+    def _create_der(self):
+        # Cria e configura o modelo OpenDER do agente uma única vez; o mesmo
+        # objeto é reutilizado em todos os passos, preservando seus estados internos
+        der_obj = DER_PV()
+        der_obj.der_file.QV_MODE_ENABLE = True
+        der_obj.der_file.NP_P_MAX = 7500
+        der_obj.der_file.NP_VA_MAX = 7500
+        der_obj.der_file.NP_Q_MAX_ABS = 4500
+        der_obj.der_file.NP_Q_MAX_INJ = 4500
+        return der_obj
+
     def step(self, time, inputs, max_advance):
         self.time = time
         cache = self.cache = {}
 
+        active = []
         for agent_eid, attrs in inputs.items():
             val_in = list(attrs.get('val_in', {}).values())[0]
             p_dc = list(attrs.get('p_dc', {}).values())[0]
             p_dc = p_dc * 1000000  # Converte MW para W
 
-            alpha = 0.2  # Fator de suavização exponencial (quanto menor, mais suave a resposta)
+            if val_in > 1.00:
+                active.append((agent_eid, val_in, p_dc))
 
-            der_obj = DER_PV()
-            der_obj.der_file.QV_MODE_ENABLE = True
-            der_obj.der_file.NP_P_MAX = 7500
-            der_obj.der_file.NP_VA_MAX = 7500
-            der_obj.der_file.NP_Q_MAX_ABS = 4500
-            der_obj.der_file.NP_Q_MAX_INJ = 4500
+        if not active:
+            return None
 
-            if val_in > 1.00:
-                # Atualiza as entradas do modelo DER com a tensão da barra e potência FV disponível
-                der_obj.update_der_input(v_pu=val_in, f=60, p_dc_w=p_dc)
+        alpha = 0.2  # Fator de suavização exponencial (quanto menor, mais suave a resposta)
 
-                # Executa o modelo OpenDER com o controle Volt-VAR ativado
-                P, Q_novo = der_obj.run()
+        # Executa o modelo OpenDER com o controle Volt-VAR ativado, com a tensão da barra
+        # e a potência FV disponível de cada agente (todos de uma vez)
+        eids, val_in, p_dc = zip(*active)
+        P, Q_novo = self.response([self.der_objs[eid] for eid in eids], val_in, p_dc)
 
-                Q_novo_mvar = Q_novo * 0.000001  # Converte VAR para MVAR
-                P_novo_mw = P * 0.000001  # Converte W para MW
+        for agent_eid, P_w, Q_var in zip(eids, P.tolist(), Q_novo.tolist()):
+            Q_novo_mvar = Q_var * 0.000001  # Converte VAR para MVAR
+            P_novo_mw = P_w * 0.000001  # Converte W para MW
 
-                # Aplica suavização exponencial na potência reativa (controle Volt-VAR)
-                self.smoothed_Q[agent_eid] = alpha * Q_novo_mvar + (1 - alpha) * self.smoothed_Q[agent_eid]
-                Q_suave = self.smoothed_Q[agent_eid]
+            # Aplica suavização exponencial na potência reativa (controle Volt-VAR)
+            self.smoothed_Q[agent_eid] = alpha * Q_novo_mvar + (1 - alpha) * self.smoothed_Q[agent_eid]
+            Q_suave = self.smoothed_Q[agent_eid]
 
-                # Armazena a saída suavizada no cache para posterior leitura
-                cache[agent_eid] = {
-                    'mod': Q_suave,
-                    'pot': P_novo_mw,
-                }
+            # Armazena a saída suavizada no cache para posterior leitura
+            cache[agent_eid] = {
+                'mod': Q_suave,
+                'pot': P_novo_mw,
+            }
 
         return None
 
 
+    def get_state(self):
+        # Estado levado de um passo ao outro, gravado nos checkpoints (ver simulators.checkpoint)
+        return {'smoothed_Q': self.smoothed_Q, 'der_objs': self.der_objs,
+                'exact': self.response.exact, 'deadband': self.deadband}
+
+    def set_state(self, state):
+        self.smoothed_Q = state['smoothed_Q']
+        self.der_objs = state['der_objs']
+        self.response.exact = state['exact']
+        self.deadband = state['deadband']
+
     def get_data(self, outputs):
         data = {}
         for eid, attrs in outputs.items():
@@ -94,6 +125,10 @@ class Controller(mosaik_api.Simulator):
                 else:
                     data[eid][attr] = None
 
+        # Envia apenas os valores que saíram da banda morta
+        if self.deadband is not None:
+            data = self.deadband.filter(data)
+
         if data and self.output_delay:
             data['time'] = self.time + self.output_delay
 
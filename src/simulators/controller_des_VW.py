@@ -2,6 +2,9 @@
 import mosaik_api
 from opender import DER, DER_PV
 
+from simulators.deadband import Deadband
+from simulators.der_table import DERResponse, load_table
+
 META = {
     'type': 'event-based',
     'models': {
@@ -18,12 +21,18 @@ class Controller(mosaik_api.Simulator):
     def __init__(self):
         super().__init__(META)
         self.agents = {}  
+        self.der_objs = {}  # Um objeto DER_PV configurado por agente
         self.output_delay = None
         self.time = 0
 
-    def init(self, sid, time_resolution, output_delay=None):
+    def init(self, sid, time_resolution, output_delay=None, deadband=None, der_table=False):
         self.sid = sid
         self.output_delay = output_delay
+        # Banda morta das saídas (ver simulators.deadband); None envia todos os valores
+        self.deadband = Deadband(deadband) if deadband is not None else None
+        # Respostas do OpenDER lidas de uma tabela pré-calculada (ver simulators.der_table);
+        # sem der_table o OpenDER é executado em todos os passos
+        self.response = DERResponse(load_table(self._create_der) if der_table else None)
         return self.meta
 
     def create(self, num, model):
@@ -33,13 +42,29 @@ class Controller(mosaik_api.Simulator):
             eid = 'Agent_%d' % i
             # Initialize agent data with default values
             self.agents[eid] = {'pot': None, 'mod': 0}
+            self.der_objs[eid] = self._create_der()
             entities.append({'eid': eid, 'type': model})
         return entities
 
+    def _create_der(self):
+        # Cria e configura o modelo OpenDER do agente uma única vez; o mesmo
+        # objeto é reutilizado em todos os passos, preservando seus estados internos
+        der_obj = DER_PV()
+        der_obj.der_file.PV_MODE_ENABLE = True
+
+        # Configuração da curva Volt-Watt
+        der_obj.der_file.PV_CURVE_V1 = 1.05  # Tensão em pu onde inicia o corte de potência ativa
+        der_obj.der_file.PV_CURVE_V2 = 1.06  # Tensão onde a potência é completamente cortada
+        der_obj.der_file.NP_P_MAX = 7500
+        der_obj.der_file.NP_VA_MAX = 7500
+        der_obj.der_file.NP_Q_MAX_ABS = 4500
+        return der_obj
+
     def step(self, time, inputs, max_advance):
         self.time = time
         cache = {}
 
+        active = []
         for agent_eid, attrs in inputs.items():
             val_in_dict = attrs.get('val_in', {})
             p_dc_dict = attrs.get('p_dc', {})
@@ -50,20 +75,13 @@ class Controller(mosaik_api.Simulator):
             val_in = list(val_in_dict.values())[0]
             p_dc = list(p_dc_dict.values())[0]
             p_dc_w = p_dc * 1000000  # Converte de MW para W
+            active.append((agent_eid, val_in, p_dc_w))
 
-            der_obj = DER_PV()
-            der_obj.der_file.PV_MODE_ENABLE = True
-
-            # Configuração da curva Volt-Watt
-            der_obj.der_file.PV_CURVE_V1 = 1.05  # Tensão em pu onde inicia o corte de potência ativa
-            der_obj.der_file.PV_CURVE_V2 = 1.06  # Tensão onde a potência é completamente cortada
-            der_obj.der_file.NP_P_MAX = 7500
-            der_obj.der_file.NP_VA_MAX = 7500
-            der_obj.der_file.NP_Q_MAX_ABS = 4500
+        # Executa o modelo do OpenDER com os valores de entrada atuais de todos os agentes
+        eids, v_in, p_in = zip(*active) if active else ((), (), ())
+        P_calculated, _ = self.response([self.der_objs[eid] for eid in eids], v_in, p_in)
 
-            # Executa o modelo do OpenDER com os valores de entrada atuais
-            der_obj.update_der_input(v_pu=val_in, f=60, p_dc_w=p_dc_w)
-            P_calculated_w, Q_calculated_var = der_obj.run()
+        for agent_eid, p_dc_w, P_calculated_w in zip(eids, p_in, P_calculated.tolist()):
             P_calculated_mw = P_calculated_w * 0.000001  # Converte para MW
 
             # Recupera o valor de potência injetada no passo anterior
@@ -99,6 +117,17 @@ class Controller(mosaik_api.Simulator):
         return None
 
 
+    def get_state(self):
+        # Estado levado de um passo ao outro, gravado nos checkpoints (ver simulators.checkpoint)
+        return {'agents': self.agents, 'der_objs': self.der_objs,
+                'exact': self.response.exact, 'deadband': self.deadband}
+
+    def set_state(self, state):
+        self.agents = state['agents']
+        self.der_objs = state['der_objs']
+        self.response.exact = state['exact']
+        self.deadband = state['deadband']
+
     def get_data(self, outputs):
         data = {}
         current_cache = getattr(self, 'cache_for_get_data', {})
@@ -120,6 +149,10 @@ class Controller(mosaik_api.Simulator):
                     # Or None if it was never set (shouldn't happen ideally)
                     data[eid][attr] = self.agents[eid].get(attr)
 
+        # Envia apenas os valores que saíram da banda morta
+        if self.deadband is not None:
+            data = self.deadband.filter(data)
+
         if data and self.output_delay:
             data['time'] = self.time + self.output_delay
 
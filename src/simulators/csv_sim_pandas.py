@@ -1,24 +1,95 @@
+import json
+import os
+
+import numpy as np
 import pandas as pd
 
 import mosaik_api
 
+from pathlib import Path
+
 DATE_FORMAT = 'YYYY-MM-DD HH:mm:ss'
 
 SENTINEL = object()
 
+CACHE_SUFFIX = '.npcache'  # sidecar directory with the binary copy of a data file
+CACHE_VERSION = 1
+
+
+def _source_signature(datafile, header):
+    stat = os.stat(datafile)
+    return {'version': CACHE_VERSION, 'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns, 'header': header}
+
+
+def _write_atomic(path, write):
+    # Processos de uma varredura podem criar o mesmo cache ao mesmo tempo, e outro
+    # processo pode estar lendo (por mapeamento de memória) o arquivo anterior
+    tmp = path.with_name('%s.%d.tmp' % (path.name, os.getpid()))
+    with open(tmp, 'wb' if path.suffix == '.npy' else 'w') as f:
+        write(f)
+    os.replace(tmp, path)
+
+
+def load_data(datafile, header, use_cache=True):
+    """Return ``(index, values, columns)`` of *datafile*.
+
+    The parsed file is stored next to it as ``.npy`` arrays on first load and
+    memory-mapped on later loads, as long as the data file is unchanged.
+
+    """
+    cache_dir = Path(str(datafile) + CACHE_SUFFIX)
+    signature = _source_signature(datafile, header)
+    if use_cache:
+        try:
+            with open(cache_dir / 'meta.json') as f:
+                meta = json.load(f)
+            if meta['source'] == signature:
+                index = np.load(cache_dir / 'index.npy', mmap_mode='r')
+                values = np.load(cache_dir / 'values.npy', mmap_mode='r')
+                return index, values, meta['columns']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    data = pd.read_csv(datafile, index_col=0, parse_dates=True,
+                       header=header)
+    data.rename(columns=lambda x: x.strip(), inplace=True)
+    index = data.index.values.astype('datetime64[ns]')
+    columns = list(data.columns)
+    try:
+        values = data.to_numpy(dtype=float)
+    except (TypeError, ValueError):
+        # Non-numeric data cannot be memory-mapped, serve it from memory
+        return index, data.to_numpy(), columns
+
+    if use_cache:
+        try:
+            cache_dir.mkdir(exist_ok=True)
+            _write_atomic(cache_dir / 'index.npy', lambda f: np.save(f, index))
+            _write_atomic(cache_dir / 'values.npy',
+                          lambda f: np.save(f, np.ascontiguousarray(values)))
+            _write_atomic(cache_dir / 'meta.json',
+                          lambda f: json.dump({'source': signature, 'columns': columns}, f))
+        except OSError:
+            pass
+
+    return index, values, columns
+
 
 class CSV(mosaik_api.Simulator):
     def __init__(self):
         super().__init__({'models': {}})
         self.start_date = None
-        self.data = None
+        self.index = None
+        self.values = None
         self.attrs = None
+        self.columns = None
         self.cache = None
         self.sid = None
         self.eid = None
         
     def init(self, sid, time_resolution, sim_start, datafile, date_format=None,
-             continuous=True):
+             continuous=True, use_cache=True):
         self.sid = sid
         self.time_res = pd.Timedelta(time_resolution, unit='seconds')
         start_date = self.start_date = pd.to_datetime(sim_start, format=date_format)
@@ -33,11 +104,10 @@ class CSV(mosaik_api.Simulator):
         else:
             header = 0
 
-        data = self.data = pd.read_csv(datafile, index_col=0, parse_dates=True,
-                                       header=header)
-        data.rename(columns=lambda x: x.strip(), inplace=True)
+        self.index, self.values, columns = load_data(datafile, header, use_cache)
 
-        self.attrs = [attr.strip() for attr in data.columns]
+        self.attrs = [attr.strip() for attr in columns]
+        self.columns = {attr: i for i, attr in enumerate(self.attrs)}
 
         self.meta['type'] = 'hybrid'
         if continuous:
@@ -53,11 +123,11 @@ class CSV(mosaik_api.Simulator):
 
         # Find first relevant value:
         if continuous:
-            first_index = data.index.get_loc(start_date)
+            first_index = self._get_loc(start_date)
             self.next_index = first_index
         else:
-            first_index = data.index.get_loc(start_date)
-            first_date = data.index[first_index]
+            first_index = self._get_loc(start_date)
+            first_date = self.index[first_index]
             if first_date == start_date:
                 self.next_index = first_index
             else:
@@ -65,6 +135,13 @@ class CSV(mosaik_api.Simulator):
 
         return self.meta
 
+    def _get_loc(self, date):
+        date = np.datetime64(date.to_datetime64(), 'ns')
+        pos = int(np.searchsorted(self.index, date))
+        if pos == len(self.index) or self.index[pos] != date:
+            raise KeyError(pd.Timestamp(date))
+        return pos
+
     def create(self, num, model):
         if model != 'Data':
             raise ValueError('Invalid model "%s" % model')
@@ -82,28 +159,34 @@ class CSV(mosaik_api.Simulator):
         return entities
 
     def step(self, time, inputs, max_advance):
-        data = self.data
         if self.next_index >= 0:
-            current_row = data.iloc[self.next_index]
-            self.cache = dict(current_row)
+            self.cache = self.values[self.next_index]
         else:
-            self.cache = {}
+            self.cache = None
         self.next_index += 1
         try:
-            next_date = self.data.index[self.next_index]
-            next_step = int((next_date - self.start_date)/self.time_res)
+            next_date = self.index[self.next_index]
+            next_step = int((next_date - self.start_date.to_datetime64())
+                            / self.time_res.to_timedelta64())
         except IndexError:
             next_step = max_advance
 
         return next_step
 
+    def get_state(self):
+        # Posição nos dados, para os checkpoints (ver simulators.checkpoint)
+        return {'next_index': self.next_index}
+
+    def set_state(self, state):
+        self.next_index = state['next_index']
+
     def get_data(self, outputs):
         data = {}
         attrs = outputs.get(self.eid, [])
         for attr in attrs:
-            value = self.cache.get(attr, SENTINEL)
-            if value != SENTINEL:
-                data[attr] = value
+            col = self.columns.get(attr, SENTINEL)
+            if col is not SENTINEL and self.cache is not None:
+                data[attr] = self.cache[col]
 
         if data:
             data = {self.eid: data}
@@ -0,0 +1,95 @@
+"""
+Deadband filtering of the controller outputs.
+
+A setpoint is only sent when it moved by more than the deadband of its
+attribute since the value last sent for the same agent::
+
+    |value - last| > max(abs, rel * |last|)
+
+Setpoints that are ``None`` (no setpoint in this step) are never sent. The
+deadband is given per attribute, either as a single absolute value or as a
+dict with the keys ``'abs'`` and ``'rel'``; attributes without an entry are
+sent whenever they change::
+
+    {'mod': 1e-5, 'pot': {'abs': 1e-5, 'rel': 0.01}}
+
+:class:`Deadband` keeps the last values per agent for the per-agent
+controllers, :class:`ArrayDeadband` keeps them in arrays for the vectorized
+ones.
+
+"""
+import numpy as np
+
+
+def parse_deadband(deadband):
+    """Return ``{attr: (abs, rel)}`` for the *deadband* settings."""
+    limits = {}
+    for attr, value in (deadband or {}).items():
+        if isinstance(value, dict):
+            unknown = set(value) - {'abs', 'rel'}
+            if unknown:
+                raise ValueError('Unknown deadband keys for "%s": %s'
+                                 % (attr, ', '.join(sorted(unknown))))
+            limits[attr] = (float(value.get('abs', 0.)), float(value.get('rel', 0.)))
+        elif isinstance(value, (tuple, list)):
+            abs_tol, rel_tol = value
+            limits[attr] = (float(abs_tol), float(rel_tol))
+        else:
+            limits[attr] = (float(value), 0.)
+    return limits
+
+
+class Deadband:
+    def __init__(self, deadband):
+        self.limits = parse_deadband(deadband)
+        self.sent = {}
+
+    def changed(self, eid, attr, value):
+        """Whether *value* of *attr* has to be sent for agent *eid*; if so,
+        it is recorded as the last value sent."""
+        if value is None:
+            return False
+        last = self.sent.get((eid, attr))
+        if last is not None:
+            abs_tol, rel_tol = self.limits.get(attr, (0., 0.))
+            if abs(value - last) <= max(abs_tol, rel_tol * abs(last)):
+                return False
+        self.sent[(eid, attr)] = value
+        return True
+
+    def filter(self, data):
+        """Return the outputs *data* of ``get_data`` without the values that
+        do not have to be sent and without agents left with no values."""
+        filtered = {}
+        for eid, values in data.items():
+            values = {attr: value for attr, value in values.items()
+                      if self.changed(eid, attr, value)}
+            if values:
+                filtered[eid] = values
+        return filtered
+
+
+class ArrayDeadband:
+    def __init__(self, deadband):
+        self.limits = parse_deadband(deadband)
+        self.sent = {}
+        self.n_agents = 0
+
+    def resize(self, n_agents):
+        """Track *n_agents* agents; new agents have not sent anything yet."""
+        for attr, sent in self.sent.items():
+            self.sent[attr] = np.append(sent, np.full(n_agents - self.n_agents, np.nan))
+        self.n_agents = n_agents
+
+    def changed(self, attr, idx, values):
+        """Mask of the *values* of *attr* for the agents *idx* that have to be
+        sent; these are recorded as the last values sent. ``nan`` stands for
+        no setpoint."""
+        sent = self.sent.setdefault(attr, np.full(self.n_agents, np.nan))
+        last = sent[idx]
+        abs_tol, rel_tol = self.limits.get(attr, (0., 0.))
+        with np.errstate(invalid='ignore'):
+            within = np.abs(values - last) <= np.maximum(abs_tol, rel_tol * np.abs(last))
+        mask = ~np.isnan(values) & ~within
+        sent[idx[mask]] = values[mask]
+        return mask
@@ -0,0 +1,257 @@
+"""
+Precomputed OpenDER responses for the per-agent controllers.
+
+With the default time step of OpenDER (``t_s``) every ``der_obj.run()``
+returns the steady state, which, while the DER is in service, depends only
+on the applied voltage, the available DC power and the settings of its
+``der_file``. :class:`ResponseTable` samples that response once on a grid
+of ``(v_pu, p_dc_w)`` points and answers later queries with vectorized
+bilinear interpolation. The grid contains the breakpoints of the curves and
+is refined around the cells that deviate from OpenDER by more than half of
+``tol`` (W or var) at their centre or edge midpoints. Some corners of the
+response (the reactive power capability and apparent power limits) do not
+lie on grid lines; the cells that still contain one after the refinement are
+marked and their queries run OpenDER. The bound is heuristic: only the cell
+centres and edge midpoints are compared with OpenDER, so a kink between
+them can still put an answer beyond ``tol``. The largest deviation found at
+those samples is kept as ``max_error``.
+
+The table covers the voltages between the undervoltage and overvoltage trip
+limits, where the DER stays in service, and DC powers up to the one that
+saturates the inverter. :class:`DERResponse` runs OpenDER for queries out of
+that range and keeps doing so for a DER that left it (tripped, for example)
+until it is back in continuous operation and its output agrees with the
+table, so the trip and re-entry states of OpenDER are preserved.
+
+Tables are stored in ``TABLE_DIR`` under the SHA-256 hash of the settings,
+the OpenDER version and ``tol``, and shared by every controller with the
+same configuration.
+
+"""
+import hashlib
+import importlib.metadata
+import json
+import os
+
+import numpy as np
+
+from pathlib import Path
+
+TABLE_DIR = Path(__file__).resolve().parents[1] / 'data' / 'opender_tables.npcache'
+TABLE_VERSION = 1
+
+TOLERANCE = 1.  # largest deviation of the table from OpenDER [W, var]
+V_STEP = 0.0025  # initial spacing of the voltage axis [p.u.]
+P_POINTS = 41    # initial number of points of the DC power axis
+MAX_ROUNDS = 3   # refinement rounds of the grid
+MARGIN = 0.5     # fraction of tol allowed at the sampled points, which can miss a kink
+
+IN_SERVICE = 'Continuous Operation'  # der_status of a DER answered by the table
+
+
+def settings(der_file):
+    """Public settings of a ``der_file`` as JSON-compatible values."""
+    values = {}
+    for name in dir(der_file):
+        if not name.isupper():
+            continue
+        value = getattr(der_file, name)
+        if isinstance(value, np.generic):
+            value = value.item()
+        try:
+            json.dumps(value)
+        except TypeError:
+            continue
+        values[name] = value
+    return values
+
+
+def table_key(der_file, tol=TOLERANCE):
+    source = {'settings': settings(der_file), 'tol': tol, 'version': TABLE_VERSION,
+              'opender': importlib.metadata.version('opender')}
+    return hashlib.sha256(json.dumps(source, sort_keys=True).encode()).hexdigest()
+
+
+def run_der(der_obj, v_pu, p_dc_w):
+    """Output ``(P [W], Q [var])`` of *der_obj* for each pair of inputs."""
+    p_out, q_out = np.empty(len(v_pu)), np.empty(len(v_pu))
+    for k, (v, p) in enumerate(zip(v_pu, p_dc_w)):
+        der_obj.update_der_input(v_pu=float(v), f=60, p_dc_w=float(p))
+        p_out[k], q_out[k] = der_obj.run()
+    return p_out, q_out
+
+
+class ResponseTable:
+    def __init__(self, v_axis, p_axis, p_out, q_out, tol=TOLERANCE, max_error=0., exact=None,
+                 exact_edge=None):
+        self.v_axis, self.p_axis = v_axis, p_axis
+        self.p_out, self.q_out = p_out, q_out
+        self.tol, self.max_error = float(tol), float(max_error)
+        # Células (e trechos da última coluna) em que a tabela não atinge a tolerância
+        self.exact = (np.zeros((len(v_axis) - 1, len(p_axis) - 1), dtype=bool)
+                      if exact is None else exact)
+        self.exact_edge = np.zeros(len(v_axis) - 1, dtype=bool) if exact_edge is None else exact_edge
+
+    @classmethod
+    def build(cls, der_obj, tol=TOLERANCE):
+        """Sample the response of *der_obj* (a configured ``DER_PV`` in
+        service, which is used for the evaluations) within *tol*."""
+        f = der_obj.der_file
+        p_sat = f.NP_P_MAX / f.NP_EFFICIENCY
+        # Margem nos limites de desligamento, onde o OpenDER passa a ter estado
+        v_low, v_high = f.UV1_TRIP_V + 1e-6, f.OV1_TRIP_V - 1e-6
+
+        # Pontos de quebra das curvas Volt-VAR, Volt-Watt e de capacidade
+        v_breaks = [f.QV_CURVE_V1, f.QV_CURVE_V2, f.QV_CURVE_V3, f.QV_CURVE_V4,
+                    f.PV_CURVE_V1, f.PV_CURVE_V2]
+        capability = f.NP_Q_CAPABILITY_BY_P_CURVE
+        p_breaks = [p * p_sat for p in (*capability['P_Q_INJ_PU'], *capability['P_Q_ABS_PU'],
+                                        f.PV_CURVE_P1, f.PV_CURVE_P2)]
+        v_axis = _axis(np.r_[np.arange(v_low, v_high, V_STEP), v_high, v_breaks], v_low, v_high)
+        p_axis = _axis(np.r_[np.linspace(0., p_sat, P_POINTS), p_breaks], 0., p_sat)
+
+        values = {}
+        for k in range(MAX_ROUNDS):
+            table = cls._sample(der_obj, v_axis, p_axis, values, tol)
+            error, edge_error = table._errors(der_obj)
+            bad = error > tol * MARGIN
+            if not bad.any() and not (edge_error > tol * MARGIN).any() or k == MAX_ROUNDS - 1:
+                break
+            # Refina os intervalos das células fora da tolerância
+            bad_v, bad_p = np.flatnonzero(bad.any(axis=1)), np.flatnonzero(bad.any(axis=0))
+            v_axis = np.union1d(v_axis, (v_axis[bad_v] + v_axis[bad_v + 1]) / 2)
+            p_axis = np.union1d(p_axis, (p_axis[bad_p] + p_axis[bad_p + 1]) / 2)
+
+        # As curvas do OpenDER têm quinas fora dos eixos (limites de capacidade e de
+        # potência aparente); as células que ainda as contêm são calculadas pelo OpenDER
+        table.exact, table.exact_edge = bad, edge_error > tol * MARGIN
+        table.max_error = max(error[~bad].max(initial=0.),
+                              edge_error[~table.exact_edge].max(initial=0.))
+        return table
+
+    @classmethod
+    def _sample(cls, der_obj, v_axis, p_axis, values, tol):
+        # Avalia o OpenDER apenas nos pontos ainda não calculados
+        grid_v, grid_p = np.meshgrid(v_axis, p_axis, indexing='ij')
+        new = [(v, p) for v, p in zip(grid_v.ravel(), grid_p.ravel()) if (v, p) not in values]
+        if new:
+            new_v, new_p = np.array(new).T
+            for point, pq in zip(new, zip(*run_der(der_obj, new_v, new_p))):
+                values[point] = pq
+        out = np.array([values[point] for point in zip(grid_v.ravel(), grid_p.ravel())])
+        shape = grid_v.shape
+        return cls(v_axis, p_axis, out[:, 0].reshape(shape), out[:, 1].reshape(shape), tol)
+
+    def _errors(self, der_obj):
+        # Maior desvio no centro e no meio das arestas de cada célula, e no meio
+        # de cada trecho da última coluna, usada pelas potências acima da saturação
+        mid_v = (self.v_axis[:-1] + self.v_axis[1:]) / 2
+        mid_p = (self.p_axis[:-1] + self.p_axis[1:]) / 2
+        centre = self._error_at(der_obj, mid_v, mid_p)
+        v_edges = self._error_at(der_obj, mid_v, self.p_axis)
+        p_edges = self._error_at(der_obj, self.v_axis, mid_p)
+        error = np.maximum.reduce([centre, v_edges[:, :-1], v_edges[:, 1:],
+                                   p_edges[:-1], p_edges[1:]])
+        return error, v_edges[:, -1]
+
+    def _error_at(self, der_obj, v_axis, p_axis):
+        grid_v, grid_p = np.meshgrid(v_axis, p_axis, indexing='ij')
+        p_exact, q_exact = run_der(der_obj, grid_v.ravel(), grid_p.ravel())
+        p_table, q_table = self._interpolate(grid_v.ravel(), grid_p.ravel())
+        return np.maximum(np.abs(p_table - p_exact), np.abs(q_table - q_exact)).reshape(grid_v.shape)
+
+    def _interpolate(self, v_pu, p_dc, cells=False):
+        i = np.clip(np.searchsorted(self.v_axis, v_pu) - 1, 0, len(self.v_axis) - 2)
+        j = np.clip(np.searchsorted(self.p_axis, p_dc) - 1, 0, len(self.p_axis) - 2)
+        tv = np.clip((v_pu - self.v_axis[i]) / (self.v_axis[i + 1] - self.v_axis[i]), 0., 1.)
+        tp = np.clip((p_dc - self.p_axis[j]) / (self.p_axis[j + 1] - self.p_axis[j]), 0., 1.)
+        result = []
+        for grid in (self.p_out, self.q_out):
+            result.append((grid[i, j] * (1 - tv) * (1 - tp) + grid[i + 1, j] * tv * (1 - tp)
+                           + grid[i, j + 1] * (1 - tv) * tp + grid[i + 1, j + 1] * tv * tp))
+        return (*result, i, j) if cells else tuple(result)
+
+    def lookup(self, v_pu, p_dc_w):
+        """Interpolated ``(P [W], Q [var])`` and a mask of the queries the
+        table answers within its tolerance; DC powers above the saturation
+        use its last column."""
+        v_pu = np.asarray(v_pu, dtype=float)
+        p_dc_w = np.asarray(p_dc_w, dtype=float)
+        p_dc = np.minimum(p_dc_w, self.p_axis[-1])
+        p_out, q_out, i, j = self._interpolate(v_pu, p_dc, cells=True)
+        exact = np.where(p_dc == self.p_axis[-1], self.exact_edge[i], self.exact[i, j])
+        valid = (v_pu >= self.v_axis[0]) & (v_pu <= self.v_axis[-1]) & (p_dc_w >= 0.) & ~exact
+        return p_out, q_out, valid
+
+    def save(self, path):
+        tmp = path.with_name('%s.%d.tmp.npz' % (path.stem, os.getpid()))
+        np.savez(tmp, v_axis=self.v_axis, p_axis=self.p_axis, p_out=self.p_out,
+                 q_out=self.q_out, tol=self.tol, max_error=self.max_error, exact=self.exact,
+                 exact_edge=self.exact_edge)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['v_axis'], data['p_axis'], data['p_out'], data['q_out'], data['tol'],
+                       data['max_error'], data['exact'], data['exact_edge'])
+
+
+def _axis(points, low, high):
+    return np.unique(np.clip(points, low, high))
+
+
+def load_table(make_der, tol=TOLERANCE, directory=TABLE_DIR):
+    """Table of the DER returned by *make_der*, read from *directory* or
+    built and stored there on first use."""
+    der_obj = make_der()
+    path = Path(directory) / ('%s.npz' % table_key(der_obj.der_file, tol))
+    try:
+        return ResponseTable.load(path)
+    except (OSError, ValueError, KeyError):
+        pass
+    table = ResponseTable.build(der_obj, tol)
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        table.save(path)
+    except OSError:
+        pass
+    return table
+
+
+class DERResponse:
+    """Response of the DERs of a controller: from *table* when possible,
+    from ``der_obj.run()`` otherwise (always, if *table* is ``None``)."""
+
+    def __init__(self, table=None):
+        self.table = table
+        self.exact = set()  # DERs that left the table and still run OpenDER
+
+    def __call__(self, der_objs, v_pu, p_dc_w):
+        if self.table is None:
+            return self._run(der_objs, v_pu, p_dc_w)
+
+        p_out, q_out, valid = self.table.lookup(v_pu, p_dc_w)
+        run = np.flatnonzero(~valid | np.array([der in self.exact for der in der_objs], dtype=bool))
+        if len(run):
+            p_run, q_run = self._run([der_objs[k] for k in run], np.asarray(v_pu)[run],
+                                     np.asarray(p_dc_w)[run])
+            margin = self.table.tol
+            for k, der, p, q in zip(run, [der_objs[k] for k in run], p_run, q_run):
+                # Volta à tabela quando o DER está em operação contínua (reconectado,
+                # no caso de um desligamento) e o OpenDER concorda com ela
+                if (valid[k] and der.der_status == IN_SERVICE
+                        and abs(p - p_out[k]) <= margin and abs(q - q_out[k]) <= margin):
+                    self.exact.discard(der)
+                else:
+                    self.exact.add(der)
+            p_out[run], q_out[run] = p_run, q_run
+        return p_out, q_out
+
+    @staticmethod
+    def _run(der_objs, v_pu, p_dc_w):
+        p_out, q_out = np.empty(len(der_objs)), np.empty(len(der_objs))
+        for k, der in enumerate(der_objs):
+            der.update_der_input(v_pu=float(v_pu[k]), f=60, p_dc_w=float(p_dc_w[k]))
+            p_out[k], q_out[k] = der.run()
+        return p_out, q_out
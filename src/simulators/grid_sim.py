@@ -0,0 +1,662 @@
+"""
+mosaik_pandapower adapter that caches the loaded grid.
+
+Loading a grid file with mosaik_pandapower parses the JSON, adds a virtual
+load and sgen to every bus and creates one ``ConstControl`` per profile,
+which takes seconds in every run and in every worker process of a sweep.
+:class:`Pandapower` stores the result of the first load in a sidecar
+directory ``<gridfile>.ppcache/``, keyed by the SHA-256 hash of the file
+content, and later loads the pickled net and entity map from there.
+
+The cache also holds the entity IDs of the grid by group (generators, buses,
+lines and loads), which :func:`grid_index` returns to the scenario, and the
+net itself, which :func:`load_net` returns for inspection. A process that
+runs many cases of the same grid (e.g. a worker of
+:mod:`scenarios.monte_carlo`) can :func:`preload` the cache once: later
+loads then unpickle the state from memory, without reading the files and
+hashing the grid again.
+
+The adapter adds a ``GenFleet`` model: one entity for a list of ``Sgen``
+entities of the grid (e.g. the ``ext_gen`` generators that have a
+controller). Its ``p_mw``/``q_mvar`` inputs are vectors with one setpoint
+per generator, written to the ``sgen`` table in a single update (``nan``
+elements are left unchanged), and its ``vm_pu`` output is the vector of the
+voltages at their buses. It is meant to be connected to the ``FleetCtrl``
+model of :mod:`simulators.controller_batch`.
+
+The ``Feeder`` model publishes the results of the whole grid as vectors:
+``vm_pu``, ``p_mw`` and ``q_mvar`` of every ``Bus`` entity and
+``loading_percent`` of every ``Line`` entity, in the order of
+:func:`grid_index`, and takes ``gen_p_mw``/``gen_q_mvar`` setpoint vectors
+for every ``ext_gen`` generator. A single connection to the collector then
+replaces one per bus or line. The per-entity outputs are also built from the
+result tables in one pass per element type instead of one lookup per entity.
+
+Before each power flow, :class:`GridModel` compares the inputs of the net
+(powers, scaling and state of loads, sgens and storages, slack voltage, tap
+positions and switches) with those of the last converged solve and reuses
+its results if nothing changed. Otherwise the solve starts from the last
+voltages: the time series already recycles them, and the plain ``pf`` mode
+runs with ``init='results'``. ``pf_stats`` counts the solves and iterations.
+
+For screening studies, ``linear_pf`` answers the steps with the
+:class:`~simulators.linear_pf.LinearPowerFlow` of the last full solve while
+the voltages stay within its trust band and the topology is unchanged, and
+falls back to the full solver (and a new linearization) otherwise. With
+``check_every`` N, every Nth linear step is also solved in full and the
+largest voltage and loading errors of the linear model are kept in
+``pf_stats``.
+
+For checkpoints (see :mod:`simulators.checkpoint`), the state of the grid
+is the net without the tables that do not change during a run
+(``NET_STATIC``, e.g. the load profiles), which the resumed run loads from
+the grid file again. The linear model is not saved; it is rebuilt by the
+first full solve after resuming.
+
+"""
+import copy
+import hashlib
+import importlib.metadata
+import json
+import os
+import pickle
+
+import time
+
+from pathlib import Path
+
+import mosaik_api
+import numpy as np
+import pandapower as pp
+
+from mosaik_pandapower import model, simulator
+from simulators.linear_pf import LinearPowerFlow, unsupported
+from pandapower.auxiliary import _internal_stored
+from pandapower.control.run_control import run_control
+from pandapower.timeseries.run_time_series import init_time_series, run_time_step
+
+META = copy.deepcopy(simulator.meta)
+META['models']['GenFleet'] = {
+    'public': True,
+    'params': ['generators'],  # entity IDs of the Sgens of the fleet, in order
+    'attrs': [
+        'p_mw',    # active power setpoint of each generator [MW]
+        'q_mvar',  # reactive power setpoint of each generator [MVAr]
+        'vm_pu',   # voltage magnitude at the bus of each generator [p.u.]
+    ],
+}
+META['models']['Feeder'] = {
+    'public': True,
+    'params': [],
+    'attrs': [
+        'vm_pu',            # voltage magnitude of each bus [p.u.]
+        'p_mw',             # active power of each bus [MW]
+        'q_mvar',           # reactive power of each bus [MVAr]
+        'loading_percent',  # loading of each line [%]
+        'gen_p_mw',         # active power setpoint of each ext_gen generator [MW]
+        'gen_q_mvar',       # reactive power setpoint of each ext_gen generator [MVAr]
+    ],
+}
+
+# Vector attributes: (table, column, elements) for the outputs and the sgen
+# column set by each input
+VECTOR_OUTPUTS = {
+    'GenFleet': {
+        'vm_pu': ('res_bus', 'vm_pu', 'bus'),
+        'p_mw': ('sgen', 'p_mw', 'sgen'),
+        'q_mvar': ('sgen', 'q_mvar', 'sgen'),
+    },
+    'Feeder': {
+        'vm_pu': ('res_bus', 'vm_pu', 'bus'),
+        'p_mw': ('res_bus', 'p_mw', 'bus'),
+        'q_mvar': ('res_bus', 'q_mvar', 'bus'),
+        'loading_percent': ('res_line', 'loading_percent', 'line'),
+        'gen_p_mw': ('sgen', 'p_mw', 'sgen'),
+        'gen_q_mvar': ('sgen', 'q_mvar', 'sgen'),
+    },
+}
+VECTOR_INPUTS = {
+    'GenFleet': {'p_mw': 'p_mw', 'q_mvar': 'q_mvar'},
+    'Feeder': {'gen_p_mw': 'p_mw', 'gen_q_mvar': 'q_mvar'},
+}
+
+# Columns of the net that are inputs of the power flow, compared between solves
+PF_INPUTS = {
+    'load': ('p_mw', 'q_mvar', 'scaling', 'in_service'),
+    'sgen': ('p_mw', 'q_mvar', 'scaling', 'in_service'),
+    'storage': ('p_mw', 'q_mvar', 'scaling', 'in_service'),
+    'gen': ('p_mw', 'vm_pu', 'scaling', 'in_service'),
+    'ext_grid': ('vm_pu', 'va_degree', 'in_service'),
+    'trafo': ('tap_pos', 'in_service'),
+    'line': ('in_service',),
+    'switch': ('closed',),
+}
+
+# Options of the linearized power flow (see GridModel._step)
+LINEAR_PF = {
+    'trust_band': 0.02,  # largest voltage change from the operating point [p.u.]
+    'check_every': 0,    # compare every Nth linear step with a full solve (0: never)
+}
+
+# Entries of the net that do not change during a run, left out of checkpoints
+NET_STATIC = ('profiles', 'controller', 'std_types', 'output_writer')
+
+CACHE_VERSION = 1
+ID_MAPS = ('bus_id', 'load_id', 'sgen_id', 'line_id', 'trafo_id', 'switch_id',
+           'storage_id', 'slack_bus_idx')
+
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def cache_dir(gridfile):
+    return Path(str(gridfile) + '.ppcache')
+
+
+# Caches kept in memory by preload(), by (grid file, grid index)
+_PRELOADED = {}
+
+
+def _preloaded(gridfile, grid_idx):
+    return _PRELOADED.get((os.path.realpath(gridfile), grid_idx))
+
+
+def _signature(gridfile, grid_idx):
+    return {
+        'sha256': file_hash(gridfile),
+        'grid_idx': grid_idx,
+        'pandapower': pp.__version__,
+        'mosaik_pandapower': importlib.metadata.version('mosaik-pandapower'),
+        'version': CACHE_VERSION,
+    }
+
+
+def _read_meta(gridfile, grid_idx):
+    """Metadata of the cache of *gridfile*, or ``None`` if there is no cache
+    or it was built from different content or library versions."""
+    preloaded = _preloaded(gridfile, grid_idx)
+    if preloaded is not None:
+        return preloaded['meta']
+    try:
+        with open(cache_dir(gridfile) / ('meta_%d.json' % grid_idx)) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get('source') != _signature(gridfile, grid_idx):
+        return None
+    return meta
+
+
+def _write_atomic(path, write):
+    # Several worker processes of a sweep may build the same cache at once
+    tmp = path.with_name('%s.%d.tmp' % (path.name, os.getpid()))
+    with open(tmp, 'wb' if path.suffix == '.pkl' else 'w') as f:
+        write(f)
+    os.replace(tmp, path)
+
+
+def entity_index(entity_map):
+    """Entity IDs by group, in the order of the children of the ``Grid``."""
+    eids = sorted(entity_map)
+    return {
+        'ext_gen': [eid for eid in eids if 'ext_gen' in eid],
+        'Bus': [eid for eid in eids if entity_map[eid]['etype'] == 'Bus'],
+        'Line': [eid for eid in eids if entity_map[eid]['etype'] == 'Line'],
+        'Load': [eid for eid in eids if entity_map[eid]['etype'] == 'Load'],
+    }
+
+
+def grid_index(gridfile, grid_idx=0):
+    """Cached :func:`entity_index` of *gridfile*, or ``None`` if the grid has
+    not been cached yet."""
+    meta = _read_meta(gridfile, grid_idx)
+    return meta['index'] if meta is not None else None
+
+
+def _load_state(gridfile, grid_idx):
+    """Cached state of *gridfile*, or ``None`` if there is no valid cache."""
+    preloaded = _preloaded(gridfile, grid_idx)
+    if preloaded is not None:
+        return pickle.loads(preloaded['state'])
+    if _read_meta(gridfile, grid_idx) is None:
+        return None
+    try:
+        with open(cache_dir(gridfile) / ('case_%d.pkl' % grid_idx), 'rb') as f:
+            return pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None
+
+
+def load_net(gridfile, grid_idx=0):
+    """The pandapower net of *gridfile* as the adapter sees it, with the
+    virtual ``ext_load``/``ext_gen`` elements of every bus.
+
+    The net is read from the cache, which is built first if needed. It is
+    meant for inspecting the tables (e.g. to place generators), not for
+    running a time series. With :func:`preload`, the same net is returned by
+    every call.
+
+    """
+    preloaded = _preloaded(gridfile, grid_idx)
+    if preloaded is not None:
+        return preloaded['net']
+    state = _load_state(gridfile, grid_idx)
+    if state is not None:
+        return state['net']
+    grid = GridModel()
+    grid.load_case(str(gridfile), grid_idx)
+    return grid.net
+
+
+class GridModel(model.pandapower):
+    def __init__(self):
+        super().__init__()
+        self.use_cache = True
+        self._groups = None
+
+        # Reaproveitamento do fluxo de potência (ver powerflow/powerflow_timeseries)
+        self.pf_reuse = True
+        self.warm_start = True
+        self._pf_inputs = None
+        self.pf_stats = {'solved': 0, 'warm_started': 0, 'skipped': 0,
+                         'iterations': 0, 'time_s': 0.}
+
+        # Fluxo de potência linearizado, desativado por padrão (ver _step)
+        self.linear = None
+        self._linear_model = None
+        self.pf_stats.update({'linear': 0, 'fallbacks': 0, 'checked': 0,
+                              'vm_error': 0., 'loading_error': 0.})
+
+    def powerflow(self):
+        """Conduct power flow, unless the inputs did not change."""
+        if self._unchanged():
+            return
+        warm = self.warm_start and not self.net.res_bus.empty
+        self._step(pp.runpp, self.net, numba=False, init='results' if warm else 'auto')
+
+    def powerflow_timeseries(self, time_step):
+        """Conduct a time series step; the profiles are applied first, the
+        power flow is skipped if they left the inputs unchanged."""
+        run_time_step(self.net, time_step, self.ts_variables, run_control_fct=self._run_control,
+                      _ppc=True, is_elements=True)
+
+    def _run_control(self, net, ctrl_variables=None, **kwargs):
+        if self._unchanged():
+            return
+        self._step(run_control, net, ctrl_variables=ctrl_variables, **kwargs)
+
+    def _step(self, func, net, **kwargs):
+        """Solve with the linear model if it is enabled and valid for the
+        current inputs, otherwise with *func* and linearize again."""
+        if self.linear is None:
+            return self._solve(func, net, **kwargs)
+
+        stats = self.pf_stats
+        linear = self._linear_model
+        voltages = linear.estimate(net) if linear is not None else None
+        if voltages is None:
+            stats['fallbacks'] += linear is not None
+            self._solve(func, net, **kwargs)
+            self._linear_model = (LinearPowerFlow(net, self.linear['trust_band'])
+                                  if net.converged else None)
+            return
+
+        results = linear.results(net, voltages)
+        stats['linear'] += 1
+        check = self.linear['check_every']
+        if check and stats['linear'] % check == 0:
+            # Passo de verificação: o resultado é o do cálculo completo
+            self._solve(func, net, **kwargs)
+            if net.converged:
+                self._linear_error(results)
+            return
+        linear.apply(net, results)
+        self._pf_inputs = self._input_vector() if self.pf_reuse else None
+
+    def _linear_error(self, results):
+        stats = self.pf_stats
+        stats['checked'] += 1
+        vm = results['res_bus']['vm_pu']
+        stats['vm_error'] = max(stats['vm_error'],
+                                np.nanmax(np.abs(vm - self.net.res_bus['vm_pu'].to_numpy()), initial=0.))
+        for table in ('res_line', 'res_trafo'):
+            if table not in results:
+                continue
+            full = self.net[table]['loading_percent'].to_numpy()[results[table]['rows']]
+            error = np.nanmax(np.abs(results[table]['loading_percent'] - full), initial=0.)
+            stats['loading_error'] = max(stats['loading_error'], error)
+
+    def _solve(self, func, net, **kwargs):
+        # A série temporal reaproveita a solução anterior (recycle) a partir do
+        # segundo passo; no modo 'pf', init='results' faz o mesmo
+        warm = (kwargs.get('init') == 'results'
+                or ('ctrl_variables' in kwargs and _internal_stored(net)))
+        self._pf_inputs = None
+        start = time.perf_counter()
+        try:
+            func(net, **kwargs)
+        finally:
+            self.pf_stats['time_s'] += time.perf_counter() - start
+        stats = self.pf_stats
+        stats['solved'] += 1
+        stats['warm_started'] += bool(warm)
+        stats['iterations'] += int((net._ppc or {}).get('iterations', 0))
+        if self.pf_reuse and net.converged:
+            self._pf_inputs = self._input_vector()
+
+    def _input_vector(self):
+        values = [self.net[table][column].to_numpy(dtype=float)
+                  for table, columns in PF_INPUTS.items() if table in self.net
+                  for column in columns if column in self.net[table]]
+        return np.concatenate(values) if values else np.zeros(0)
+
+    def _unchanged(self):
+        """Whether the inputs are those of the last converged solve; if so,
+        its results stay valid and the solve is counted as skipped."""
+        if self._pf_inputs is None or self.net.res_bus.empty:
+            return False
+        if not np.array_equal(self._input_vector(), self._pf_inputs, equal_nan=True):
+            return False
+        self.pf_stats['skipped'] += 1
+        return True
+
+    def get_state(self):
+        return {'net': {key: value for key, value in self.net.items() if key not in NET_STATIC},
+                'pf_inputs': self._pf_inputs, 'pf_stats': self.pf_stats}
+
+    def set_state(self, state):
+        for key, value in state['net'].items():
+            self.net[key] = value
+        self._pf_inputs = state['pf_inputs']
+        self.pf_stats = state['pf_stats']
+        self._linear_model = None
+
+    def get_cache_entries(self):
+        """Outputs of every entity, as the adapter's ``get_cache_entries``
+        returns them, reading each result table once."""
+        if self._groups is None or self._groups[0] != len(self.entity_map):
+            self._groups = (len(self.entity_map), self._entity_groups())
+
+        cache = {}
+        converged = not self.net.res_bus.empty
+        for etype, (eids, idx) in self._groups[1].items():
+            attrs = model.OUTPUT_ATTRS[etype]
+            if converged:
+                res = getattr(self.net, 'res_%s' % etype.lower())
+                if etype == 'Ext_grid':
+                    idx = np.zeros(len(eids), dtype=int)
+                values = res.loc[idx, attrs].to_numpy(dtype=float)
+            else:  # Failed to converge.
+                values = np.full((len(eids), len(attrs)), np.nan)
+            cache.update({eid: dict(zip(attrs, row)) for eid, row in zip(eids, values.tolist())})
+        return cache
+
+    def _entity_groups(self):
+        groups = {}
+        for eid, attrs in self.entity_map.items():
+            eids, idx = groups.setdefault(attrs['etype'], ([], []))
+            eids.append(eid)
+            idx.append(attrs['idx'])
+        return {etype: (eids, np.array(idx)) for etype, (eids, idx) in groups.items()}
+
+    def load_case(self, path, grid_idx):
+        if not self.use_cache or not os.path.isfile(path):
+            return super().load_case(path, grid_idx)
+
+        state = _load_state(path, grid_idx)
+        if state is not None:
+            return self._restore(state)
+
+        known = set(self.entity_map)
+        ppc, entity_map = super().load_case(path, grid_idx)
+        self._save(path, grid_idx, {eid: entity_map[eid] for eid in entity_map
+                                    if eid not in known})
+        return ppc, entity_map
+
+    def _save(self, path, grid_idx, entity_map):
+        # The OutputWriter preallocates the results of all time steps; it is
+        # recreated on load instead of being stored
+        output_writer = self.net.pop('output_writer', None)
+        try:
+            state = {'net': self.net, 'entity_map': entity_map}
+            state.update({name: getattr(self, name) for name in ID_MAPS})
+            meta = {'source': _signature(path, grid_idx), 'index': entity_index(entity_map)}
+
+            directory = cache_dir(path)
+            directory.mkdir(exist_ok=True)
+            _write_atomic(directory / ('case_%d.pkl' % grid_idx),
+                          lambda f: pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL))
+            _write_atomic(directory / ('meta_%d.json' % grid_idx),
+                          lambda f: json.dump(meta, f))
+        except OSError:
+            pass
+        finally:
+            if output_writer is not None:
+                self.net['output_writer'] = output_writer
+
+    def _restore(self, state):
+        """Set up the model like ``load_case`` does, from a cached *state*."""
+        self.net = state['net']
+        self.entity_map.update(state['entity_map'])
+        for name in ID_MAPS:
+            setattr(self, name, state[name])
+
+        if 'profiles' in self.net:
+            time_steps = range(0, len(self.net.profiles['load']))
+            output_dir = os.path.join(os.getcwd(), "time_series_example")
+            model.create_output_writer(self.net, time_steps, output_dir)
+            self.ts_variables = init_time_series(self.net, time_steps)
+
+        return self.net, self.entity_map
+
+
+class Pandapower(simulator.Pandapower):
+    def __init__(self):
+        super().__init__()
+        self.meta['models'] = copy.deepcopy(META['models'])
+        self.simulator = GridModel()
+        self._vectors = {}  # GenFleet/Feeder entity -> model and element indices
+
+    def init(self, sid, time_resolution, step_size, trigger=False, mode='pf',
+             use_cache=True, pf_reuse=True, warm_start=True, pf_report=False,
+             linear_pf=None, pf_inputs=False):
+        """*pf_reuse* skips power flows whose inputs did not change and
+        *warm_start* starts them from the last voltages; with *pf_report*
+        the counts of ``GridModel.pf_stats`` are printed at the end.
+        *linear_pf* (``True`` or a dict overriding ``LINEAR_PF``) enables
+        the linearized power flow. With *pf_inputs*, the ``pf_timeseries``
+        mode also solves the steps that have inputs, after applying them
+        (the original adapter leaves their results unchanged). The reuse,
+        the warm start and the linearized power flow only act on the steps
+        that solve: without *pf_inputs*, a scenario whose controllers send
+        setpoints every step solves only once."""
+        self.pf_inputs = pf_inputs
+        self.simulator.use_cache = use_cache
+        self.simulator.pf_reuse = pf_reuse
+        self.simulator.warm_start = warm_start
+        if linear_pf:
+            self.simulator.linear = dict(LINEAR_PF, **(linear_pf if isinstance(linear_pf, dict) else {}))
+        self.pf_report = pf_report
+        return super().init(sid, time_resolution, step_size, trigger, mode)
+
+    def finalize(self):
+        # A rede e o OutputWriter formam um ciclo que passa pelo DataFrame
+        # net['output_writer'], que o coletor de lixo não percorre: sem isso, cada
+        # execução no mesmo processo (workers de sweep e chunking) retém a rede e os
+        # resultados pré-alocados do ano inteiro
+        net = getattr(self.simulator, 'net', None)
+        if net is not None:
+            net.pop('output_writer', None)
+        if self.pf_report:
+            stats = self.simulator.pf_stats
+            total = stats['solved'] + stats['skipped']
+            print('%s: %d power flows, %d skipped (unchanged inputs), %d warm-started, '
+                  '%.2f iterations per solve, %.2f s solving'
+                  % (self.sid, total, stats['skipped'], stats['warm_started'],
+                     stats['iterations'] / max(stats['solved'], 1), stats['time_s']))
+            if self.simulator.linear is not None:
+                print('%s: %d linear steps, %d fallbacks to the full solver; largest error '
+                      'in %d checks: %.2e p.u. (voltage), %.3f %% (loading)'
+                      % (self.sid, stats['linear'], stats['fallbacks'], stats['checked'],
+                         stats['vm_error'], stats['loading_error']))
+
+    def get_state(self):
+        """State for a checkpoint (see :mod:`simulators.checkpoint`)."""
+        return {'time_step_index': self.time_step_index, 'model': self.simulator.get_state()}
+
+    def set_state(self, state):
+        self.time_step_index = state['time_step_index']
+        self.simulator.set_state(state['model'])
+
+    def create(self, num, modelname, **params):
+        if modelname == 'GenFleet':
+            return [self._create_fleet(**params) for _ in range(num)]
+        if modelname == 'Feeder':
+            return [self._create_feeder() for _ in range(num)]
+        grids = super().create(num, modelname, **params)
+        # Verificado aqui, antes da execução: no primeiro passo, o erro encerraria o mundo
+        reason = unsupported(self.simulator.net) if self.simulator.linear is not None else None
+        if reason is not None:
+            raise ValueError('linear_pf cannot be used with %s: %s; use the full power flow'
+                             % (params.get('gridfile'), reason))
+        return grids
+
+    def _create_fleet(self, generators):
+        eid = 'GenFleet_%d' % sum(v['model'] == 'GenFleet' for v in self._vectors.values())
+        generators = [g.split('.', 1)[1] if g.startswith(self.sid + '.') else g
+                      for g in generators]
+        unknown = [g for g in generators
+                   if self._entities.get(g, {}).get('etype') != 'Sgen']
+        if unknown:
+            raise ValueError('GenFleet generators are not Sgen entities of the grid: %s'
+                             % ', '.join(unknown[:5]))
+        sgen = np.array([self._entities[g]['idx'] for g in generators], dtype=int)
+        net = self.simulator.net
+        self._vectors[eid] = {'model': 'GenFleet', 'sgen': sgen,
+                              'bus': net.sgen.bus.loc[sgen].to_numpy()}
+        # Os geradores da frota recebem setpoints de outro simulador
+        net.sgen.loc[sgen, 'in_service'] = True
+        return {'eid': eid, 'type': 'GenFleet', 'rel': generators}
+
+    def _create_feeder(self):
+        if not self._entities:
+            raise ValueError('A Grid has to be created before its Feeder')
+        eid = 'Feeder_%d' % sum(v['model'] == 'Feeder' for v in self._vectors.values())
+        index = entity_index(self._entities)
+        self._vectors[eid] = {
+            'model': 'Feeder',
+            'bus': np.array([self._entities[e]['idx'] for e in index['Bus']], dtype=int),
+            'line': np.array([self._entities[e]['idx'] for e in index['Line']], dtype=int),
+            'sgen': np.array([self._entities[e]['idx'] for e in index['ext_gen']], dtype=int),
+        }
+        return {'eid': eid, 'type': 'Feeder', 'rel': []}
+
+    def step(self, time, inputs, max_advance):
+        # Os vetores de setpoints são aplicados em bloco; as demais entradas seguem
+        # o caminho do mosaik_pandapower. Como no adaptador original, um passo com
+        # entradas não executa o fluxo de potência da série temporal, a menos que
+        # pf_inputs tenha sido informado.
+        vector_inputs = {eid: inputs.pop(eid) for eid in list(inputs) if eid in self._vectors}
+        for eid, attrs in vector_inputs.items():
+            self._set_vector_inputs(eid, attrs)
+        if not vector_inputs and not self.pf_inputs:
+            return super().step(time, inputs, max_advance)
+
+        for eid, attrs in inputs.items():
+            entity = self._entities[eid]
+            for name, values in attrs.items():
+                if name in ('in_service', 'controllable'):
+                    attrs[name] = next(iter(values.values()))
+                else:
+                    attrs[name] = sum(float(v) for v in values.values())
+            self.simulator.set_inputs(entity['etype'], entity['idx'], attrs, entity['static'])
+
+        if self.mode == 'pf':
+            self.simulator.powerflow()
+        elif self.mode == 'pf_timeseries' and self.pf_inputs:
+            self.simulator.powerflow_timeseries(self.time_step_index)
+        self._cache = self.simulator.get_cache_entries()
+        self.time_step_index += 1
+        return time + self.step_size if self.step_size else None
+
+    def _set_vector_inputs(self, eid, attrs):
+        entity = self._vectors[eid]
+        sgen = entity['sgen']
+        columns = VECTOR_INPUTS[entity['model']]
+        net = self.simulator.net
+        for name, values in attrs.items():
+            if name not in columns:
+                raise ValueError('Unknown input attribute "%s" for %s' % (name, eid))
+            # Setpoints de várias fontes são somados, como no adaptador original
+            total = None
+            for value in values.values():
+                value = np.broadcast_to(np.asarray(value, dtype=float), sgen.shape)
+                total = value if total is None else total + value
+            mask = ~np.isnan(total)
+            net.sgen.loc[sgen[mask], columns[name]] = total[mask]
+            if entity['model'] == 'Feeder':
+                net.sgen.loc[sgen[mask], 'in_service'] = True
+
+    def get_data(self, outputs):
+        # O dicionário outputs é o do mosaik, reutilizado a cada passo: não é alterado
+        vector_outputs = {eid: attrs for eid, attrs in outputs.items() if eid in self._vectors}
+        data = super().get_data({eid: attrs for eid, attrs in outputs.items()
+                                 if eid not in self._vectors})
+        net = self.simulator.net
+        for eid, attrs in vector_outputs.items():
+            entity = self._vectors[eid]
+            data[eid] = {}
+            for attr in attrs:
+                try:
+                    table, column, elements = VECTOR_OUTPUTS[entity['model']][attr]
+                except KeyError:
+                    raise ValueError('Unknown attribute "%s" for %s' % (attr, eid)) from None
+                idx = entity[elements]
+                if table.startswith('res_') and net.res_bus.empty:  # não convergiu
+                    data[eid][attr] = np.full(len(idx), np.nan)
+                else:
+                    data[eid][attr] = net[table][column].loc[idx].to_numpy(dtype=float)
+        return data
+
+
+def build_cache(gridfile, grid_idx=0):
+    """Load *gridfile* once so that its cache exists; returns the entity
+    index of the grid."""
+    GridModel().load_case(str(gridfile), grid_idx)
+    return grid_index(gridfile, grid_idx)
+
+
+def preload(gridfile, grid_idx=0):
+    """Keep the cache of *gridfile* in memory for the rest of the process,
+    building it first if needed.
+
+    Every later load of the grid in the process unpickles a fresh copy of
+    the state from memory (the runs change the net) and :func:`load_net`
+    returns one shared net, so the cache files are read and the grid file is
+    hashed only once per process.
+
+    """
+    key = (os.path.realpath(gridfile), grid_idx)
+    _PRELOADED.pop(key, None)
+    if _read_meta(gridfile, grid_idx) is None:
+        build_cache(gridfile, grid_idx)
+    meta = _read_meta(gridfile, grid_idx)
+    if meta is None:
+        return None
+    with open(cache_dir(gridfile) / ('case_%d.pkl' % grid_idx), 'rb') as f:
+        state = f.read()
+    _PRELOADED[key] = {'meta': meta, 'state': state, 'net': pickle.loads(state)['net']}
+    return meta['index']
+
+
+def main():
+    return mosaik_api.start_simulation(Pandapower(), 'The mosaik-Pandapower adapter')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+"""
+Opt-in timing and profiling of the simulators of a scenario.
+
+:class:`Instrumentation` wraps ``step`` and ``get_data`` of every Python
+simulator class named in a ``sim_config`` and records the wall time, the
+number of calls and the payload size (number of input or output values) of
+each call. At the end it prints a summary table and, optionally, dumps a
+cProfile of the whole run for ``pstats``/``snakeviz``::
+
+    with Instrumentation(sim_config, profile_dump='run.prof') as inst:
+        world.run(until=END)
+
+The wrappers are installed on the classes only inside the ``with`` block.
+``base_scenario.run_cosimul(profile=True)`` and the environment variables
+``TSRE_PROFILE=1`` / ``TSRE_PROFILE_DUMP=<file>`` enable it for a run.
+
+"""
+import cProfile
+import functools
+import importlib
+import io
+import os
+import pstats
+import time
+
+import numpy as np
+
+METHODS = ('step', 'get_data')
+
+
+def payload_size(data):
+    """Number of leaf values in the nested input/output dicts of mosaik."""
+    if isinstance(data, dict):
+        return sum(payload_size(value) for value in data.values())
+    if isinstance(data, np.ndarray):
+        return data.size
+    if isinstance(data, (list, tuple)):
+        return len(data)
+    return 1
+
+
+class CallStats:
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.
+        self.max = 0.
+        self.payload = 0
+
+    def add(self, elapsed, payload):
+        self.calls += 1
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+        self.payload += payload
+
+
+class Instrumentation:
+    """Record per-call timings of the simulators in *sim_config*.
+
+    Only entries started in-process (``'python'``) can be wrapped; entries
+    started as separate processes (``'cmd'``) are skipped.
+
+    """
+
+    def __init__(self, sim_config, profile_dump=None):
+        self.classes = {}
+        for name, config in sim_config.items():
+            if 'python' in config:
+                mod_name, cls_name = config['python'].split(':')
+                self.classes[name] = getattr(importlib.import_module(mod_name), cls_name)
+        self.profile_dump = profile_dump
+        self.stats = {}
+        self._originals = []
+        self._profiler = None
+        self._start = None
+        self.elapsed = None
+
+    def install(self):
+        for name, cls in self.classes.items():
+            for method in METHODS:
+                if any(c is cls and m == method for c, m, _ in self._originals):
+                    continue
+                original = cls.__dict__.get(method)
+                stats = self.stats.setdefault((name, method), CallStats())
+                setattr(cls, method, self._wrap(getattr(cls, method), method, stats))
+                self._originals.append((cls, method, original))
+
+        if self.profile_dump:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        self._start = time.perf_counter()
+
+    def uninstall(self):
+        self.elapsed = time.perf_counter() - self._start
+        if self._profiler is not None:
+            self._profiler.disable()
+            self._profiler.dump_stats(self.profile_dump)
+
+        for cls, method, original in reversed(self._originals):
+            if original is None:
+                delattr(cls, method)
+            else:
+                setattr(cls, method, original)
+        self._originals = []
+
+    def __enter__(self):
+        self.install()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.uninstall()
+        print(self.summary())
+        if self._profiler is not None:
+            print(self.profile_summary())
+
+    @staticmethod
+    def _wrap(func, method, stats):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            t0 = time.perf_counter()
+            result = func(self, *args, **kwargs)
+            elapsed = time.perf_counter() - t0
+            if method == 'step':
+                # step(time, inputs, max_advance): size of the inputs
+                payload = payload_size(args[1] if len(args) > 1 else kwargs.get('inputs', {}))
+            else:
+                payload = payload_size(result)
+            stats.add(elapsed, payload)
+            return result
+        return wrapper
+
+    def summary(self):
+        """Table of the recorded calls, sorted by total time."""
+        header = '%-10s %-9s %8s %10s %7s %11s %11s %12s' % (
+            'simulator', 'method', 'calls', 'total [s]', 'share', 'mean [ms]', 'max [ms]',
+            'values/call')
+        lines = [header, '-' * len(header)]
+        rows = sorted(self.stats.items(), key=lambda item: item[1].total, reverse=True)
+        for (name, method), stats in rows:
+            if not stats.calls:
+                continue
+            lines.append('%-10s %-9s %8d %10.3f %6.1f%% %11.3f %11.3f %12.1f' % (
+                name, method, stats.calls, stats.total,
+                100 * stats.total / self.elapsed if self.elapsed else 0.,
+                1e3 * stats.total / stats.calls, 1e3 * stats.max,
+                stats.payload / stats.calls))
+        simulators = sum(stats.total for stats in self.stats.values())
+        lines.append('-' * len(header))
+        lines.append('simulators: %.3f s of %.3f s wall time (%.3f s in mosaik)'
+                     % (simulators, self.elapsed, self.elapsed - simulators))
+        return '\n'.join(lines)
+
+    def profile_summary(self, limit=20):
+        """Top *limit* functions of the cProfile dump by cumulative time."""
+        out = io.StringIO()
+        out.write('cProfile written to %s\n' % self.profile_dump)
+        pstats.Stats(self.profile_dump, stream=out).sort_stats('cumulative').print_stats(limit)
+        return out.getvalue()
+
+
+def from_environment(sim_config, profile=None, profile_dump=None):
+    """Return an :class:`Instrumentation` if enabled by the arguments or by
+    ``TSRE_PROFILE`` / ``TSRE_PROFILE_DUMP``, else ``None``."""
+    if profile_dump is None:
+        profile_dump = os.environ.get('TSRE_PROFILE_DUMP') or None
+    if profile is None:
+        profile = os.environ.get('TSRE_PROFILE', '').lower() not in ('', '0', 'false', 'no')
+    if not (profile or profile_dump):
+        return None
+    return Instrumentation(sim_config, profile_dump)
@@ -0,0 +1,141 @@
+"""
+Operating limits of the grid, checked at every step of a run.
+
+The ``Limits`` entity takes ``vm_pu`` and ``loading_percent`` values, as
+vectors from the ``Feeder`` of :mod:`simulators.grid_sim` (named by the
+``labels`` of the entity, ``{attr: [name, ...]}``) or as scalars of single
+buses and lines (named by their source). At the first step where a voltage is
+outside ``[vm_min, vm_max]`` or a loading is above ``loading_max``, the
+limits keep a :class:`LimitViolation` with the worst violation of the step in
+:attr:`Limits.error` and call the *end_run* callable, ``end_run(time)``,
+which ends the run after that step. The scenario passes one that stops the
+world (see :func:`scenarios.base_scenario.end_run`), and ``run_cosimul``
+raises :attr:`Limits.error` once ``world.run()`` has returned, so a run that
+only has to tell whether a case respects the limits stops as soon as it does
+not. Without *end_run*, the exception is raised from ``step`` instead.
+
+*stop* is an optional callable ``stop(time) -> bool``, polled at every step;
+if it returns true, the run ends the same way with :class:`RunStopped`
+(e.g. when a parallel run already showed the outcome, see
+:mod:`scenarios.hosting_capacity`).
+
+"""
+import numpy as np
+
+import mosaik_api
+
+META = {
+    'type': 'event-based',
+    'models': {
+        'Limits': {
+            'public': True,
+            'params': ['labels'],
+            'attrs': ['vm_pu', 'loading_percent'],
+        },
+    },
+}
+
+LIMITS = {'vm_min': 0.95, 'vm_max': 1.05, 'loading_max': 100.}
+
+
+class LimitViolation(RuntimeError):
+    """*element* violated the limit *constraint* (a key of ``LIMITS``) with
+    *value* at *time*."""
+
+    def __init__(self, time, constraint, element, value, limit):
+        super().__init__('%s = %g at %s exceeds %s = %g at t = %d s'
+                         % (constraint.split('_')[0], value, element, constraint, limit, time))
+        self.time = time
+        self.constraint = constraint
+        self.element = element
+        self.value = value
+        self.limit = limit
+
+
+class RunStopped(RuntimeError):
+    """The *stop* callable of the limits ended the run at *time*."""
+
+    def __init__(self, time):
+        super().__init__('Run stopped at t = %d s' % time)
+        self.time = time
+
+
+class Limits(mosaik_api.Simulator):
+    def __init__(self):
+        super().__init__(META)
+        self.eid = None
+        self.labels = {}
+        self.stop = None
+        self.end_run = None
+        self.error = None  # LimitViolation ou RunStopped que encerrou a execução
+
+    def init(self, sid, time_resolution, vm_min=LIMITS['vm_min'], vm_max=LIMITS['vm_max'],
+             loading_max=LIMITS['loading_max'], stop=None, end_run=None):
+        # Limites (inferior, superior) de cada atributo, com o nome de cada um
+        self.bounds = {
+            'vm_pu': (('vm_min', vm_min), ('vm_max', vm_max)),
+            'loading_percent': (None, ('loading_max', loading_max)),
+        }
+        self.stop = stop
+        self.end_run = end_run
+        return self.meta
+
+    def create(self, num, model, labels=None):
+        if num > 1 or self.eid is not None:
+            raise RuntimeError('Can only create one instance of Limits.')
+        self.eid = 'Limits'
+        self.labels = labels or {}
+        return [{'eid': self.eid, 'type': model}]
+
+    def step(self, time, inputs, max_advance):
+        if self.error is not None:
+            return None  # passos já em andamento quando a execução foi encerrada
+        if self.stop is not None and self.stop(time):
+            return self._end(RunStopped(time))
+
+        worst = None
+        for attr, values in inputs.get(self.eid, {}).items():
+            for src, value in values.items():
+                if value is None:
+                    continue
+                value = np.atleast_1d(np.asarray(value, dtype=float))
+                for bound, sign in zip(self.bounds[attr], (-1, 1)):
+                    if bound is None:
+                        continue
+                    constraint, limit = bound
+                    # Violação relativa ao limite; nan não viola
+                    excess = np.nan_to_num(sign * (value - limit) / abs(limit), nan=-1.)
+                    i = int(np.argmax(excess))
+                    if excess[i] > 0 and (worst is None or excess[i] > worst[0]):
+                        worst = (excess[i], constraint, self._name(src, attr, i, value.size),
+                                 value[i], limit)
+        if worst is not None:
+            return self._end(LimitViolation(time, *worst[1:]))
+        return None
+
+    def _end(self, error):
+        if self.end_run is None:
+            raise error
+        self.error = error
+        self.end_run(error.time)
+        return None
+
+    def _name(self, src, attr, i, size):
+        names = self.labels.get(attr)
+        if names is not None and len(names) == size:
+            return names[i]
+        return src if size == 1 else '%s.%d' % (src, i)
+
+    def get_data(self, outputs):
+        return {}
+
+    def get_state(self):
+        """State for a checkpoint; the limits carry none between steps."""
+        return None
+
+    def set_state(self, state):
+        pass
+
+
+if __name__ == '__main__':
+    mosaik_api.start_simulation(Limits())
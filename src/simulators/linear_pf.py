@@ -0,0 +1,234 @@
+"""
+Linearized power flow for screening studies.
+
+:class:`LinearPowerFlow` takes a converged pandapower net as operating point
+and factorizes the power flow Jacobian at its voltages once. The voltages of
+a later step are then estimated from the change of the bus injections of
+loads, sgens and storages (two triangular solves with the stored
+factorization), and the branch, slack and element results are derived from
+them with the admittance matrices of the same solve, so no Newton-Raphson
+iteration runs.
+
+The estimate is only valid close to the operating point: :meth:`estimate`
+returns ``None`` when the topology, tap positions or slack voltage changed
+(see ``STRUCTURE``) or when a voltage moved more than ``trust_band`` p.u.
+from it, and the caller is expected to run the full solver and build a new
+model. Nets with PV generators (``gen``) or more than one slack bus are not
+supported (see :func:`unsupported`) and raise ``ValueError``.
+
+"""
+import numpy as np
+import scipy.sparse as sp
+
+from scipy.sparse.linalg import splu
+
+from pandapower.pypower.dSbus_dV import dSbus_dV
+from pandapower.pypower.idx_bus import BASE_KV
+
+# Columns of the net that define the linearization; a change needs a full solve
+STRUCTURE = {
+    'bus': ('in_service',),
+    'ext_grid': ('vm_pu', 'va_degree', 'in_service'),
+    'trafo': ('tap_pos', 'in_service'),
+    'line': ('in_service',),
+    'switch': ('closed',),
+}
+# Elements whose powers are the inputs of the model, and their sign as injection
+INJECTIONS = {'load': -1., 'sgen': 1., 'storage': -1.}
+
+LINE_COLUMNS = ('p_from_mw', 'q_from_mvar', 'p_to_mw', 'q_to_mvar', 'pl_mw', 'ql_mvar',
+                'i_from_ka', 'i_to_ka', 'i_ka', 'vm_from_pu', 'va_from_degree',
+                'vm_to_pu', 'va_to_degree', 'loading_percent')
+TRAFO_COLUMNS = ('p_hv_mw', 'q_hv_mvar', 'p_lv_mw', 'q_lv_mvar', 'pl_mw', 'ql_mvar',
+                 'i_hv_ka', 'i_lv_ka', 'vm_hv_pu', 'va_hv_degree', 'vm_lv_pu',
+                 'va_lv_degree', 'loading_percent')
+
+
+def unsupported(net):
+    """Why *net* cannot be linearized, or None if it can; checked from the
+    element tables, before any power flow."""
+    if 'gen' in net and net.gen['in_service'].any():
+        return 'it has PV generators (gen)'
+    if 'ext_grid' in net and net.ext_grid['in_service'].sum() > 1:
+        return 'it has more than one slack bus (ext_grid)'
+    return None
+
+
+def structure_vector(net):
+    values = [net[table][column].to_numpy(dtype=float)
+              for table, columns in STRUCTURE.items() if table in net
+              for column in columns if column in net[table]]
+    return np.concatenate(values) if values else np.zeros(0)
+
+
+def element_powers(net, table):
+    """Active and reactive power of the in-service elements of *table* [MW, MVAr]."""
+    df = net[table]
+    factor = df['scaling'].to_numpy(dtype=float) * df['in_service'].to_numpy(dtype=float)
+    return df['p_mw'].to_numpy(dtype=float) * factor, df['q_mvar'].to_numpy(dtype=float) * factor
+
+
+class LinearPowerFlow:
+    def __init__(self, net, trust_band=0.02):
+        internal = (net._ppc or {}).get('internal')
+        if internal is None or not net.converged:
+            raise ValueError('the net has no converged power flow to linearize')
+        ref, pv, pq = (np.asarray(internal[key], dtype=int) for key in ('ref', 'pv', 'pq'))
+        if len(ref) != 1 or len(pv) or ('gen' in net and net.gen['in_service'].any()):
+            raise ValueError('only nets with a single slack and no PV generators are supported')
+
+        self.trust_band = trust_band
+        self.structure = structure_vector(net)
+        self.base_mva = float(internal['baseMVA'])
+        self.ref, self.pvpq, self.pq = ref[0], np.r_[pv, pq], pq
+        self.ybus = internal['Ybus'].tocsr()
+        self.yf, self.yt = internal['Yf'].tocsr(), internal['Yt'].tocsr()
+        self.v0 = np.asarray(internal['V'], dtype=complex)
+        self.vm0, self.va0 = np.abs(self.v0), np.angle(self.v0)
+        base_kv = internal['bus'][:, BASE_KV]
+        nbus = len(self.v0)
+
+        # Derivadas de P (barras PV e PQ) e Q (barras PQ) em relação a Va e Vm
+        ds_dvm, ds_dva = dSbus_dV(self.ybus, self.v0)
+        jac = sp.vstack([
+            sp.hstack([ds_dva[self.pvpq][:, self.pvpq].real, ds_dvm[self.pvpq][:, self.pq].real]),
+            sp.hstack([ds_dva[self.pq][:, self.pvpq].imag, ds_dvm[self.pq][:, self.pq].imag]),
+        ])
+        self.lu = splu(sp.csc_matrix(jac))
+
+        # Incidência dos elementos nas barras internas e nas linhas de res_bus
+        lookup = net._pd2ppc_lookups['bus']
+        self.incidence, self.bus_incidence = {}, {}
+        for table, sign in INJECTIONS.items():
+            if table not in net or net[table].empty:
+                continue
+            buses = net[table]['bus'].to_numpy()
+            ppci = lookup[buses]
+            valid = (ppci >= 0) & (ppci < nbus)
+            cols = np.flatnonzero(valid)
+            self.incidence[table] = sp.csr_matrix(
+                (np.full(len(cols), sign), (ppci[valid], cols)), shape=(nbus, len(buses)))
+            rows = net.res_bus.index.get_indexer(buses)
+            valid = rows >= 0
+            cols = np.flatnonzero(valid)
+            self.bus_incidence[table] = sp.csr_matrix(
+                (np.full(len(cols), sign), (rows[valid], cols)),
+                shape=(len(net.res_bus), len(buses)))
+        self.p0, self.q0 = self._injections(net)
+        self.elements0 = {table: element_powers(net, table) for table in self.incidence}
+
+        bus_ppci = lookup[net.res_bus.index.to_numpy()]
+        self.bus_valid = (bus_ppci >= 0) & (bus_ppci < nbus)
+        self.bus_ppci = bus_ppci[self.bus_valid]
+        self.bus_p0 = net.res_bus['p_mw'].to_numpy(dtype=float)
+        self.bus_q0 = net.res_bus['q_mvar'].to_numpy(dtype=float)
+        self.ext_bus = net.res_bus.index.get_indexer(net.ext_grid['bus'][net.ext_grid['in_service']])
+        self.s_ref0 = self._slack_injection(self.v0)
+        self.ext0 = complex(net.res_ext_grid['p_mw'].iloc[0], net.res_ext_grid['q_mvar'].iloc[0])
+
+        # Ramos em serviço: posição na tabela de resultados e linha de Yf/Yt
+        ppci_row = np.cumsum(internal['branch_is']) - 1
+        self.branches = {}
+        f_bus, t_bus = internal['branch'][:, 0].real.astype(int), internal['branch'][:, 1].real.astype(int)
+        for table, (start, stop) in net._pd2ppc_lookups.get('branch', {}).items():
+            if table not in ('line', 'trafo'):
+                continue
+            is_in = internal['branch_is'][start:stop]
+            rows = ppci_row[start:stop][is_in]
+            df = net[table][is_in]
+            if table == 'line':
+                i_max = (df['max_i_ka'] * df['df'] * df['parallel']).to_numpy(dtype=float)
+                rating = (np.ones(len(df)), np.ones(len(df)), i_max)
+            else:
+                # Carregamento pela corrente (trafo_loading='current')
+                limit = (df['sn_mva'] * df['parallel'] * df['df']).to_numpy(dtype=float)
+                rating = (df['vn_hv_kv'].to_numpy(dtype=float), df['vn_lv_kv'].to_numpy(dtype=float),
+                          limit / np.sqrt(3))
+            self.branches[table] = (np.flatnonzero(is_in), rows, f_bus[rows], t_bus[rows],
+                                    base_kv[f_bus[rows]], base_kv[t_bus[rows]], rating)
+
+    def _injections(self, net):
+        nbus = len(self.v0)
+        p, q = np.zeros(nbus), np.zeros(nbus)
+        for table, incidence in self.incidence.items():
+            p_el, q_el = element_powers(net, table)
+            p += incidence @ p_el
+            q += incidence @ q_el
+        return p, q
+
+    def _slack_injection(self, v):
+        ref = self.ref
+        return v[ref] * np.conj(self.ybus[ref] @ v)[0] * self.base_mva
+
+    def estimate(self, net):
+        """Complex bus voltages for the current inputs of *net*, in the
+        internal bus order, or ``None`` if the model is not valid for them."""
+        if not np.array_equal(structure_vector(net), self.structure, equal_nan=True):
+            return None
+        p, q = self._injections(net)
+        rhs = np.r_[(p - self.p0)[self.pvpq], (q - self.q0)[self.pq]] / self.base_mva
+        dx = self.lu.solve(rhs)
+        va, vm = self.va0.copy(), self.vm0.copy()
+        va[self.pvpq] += dx[:len(self.pvpq)]
+        vm[self.pq] += dx[len(self.pvpq):]
+        if np.max(np.abs(vm - self.vm0), initial=0.) > self.trust_band:
+            return None
+        return vm * np.exp(1j * va)
+
+    def results(self, net, v):
+        """Result columns for the voltages *v*: ``{table: {column: values}}``,
+        with the row positions of the branch tables under ``'rows'``."""
+        vm, va = np.abs(v), np.degrees(np.angle(v))
+        res = {}
+
+        bus_p, bus_q = self.bus_p0.copy(), self.bus_q0.copy()
+        for table, incidence in self.bus_incidence.items():
+            p_el, q_el = element_powers(net, table)
+            p0_el, q0_el = self.elements0[table]
+            bus_p -= incidence @ (p_el - p0_el)
+            bus_q -= incidence @ (q_el - q0_el)
+            res['res_' + table] = {'p_mw': p_el, 'q_mvar': q_el}
+
+        # Slack: injeção calculada menos a variação das cargas na própria barra
+        p, q = self._injections(net)
+        ds = (self._slack_injection(v) - self.s_ref0
+              - complex(p[self.ref] - self.p0[self.ref], q[self.ref] - self.q0[self.ref]))
+        ext = self.ext0 + ds
+        res['res_ext_grid'] = {'p_mw': np.array([ext.real]), 'q_mvar': np.array([ext.imag])}
+        bus_p[self.ext_bus] -= ext.real - self.ext0.real
+        bus_q[self.ext_bus] -= ext.imag - self.ext0.imag
+
+        res_vm = np.full(len(self.bus_valid), np.nan)
+        res_va = np.full(len(self.bus_valid), np.nan)
+        res_vm[self.bus_valid], res_va[self.bus_valid] = vm[self.bus_ppci], va[self.bus_ppci]
+        res['res_bus'] = {'vm_pu': res_vm, 'va_degree': res_va, 'p_mw': bus_p, 'q_mvar': bus_q}
+
+        i_f, i_t = self.yf @ v, self.yt @ v
+        for table, (pos, rows, f, t, kv_f, kv_t, rating) in self.branches.items():
+            s_f = v[f] * np.conj(i_f[rows]) * self.base_mva
+            s_t = v[t] * np.conj(i_t[rows]) * self.base_mva
+            ka_f = np.abs(i_f[rows]) * self.base_mva / (np.sqrt(3) * kv_f)
+            ka_t = np.abs(i_t[rows]) * self.base_mva / (np.sqrt(3) * kv_t)
+            vn_f, vn_t, limit = rating
+            loading = np.maximum(ka_f * vn_f, ka_t * vn_t) / limit * 100.
+            columns = LINE_COLUMNS if table == 'line' else TRAFO_COLUMNS
+            values = (s_f.real, s_f.imag, s_t.real, s_t.imag, (s_f + s_t).real, (s_f + s_t).imag,
+                      ka_f, ka_t)
+            if table == 'line':
+                values += (np.maximum(ka_f, ka_t),)
+            values += (vm[f], va[f], vm[t], va[t], loading)
+            res['res_' + table] = dict(zip(columns, values), rows=pos)
+        return res
+
+    def apply(self, net, res):
+        """Write *res* (from :meth:`results`) to the result tables of *net*."""
+        for table, columns in res.items():
+            df = net[table]
+            rows = columns.get('rows')
+            for column, values in columns.items():
+                if column == 'rows':
+                    continue
+                if rows is None:
+                    df[column] = values
+                else:
+                    df.iloc[rows, df.columns.get_loc(column)] = values
@@ -1,9 +1,47 @@
-from numpy import sin, cos, tan, arcsin, arccos, arctan2, nan, pi, isnan, radians
+from numpy import (sin, cos, tan, arcsin, arccos, arctan2, nan, pi, isnan, radians,
+                   maximum, where)
 import arrow
+import numpy as np
 
 DATE_FORMAT = 'YYYY-MM-DD HH:mm:ss'
 
 
+def incidence_cos(index, lat, el_tilt, az_tilt):
+    """Calculate the cosine of the incidence angle for every time of *index*
+    (a pandas ``DatetimeIndex``), ``nan`` while the sun is below the horizon.
+
+    *lat*, *el_tilt* and *az_tilt* are in radians, either scalars (the result
+    has one value per time) or arrays with one value per panel (the result
+    has shape ``(len(index), n_panels)``).
+
+    """
+    dec = radians(23.45 * sin(2 * pi * (index.day.values - 81) / 365.0))
+    ha = radians(15 * (index.hour.values + index.minute.values / 60.0 - 12))
+    if np.ndim(lat) or np.ndim(el_tilt) or np.ndim(az_tilt):
+        dec, ha = dec[:, None], ha[:, None]
+    arg = cos(lat) * cos(dec) * cos(ha) + sin(lat) * sin(dec)
+    el = where(arg > 0, arcsin(arg), nan)
+    az = arctan2(sin(ha), sin(lat)*cos(ha) - cos(lat)
+                 *tan(dec))
+    ang = arccos(cos(el) * cos(az - az_tilt) * sin(el_tilt)
+                 + sin(el) * cos(el_tilt))
+    return cos(ang)
+
+
+def power_from_incidence(dni, cos_incidence, area, efficiency):
+    """Calculate the active power output from *dni* and the cosine of the
+    incidence angle (``nan`` while the sun is down), for scalars or arrays."""
+    rn = where(isnan(cos_incidence), 0, maximum(0, dni * cos_incidence))
+    return panel_power(rn, area, efficiency)
+
+
+def panel_power(rn, area, efficiency):
+    """Active power output for the normal radiation *rn*."""
+    p = area * efficiency * rn
+    p = 7 * p
+    return p/1000000000  #adicionei 2 casas a mais (TIREI UMA CASA) p = 1250
+
+
 class PVpanel:
 
     def __init__(self, lat, area=1, efficiency=0.2, el_tilt=0, az_tilt=0,
@@ -22,9 +60,25 @@ class PVpanel:
     def power(self, dni):
         """Calculate the PV panels active power output output based on the
         irradiation input and current time."""
-        p = self.area * self.efficiency * self._radiation_normal(dni) 
-        p = 7 * p
-        return p/1000000000  #adicionei 2 casas a mais (TIREI UMA CASA) p = 1250
+        return self._power(self._radiation_normal(dni))
+
+    def power_series(self, index, dni):
+        """Calculate the active power output for every time of *index* (a
+        pandas ``DatetimeIndex``) and the matching array of *dni* values."""
+        return self.power_from_incidence(dni, self.incidence_cos(index))
+
+    def power_from_incidence(self, dni, cos_incidence):
+        """Calculate the active power output from *dni* and a precomputed
+        cosine of the incidence angle (``nan`` while the sun is down)."""
+        return power_from_incidence(dni, cos_incidence, self.area, self.efficiency)
+
+    def incidence_cos(self, index):
+        """Calculate the cosine of the incidence angle for every time of
+        *index* at once, ``nan`` while the sun is below the horizon."""
+        return incidence_cos(index, self.lat, self.el_tilt, self.az_tilt)
+
+    def _power(self, rn):
+        return panel_power(rn, self.area, self.efficiency)
 
     def step_time(self, step_size):
         """Advance the current model time"""
@@ -36,12 +90,12 @@ class PVpanel:
         if isnan(ang):
             return 0
         else:
-            rn = dni * cos(self._incidence_angle())
+            rn = dni * cos(ang)
             return max(0, rn)
 
     def _incidence_angle(self):
         el = self._elevation()
-        az = self._azimuth()
+        az = self._azimuth(el)
         ang = arccos(cos(el) * cos(az - self.az_tilt) * sin(self.el_tilt)
                      + sin(el) * cos(self.el_tilt))
         return float(ang)  # conversion from numpy float
@@ -57,10 +111,11 @@ class PVpanel:
         else:
             return nan
 
-    def _azimuth(self):
+    def _azimuth(self, el=None):
         dec = self._declination()
         ha = self._hour_angle()
-        el = self._elevation()
+        if el is None:
+            el = self._elevation()
         # Formula from "Fundamentals of Renewable Energy Processes" (da Rosa)
         az = arctan2(sin(ha), sin(self.lat)*cos(ha) - cos(self.lat)
                      *tan(dec))
@@ -76,6 +131,50 @@ class PVpanel:
     def _declination(self):
         arg = 23.45 * sin(2 * pi * (self.date.day - 81) / 365.0)
         return radians(arg)
+
+
+class PVFleet:
+    """N PV panels whose parameters are stored in contiguous arrays, so the
+    output of every panel is computed in one vectorized update.
+
+    Each parameter may be a scalar (shared by all panels) or a sequence with
+    one value per panel. All panels share one clock, advanced by *time_res*
+    seconds per step as for :class:`PVpanel`.
+
+    """
+
+    def __init__(self, lat, area=1, efficiency=0.2, el_tilt=0, az_tilt=0,
+                 n_panels=None, time_res=1.):
+        params = [np.atleast_1d(np.asarray(x, dtype=float))
+                  for x in (lat, area, efficiency, el_tilt, az_tilt)]
+        shape = (n_panels,) if n_panels is not None else np.broadcast_shapes(
+            *(x.shape for x in params))
+        lat, area, efficiency, el_tilt, az_tilt = (
+            np.ascontiguousarray(np.broadcast_to(x, shape)) for x in params)
+
+        self.n_panels = shape[0]
+        self.area = area
+        self.efficiency = efficiency
+        self.el_tilt = radians(el_tilt)
+        self.az_tilt = radians(az_tilt)
+        self.lat = radians(lat)
+        self.time_res = float(time_res)
+
+    def power_series(self, index, dni):
+        """Calculate the active power output of every panel for every time of
+        *index*, as an array of shape ``(len(index), n_panels)``."""
+        dni = np.asarray(dni, dtype=float)[:, None]
+        return self.power_from_incidence(dni, self.incidence_cos(index))
+
+    def power_from_incidence(self, dni, cos_incidence):
+        """Calculate the active power output of the panels from *dni* and the
+        cosine of the incidence angles (``nan`` while the sun is down)."""
+        return power_from_incidence(dni, cos_incidence, self.area, self.efficiency)
+
+    def incidence_cos(self, index):
+        """Calculate the cosine of the incidence angle of every panel for every
+        time of *index*, ``nan`` while the sun is below the horizon."""
+        return incidence_cos(index, self.lat, self.el_tilt, self.az_tilt)
     
     
 #if __name__ == '__main__':
@@ -1,6 +1,9 @@
+import copy
 import itertools
 import math
 import mosaik_api
+import numpy as np
+import pandas as pd
 
 import simulators.pv_model as pvpanel
 
@@ -15,17 +18,48 @@ meta = {
                 'efficiency',   # panel efficiency
                 'el_tilt',      # panel elevation tilt [°]
                 'az_tilt',      # panel azimuth tilt [°]
+                'time_res',     # seconds of the panel clock per step
             ],
             'attrs': ['P_gen',      # output active power [W]
                       'DNI',    # input direct normal insolation [W/m2]
                       'mod'],    # input of modifier from ctrl
             'trigger': ['DNI', 'mod']
         },
+        'PVFleet': {
+            'public': True,
+            'params': [
+                'lat',          # latitude of each panel [°]
+                'area',         # area of each panel [m2]
+                'efficiency',   # efficiency of each panel
+                'el_tilt',      # elevation tilt of each panel [°]
+                'az_tilt',      # azimuth tilt of each panel [°]
+                'n_panels',     # number of panels, if all params are scalars
+                'time_res',     # seconds of the panel clock per step
+            ],
+            'attrs': ['P_gen',      # output active power of all panels [W]
+                      'DNI'],   # input direct normal insolation [W/m2]
+            'trigger': ['DNI']
+        },
+        'Panel': {
+            'public': False,
+            'params': [],
+            'attrs': ['P_gen',      # output active power [W]
+                      'mod'],    # input of modifier from ctrl
+            'trigger': ['mod']
+        },
     },
 }
 
 DATE_FORMAT = 'YYYY-MM-DD HH:mm:ss'
 
+BLOCK_MINUTES = 1440  # size of each precomputed block of solar geometry [min]
+SUNRISE_HORIZON = 2 * 1440  # how far ahead to look for the next sunrise [min]
+
+# Attributes carried from one step to the next, saved in checkpoints (the
+# precomputed incidence tables are rebuilt on demand)
+STATE = ('mods', 'last_step', 'next_self_step', '_offsets', '_dark', '_sent',
+         'fleet_mods', 'fleet_cache', '_fleet_power', '_fleet_last_step')
+
 
 class PvAdapter(mosaik_api.Simulator):
     def __init__(self):
@@ -39,11 +73,51 @@ class PvAdapter(mosaik_api.Simulator):
         self.mods = {}
         self.eid_counters = {}
 
-    def init(self, sid, time_resolution, start_date, step_size=None, gen_neg=True):
+        # Panel clock of each entity, in seconds after start_date, and the
+        # precomputed cosine of the incidence angle per minute of that clock
+        self._offsets = {}
+        self._incidence = {}
+
+        # PV fleets: parameters and state of all panels of a fleet in arrays,
+        # the panels themselves are child entities that index into them
+        self._fleets = {}
+        self._panels = {}
+        self.fleet_mods = {}
+        self.fleet_cache = {}
+        self._fleet_power = {}
+        self._fleet_last_step = {}
+
+        # Night skipping and output suppression (see init())
+        self.night_skip = False
+        self.tolerance = None
+        self._dark = {}
+        self._sent = {}
+
+    def init(self, sid, time_resolution, start_date, step_size=None, gen_neg=True,
+             night_skip=False, tolerance=None):
+        """With *night_skip* the simulator steps itself every *step_size*
+        and reads the DNI without being triggered by it; while the sun is
+        down at every panel it sleeps until the next sunrise. Only the PV
+        steps are saved: the grid and the controllers connected to it keep
+        stepping, driven by the load profiles and the bus voltages. With a
+        *tolerance* [MW], ``P_gen`` values that changed by at most that much
+        since they were last sent are left out of ``get_data``, so they do
+        not trigger the connected simulators (mosaik keeps the last value)."""
         self.sid = sid
         self.gen_neg = gen_neg
+        self.night_skip = night_skip
+        self.tolerance = tolerance
+        if night_skip:
+            if not step_size:
+                raise ValueError('night_skip requires a step_size')
+            self.meta = copy.deepcopy(self.meta)
+            for model in ('PV', 'PVFleet'):
+                self.meta['models'][model]['trigger'].remove('DNI')
 
         self.start_date = start_date
+        start = pd.Timestamp(start_date)
+        self._start_minute = start.floor('min')
+        self._start_second = start.second
         self.step_size = step_size
         self.last_step = -1
         self.next_self_step = 0
@@ -53,6 +127,10 @@ class PvAdapter(mosaik_api.Simulator):
     def create(self, num, model, **model_params):
         counter = self.eid_counters.setdefault(model, itertools.count())
 
+        if model == 'PVFleet':
+            return [self._create_fleet(next(counter), model_params)
+                    for i in range(num)]
+
         entities = []
 
         # creation of the entities:
@@ -62,17 +140,40 @@ class PvAdapter(mosaik_api.Simulator):
             self._entities[eid] = pvpanel.PVpanel(start_date=self.start_date,
                                                   **model_params)
             self.mods[eid] = 1.
+            self._offsets[eid] = 0.
+            self._incidence[eid] = {}
 
             entities.append({'eid': eid, 'type': model, 'rel': []})
 
         return entities
 
+    def _create_fleet(self, idx, model_params):
+        eid = 'PVFleet_%s' % idx
+        fleet = self._fleets[eid] = pvpanel.PVFleet(**model_params)
+        self.fleet_mods[eid] = np.ones(fleet.n_panels)
+        self.fleet_cache[eid] = np.zeros(fleet.n_panels)
+        self._fleet_power[eid] = np.zeros(fleet.n_panels)
+        self._fleet_last_step[eid] = -1
+        self._offsets[eid] = 0.
+
+        children = []
+        for i in range(fleet.n_panels):
+            panel_eid = '%s-%d' % (eid, i)
+            self._panels[panel_eid] = (eid, i)
+            children.append({'eid': panel_eid, 'type': 'Panel', 'rel': []})
+
+        return {'eid': eid, 'type': 'PVFleet', 'rel': [], 'children': children}
+
     def step(self, t, inputs, max_advance):
         # print('%s: %s: %s' % (t, max_advance, inputs))
 
 
         self.cache = {}
+        fleet_inputs = {}
         for eid, attrs in inputs.items():
+            if eid not in self._entities:
+                self._collect_fleet_inputs(fleet_inputs, eid, attrs)
+                continue
             if t != self.last_step:
                 fac = math.exp(-(t-self.last_step)/900.)  # Relax mod towards 1 within 15min
                 self.mods[eid] = 1. - fac + fac*self.mods[eid]
@@ -87,26 +188,168 @@ class PvAdapter(mosaik_api.Simulator):
             for attr, vals in attrs.items():
                 if attr == 'DNI':
                     dni = list(vals.values())[0] # only one source expected
-                    self.cache[eid] = self._entities[eid].power(dni)
+                    self.cache[eid], self._dark[eid] = self._power(eid, dni)
                     if t != self.last_step:
-                        self._entities[eid].step_time(t - self.last_step)
+                        panel = self._entities[eid]
+                        self._offsets[eid] += (t - self.last_step) * panel.time_res
                     if self.gen_neg:
                         self.cache[eid] *= (-1)
                 #print('valor de fac no loop for',fac)
             self.cache[eid] *= self.mods[eid]
 
+        for eid, (dni, mods) in fleet_inputs.items():
+            self._step_fleet(eid, t, dni, mods)
+
         self.last_step = t
 
         if self.step_size and t == self.next_self_step:
             next_step = t + self.step_size
+            if self.night_skip:
+                next_step = max(next_step, self._next_daylight_step(t))
             self.next_self_step = next_step
         else:
             next_step = None
         return next_step
 
+    def _collect_fleet_inputs(self, fleet_inputs, eid, attrs):
+        if eid in self._panels:
+            eid, i = self._panels[eid]
+        dni, mods = fleet_inputs.setdefault(eid, (None, {}))
+        for attr, vals in attrs.items():
+            if attr == 'DNI':
+                dni = list(vals.values())[0] # only one source expected
+            elif attr == 'mod':
+                mods[i] = list(vals.values())[0]
+        fleet_inputs[eid] = (dni, mods)
+
+    def _step_fleet(self, eid, t, dni, mod_inputs):
+        """Update every panel of the fleet *eid* at once."""
+        last_step = self._fleet_last_step[eid]
+        mods = self.fleet_mods[eid]
+        if t != last_step:
+            fac = math.exp(-(t-last_step)/900.)  # Relax mod towards 1 within 15min
+            mods *= fac
+            mods += 1. - fac
+        for i, mod in mod_inputs.items():
+            mods[i] *= mod
+
+        if dni is not None:
+            fleet = self._fleets[eid]
+            minute = int((self._start_second + self._offsets[eid]) // 60)
+            index = pd.DatetimeIndex([self._start_minute + pd.Timedelta(minutes=minute)])
+            cos_incidence = fleet.incidence_cos(index)[0]
+            self._fleet_power[eid] = fleet.power_from_incidence(dni, cos_incidence)
+            self._dark[eid] = bool(np.isnan(cos_incidence).all())
+            if t != last_step:
+                self._offsets[eid] += (t - last_step) * fleet.time_res
+
+        power = self._fleet_power[eid] * mods
+        self.fleet_cache[eid] = -power if self.gen_neg else power
+        self._fleet_last_step[eid] = t
+
+    def _power(self, eid, dni):
+        """Active power of entity *eid* for *dni* at its current panel time,
+        served from the precomputed incidence table, and whether the sun is
+        down at that time."""
+        cos_incidence = self._incidence_block(eid, self._minute(eid))
+        return (float(self._entities[eid].power_from_incidence(dni, cos_incidence[0])),
+                bool(np.isnan(cos_incidence[0])))
+
+    def _minute(self, eid):
+        """Current panel time of entity *eid* in minutes after the start."""
+        return int((self._start_second + self._offsets[eid]) // 60)
+
+    def _incidence_block(self, eid, minute):
+        """Cosine of the incidence angle of the single PV *eid* from *minute*
+        to the end of its precomputed block. Only the block of the current
+        panel time, the next one and the requested one are kept."""
+        block, i = divmod(minute, BLOCK_MINUTES)
+        blocks = self._incidence[eid]
+        if block not in blocks:
+            current = self._minute(eid) // BLOCK_MINUTES
+            for old in [key for key in blocks if key not in (current, current + 1)]:
+                del blocks[old]
+            index = self._start_minute + pd.to_timedelta(
+                np.arange(block * BLOCK_MINUTES, (block + 1) * BLOCK_MINUTES), unit='min')
+            blocks[block] = self._entities[eid].incidence_cos(index)
+        return blocks[block][i:]
+
+    def _sunrise_minute(self, eid, minute):
+        """First panel minute from *minute* on at which the sun is up at
+        any panel of *eid*, or ``None`` if there is none within
+        ``SUNRISE_HORIZON``."""
+        end = minute + SUNRISE_HORIZON
+        while minute < end:
+            if eid in self._fleets:
+                index = self._start_minute + pd.to_timedelta(
+                    np.arange(minute, minute + BLOCK_MINUTES), unit='min')
+                dark = np.isnan(self._fleets[eid].incidence_cos(index)).all(axis=1)
+            else:
+                dark = np.isnan(self._incidence_block(eid, minute))
+            if not dark.all():
+                return minute + int(np.argmin(dark))
+            minute += len(dark)
+        return None
+
+    def _next_daylight_step(self, t):
+        """Step at which the simulator has to wake up again: now if any
+        panel still produces or is in daylight, else at the next sunrise."""
+        wake = None
+        for eid in itertools.chain(self._entities, self._fleets):
+            if eid not in self._dark:
+                continue  # no DNI received yet
+            if not self._dark[eid]:
+                return t
+            sunrise = self._sunrise_minute(eid, self._minute(eid))
+            if sunrise is None:
+                continue
+            delay = sunrise * 60 - (self._start_second + self._offsets[eid])
+            delay /= (self._entities[eid] if eid in self._entities
+                      else self._fleets[eid]).time_res
+            if delay <= 0:
+                return t
+            wake = delay if wake is None else min(wake, delay)
+        if wake is None:
+            return t
+        return t + int(math.ceil(wake / self.step_size)) * self.step_size
+
+    def _changed(self, key, value):
+        """Whether *value* has to be sent, given the output tolerance and
+        the value last sent under *key*."""
+        if self.tolerance is None:
+            return True
+        last = self._sent.get(key)
+        if last is not None and np.all(np.abs(np.asarray(value) - last) <= self.tolerance):
+            return False
+        self._sent[key] = np.copy(value) if isinstance(value, np.ndarray) else value
+        return True
+
+    def get_state(self):
+        """State for a checkpoint (see :mod:`simulators.checkpoint`)."""
+        return {name: getattr(self, name) for name in STATE}
+
+    def set_state(self, state):
+        for name in STATE:
+            setattr(self, name, state[name])
+
     def get_data(self, outputs):
         data = {}
         for eid, attrs in outputs.items():
+            if eid in self._fleets:
+                if 'P_gen' in attrs and self._changed(eid, self.fleet_cache[eid]):
+                    data[eid] = {'P_gen': self.fleet_cache[eid].copy()}
+                continue
+            if eid in self._panels:
+                fleet_eid, i = self._panels[eid]
+                data[eid] = {}
+                for attr in attrs:
+                    if attr == 'P_gen':
+                        value = float(self.fleet_cache[fleet_eid][i])
+                        if self._changed(eid, value):
+                            data[eid][attr] = value
+                    elif attr == 'mod':
+                        data[eid][attr] = float(self.fleet_mods[fleet_eid][i])
+                continue
             if eid not in self._entities.keys():
                 raise ValueError('Unknown entity ID "%s"' % eid)
 
@@ -115,7 +358,8 @@ class PvAdapter(mosaik_api.Simulator):
                 #if attr != 'P_gen':
                 #    raise ValueError('Unknown output attribute "%s"' % attr)
                 if attr == 'P_gen':
-                    data[eid][attr] = self.cache[eid]
+                    if self._changed(eid, self.cache[eid]):
+                        data[eid][attr] = self.cache[eid]
                 elif attr == 'mod':
                     data[eid][attr] = self.mods[eid]
 
@@ -0,0 +1,40 @@
+"""
+Run a simulator class of this package as a separate mosaik process.
+
+mosaik starts the simulators of ``'cmd'`` entries of ``sim_config`` as
+subprocesses that connect back to it, and steps simulators in different
+processes concurrently. This module starts the class named by a
+``'module:Class'`` path, so any ``'python'`` entry can be moved out of
+process without a dedicated ``main()``::
+
+    {'cmd': '%(python)s -m simulators.remote simulators.controller_des_VV:Controller %(addr)s',
+     'cwd': 'src'}
+
+"""
+import importlib
+import sys
+
+import mosaik_api
+
+CMD = '%%(python)s -m simulators.remote %s %%(addr)s'
+
+
+def command(path):
+    """``'cmd'`` of a ``sim_config`` entry that runs the class at *path*."""
+    return CMD % path
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or ':' not in argv[0]:
+        sys.exit('usage: python -m simulators.remote module:Class HOST:PORT [options]')
+    module, _, name = argv[0].partition(':')
+    simulator = getattr(importlib.import_module(module), name)()
+
+    # O restante da linha de comando (endereço do mosaik e opções) é lido pelo mosaik_api
+    sys.argv = [sys.argv[0]] + argv[1:]
+    return mosaik_api.start_simulation(simulator)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+"""
+Queries on results written in the ``store`` format of
+:mod:`simulators.writers` (an output file ending in ``.store``)::
+
+    results = ResultsStore('output/results.store')
+    vm = results.get('vm_pu', buses=['0-LV2.101 Bus 42'],
+                     start='2016-01-02', end='2016-01-09')
+
+A store is a directory with ``meta.json`` (the columns, their entity group
+and the number of rows of each day) and one subdirectory per day, with the
+time index of the day (``index.npy``) and one array per group
+(``<group>.npy``, one row per column of the group). The arrays are
+memory-mapped and every column of a day is contiguous, so a query reads
+only the days in ``[start, end)`` and the columns it asks for instead of
+parsing a whole CSV file.
+
+Entities are given by their full ID (``'Grid-0.0-LV2.101 Bus 42'``) or
+entity ID (``'0-LV2.101 Bus 42'``), as in the columns ``<full ID>-<attr>``
+of the CSV results. :func:`convert` writes an existing CSV results file as a
+store; :func:`grid_groups` gives the groups of the grid entities, as written
+by the scenarios.
+
+"""
+import json
+
+import numpy as np
+import pandas as pd
+
+from pathlib import Path
+
+from simulators.grid_sim import preload
+from simulators.writers import OTHER_GROUP, STORE_INDEX, STORE_META, entity_group, make_writer
+
+GRID_GROUPS = {'Bus': 'bus', 'Line': 'line', 'ext_gen': 'gen'}
+SIM_GROUPS = {'PV': 'gen'}  # grupo das entidades de outros simuladores
+
+
+class ResultsStore:
+    def __init__(self, path):
+        self.path = Path(path)
+        try:
+            with open(self.path / STORE_META) as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            raise ValueError('%s is not a results store' % self.path) from None
+        self.columns = meta['columns']
+        self.groups = meta['groups']
+        self.partitions = sorted(meta['partitions'])
+        self._days = pd.DatetimeIndex([pd.Timestamp(name) for name in self.partitions])
+
+    @property
+    def attrs(self) -> list:
+        return sorted({attr for entry in self.groups.values() for attr in entry['attrs']})
+
+    @property
+    def start(self):
+        """Time of the first row."""
+        return self._index(self.partitions[0])[0] if self.partitions else None
+
+    @property
+    def end(self):
+        """Time of the last row."""
+        return self._index(self.partitions[-1])[-1] if self.partitions else None
+
+    def entities(self, group=None, attr=None) -> list:
+        """Full IDs of the entities of *group* (all groups if ``None``) with
+        values of *attr* (any attribute if ``None``)."""
+        entities = []
+        for name, entry in self.groups.items():
+            if group is None or name == group:
+                entities += [source for source, column_attr in zip(entry['sources'],
+                                                                    entry['attrs'])
+                             if attr is None or column_attr == attr]
+        return list(dict.fromkeys(entities))
+
+    def get(self, attr, buses=None, lines=None, gens=None, entities=None, start=None,
+            end=None) -> pd.DataFrame:
+        """Values of *attr* in ``[start, end)``, one column per entity, named
+        by its full ID.
+
+        *buses*, *lines* and *gens* select entities of those groups (only the
+        groups given are read); *entities* selects entities of any group.
+        Without any of them, every entity with *attr* is returned.
+
+        """
+        selection = {'bus': buses, 'line': lines, 'gen': gens}
+        read = [group for group, names in selection.items() if names is not None]
+        if entities is not None or not read:
+            read = list(self.groups)
+        wanted = [name for names in list(selection.values()) + [entities] if names is not None
+                  for name in names]
+        position = {name: k for k, name in reversed(list(enumerate(wanted)))}
+
+        rows = {}
+        names = []
+        rank = {}  # posição de cada entidade no pedido
+        for group in read:
+            entry = self.groups.get(group, {'sources': [], 'attrs': []})
+            for row, (source, column_attr) in enumerate(zip(entry['sources'], entry['attrs'])):
+                if column_attr != attr:
+                    continue
+                if wanted:
+                    keys = [key for key in (source, source.partition('.')[2]) if key in position]
+                    if not keys:
+                        continue
+                    rank[source] = min(position[key] for key in keys)
+                    rank.update(dict.fromkeys(keys, rank[source]))
+                rows.setdefault(group, []).append(row)
+                names.append(source)
+
+        missing = [name for name in wanted if name not in rank]
+        if missing:
+            raise KeyError('No "%s" values for %s' % (attr, ', '.join(missing)))
+        if not names:
+            raise KeyError('No "%s" values in %s' % (attr, self.path))
+        index, values = self._read(rows, start, end)
+        df = pd.DataFrame(values, index=index, columns=names)
+        return df[sorted(names, key=rank.get)] if wanted else df
+
+    def read(self, start=None, end=None) -> pd.DataFrame:
+        """All columns in ``[start, end)``, as in the CSV results."""
+        rows = {group: list(range(len(entry['positions'])))
+                for group, entry in self.groups.items()}
+        positions = [position for entry in self.groups.values()
+                     for position in entry['positions']]
+        index, values = self._read(rows, start, end)
+        df = pd.DataFrame(values, index=index,
+                          columns=[self.columns[position] for position in positions])
+        return df[self.columns]
+
+    def _index(self, partition):
+        return pd.DatetimeIndex(np.load(self.path / partition / STORE_INDEX, mmap_mode='r'),
+                                name='date')
+
+    def _read(self, rows, start, end):
+        # Linhas 'rows' de cada grupo, nos dias que coincidem com [start, end)
+        start = pd.Timestamp(start) if start is not None else None
+        end = pd.Timestamp(end) if end is not None else None
+        first = 0 if start is None else self._days.searchsorted(start.floor('D'))
+        last = len(self._days) if end is None else self._days.searchsorted(end)
+        indexes = []
+        blocks = []
+        for partition in self.partitions[first:last]:
+            index = self._index(partition)
+            lo = 0 if start is None else index.searchsorted(start)
+            hi = len(index) if end is None else index.searchsorted(end)
+            if lo == hi:
+                continue
+            indexes.append(index[lo:hi])
+            blocks.append(np.concatenate(
+                [np.load(self.path / partition / ('%s.npy' % group), mmap_mode='r')[
+                    group_rows, lo:hi] for group, group_rows in rows.items()]
+                or [np.empty((0, hi - lo))]))
+        n_columns = sum(len(group_rows) for group_rows in rows.values())
+        if not blocks:
+            return pd.DatetimeIndex([], name='date'), np.empty((0, n_columns))
+        return indexes[0].append(indexes[1:]), np.concatenate(blocks, axis=1).T
+
+
+def grid_groups(grid_file) -> dict:
+    """Group of each bus, line and generator of *grid_file*, by entity ID."""
+    index = preload(grid_file)
+    return {eid: group for kind, group in GRID_GROUPS.items() for eid in index.get(kind, [])}
+
+
+def column_groups(columns, groups) -> list:
+    """Group of each column ``<full ID>-<attr>`` of the results, from
+    *groups* (``{full or entity ID: group}``, as for the collector) or else
+    from the simulator of the entity (``SIM_GROUPS``)."""
+    column_groups = []
+    for column in columns:
+        source = column.rpartition('-')[0]
+        group = entity_group(source, groups)
+        if group == OTHER_GROUP:
+            group = SIM_GROUPS.get(source.partition('-')[0], OTHER_GROUP)
+        column_groups.append(group)
+    return column_groups
+
+
+def convert(csv_file, store_file, groups=None, chunksize=1440) -> int:
+    """Write the CSV results *csv_file* as the store *store_file*, reading
+    *chunksize* rows at a time; *groups* as in :func:`column_groups`. Returns
+    the number of rows."""
+    writer = None
+    rows = 0
+    for chunk in pd.read_csv(csv_file, index_col=0, parse_dates=True, chunksize=chunksize,
+                             float_precision='round_trip'):
+        if writer is None:
+            writer = make_writer(store_file, chunk.columns, chunk.index[0], 1, 'store',
+                                 groups=column_groups(chunk.columns, groups or {}))
+        writer.write_frame(chunk.rename_axis('date'))
+        rows += len(chunk)
+    if writer is not None:
+        writer.close()
+    return rows
@@ -0,0 +1,311 @@
+"""
+Buffered, fixed-schema writers used by the collector.
+
+Rows are stored in a preallocated NumPy array and written to disk in chunks
+of ``buffer_size`` rows, so the output file is opened and formatted once per
+chunk instead of once per simulation step.
+
+CSV, HDF5 and store files can be continued by a later run: :meth:`position`
+flushes the buffer and returns how much of the file is written, and
+:meth:`resume` cuts a file back to that position and appends to it (see
+:mod:`simulators.checkpoint`).
+
+The ``store`` format (:class:`StoreWriter`, suffix ``.store``) is a directory
+partitioned by day and by entity group (``bus``, ``line``, ``gen``, ...), with
+every column stored contiguously, so that :mod:`simulators.results_store`
+reads only the columns and days of a query.
+
+"""
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from pathlib import Path
+
+
+class BufferedWriter:
+    """Base class: collects rows of floats and flushes them in chunks."""
+
+    def __init__(self, output_file, columns, start_date, time_resolution,
+                 buffer_size=1440, groups=None):
+        self.output_file = Path(output_file)
+        self.columns = list(columns)
+        # Grupo da entidade de cada coluna ('bus', 'line', ...); só o formato store o usa
+        self.groups = list(groups) if groups is not None else [OTHER_GROUP] * len(self.columns)
+        self.start_date = start_date
+        self.time_resolution = time_resolution
+        self.buffer_size = buffer_size
+
+        self._times = np.empty(buffer_size, dtype=np.int64)
+        self._values = np.empty((buffer_size, len(self.columns)), dtype=float)
+        self._n = 0
+        self._flushes = 0
+
+    def append(self, time, row):
+        """Add the row *row* (an array with one value per column) for *time*."""
+        self._times[self._n] = time
+        self._values[self._n] = row
+        self._n += 1
+        if self._n == self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self._n == 0:
+            return
+        index = pd.DatetimeIndex(
+            self.start_date + pd.to_timedelta(self._times[:self._n] * self.time_resolution,
+                                              unit='seconds'),
+            name='date')
+        df = pd.DataFrame(self._values[:self._n], index=index, columns=self.columns)
+        self._write(df, first=self._flushes == 0)
+        self._flushes += 1
+        self._n = 0
+
+    def close(self):
+        self.flush()
+
+    def write_frame(self, df):
+        """Write the rows of *df* (indexed by date, with the writer's columns)
+        at once, e.g. results read back from a cache."""
+        self.flush()
+        self._write(df, first=self._flushes == 0)
+        self._flushes += 1
+
+    def position(self):
+        """Flush the buffer and return a marker of what has been written."""
+        raise ValueError('%s output files cannot be resumed' % type(self).__name__)
+
+    def resume(self, position):
+        """Continue a file written up to *position* by an earlier writer,
+        discarding anything written after it."""
+        raise ValueError('%s output files cannot be resumed' % type(self).__name__)
+
+    def _write(self, df, first):
+        raise NotImplementedError
+
+
+class CSVWriter(BufferedWriter):
+    def _write(self, df, first):
+        if first:
+            df.to_csv(self.output_file, mode='w', header=True)
+        else:
+            df.to_csv(self.output_file, mode='a', header=False)
+
+    def position(self):
+        self.flush()
+        return self.output_file.stat().st_size if self._flushes else 0
+
+    def resume(self, position):
+        if position:
+            with open(self.output_file, 'r+b') as f:
+                if f.seek(0, 2) < position:
+                    raise ValueError('%s is shorter than when it was checkpointed'
+                                     % self.output_file)
+                f.truncate(position)
+        self._flushes = int(bool(position))
+
+
+class ParquetWriter(BufferedWriter):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError('Writing Parquet files requires "pyarrow" '
+                              '(uv add pyarrow).') from None
+        self._pa = pyarrow
+        self._writer = None
+
+    def _write(self, df, first):
+        table = self._pa.Table.from_pandas(df)
+        if self._writer is None:
+            self._writer = self._pa.parquet.ParquetWriter(self.output_file, table.schema)
+        self._writer.write_table(table)
+
+    def close(self):
+        super().close()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+class HDF5Writer(BufferedWriter):
+    key = 'results'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._rows = 0
+
+    def _write(self, df, first):
+        try:
+            with pd.HDFStore(self.output_file, mode='w' if first else 'a') as store:
+                store.append(self.key, df, format='table')
+        except ImportError:
+            raise ImportError('Writing HDF5 files requires "tables" '
+                              '(uv add tables).') from None
+        self._rows += len(df)
+
+    def position(self):
+        self.flush()
+        return self._rows
+
+    def resume(self, position):
+        if position:
+            with pd.HDFStore(self.output_file, mode='a') as store:
+                rows = store.get_storer(self.key).nrows
+                if rows < position:
+                    raise ValueError('%s is shorter than when it was checkpointed'
+                                     % self.output_file)
+                if rows > position:
+                    store.remove(self.key, start=position, stop=rows)
+        self._rows = position
+        self._flushes = int(bool(position))
+
+
+OTHER_GROUP = 'other'  # grupo das colunas sem entidade conhecida
+STORE_META = 'meta.json'
+STORE_INDEX = 'index.npy'
+STORE_VERSION = 1
+PARTITION_FORMAT = '%Y%m%d'  # uma partição por dia
+
+
+def entity_group(source, groups):
+    """Group of the entity *source* (a full ID such as ``'Grid-0.0-Bus 1'``)
+    in *groups*, whose keys are full IDs or entity IDs (``'0-Bus 1'``)."""
+    return groups.get(source, groups.get(source.partition('.')[2], OTHER_GROUP))
+
+
+def _save_atomic(path, save):
+    # O sufixo é mantido: np.save acrescenta '.npy' a nomes sem ele
+    tmp = path.with_name('%s.%d.tmp%s' % (path.stem, os.getpid(), path.suffix))
+    save(tmp)
+    os.replace(tmp, path)
+
+
+class StoreWriter(BufferedWriter):
+    """Directory with one subdirectory per day, holding the time index
+    (``index.npy``) and one array per entity group (``<group>.npy``, one row
+    per column of the group), described by ``meta.json``.
+
+    A day that already exists (a flush in the middle of the day) is read back
+    and rewritten with the new rows, so a partition is rewritten at most once
+    per flush of the buffer.
+
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._meta = None
+
+    def _new_meta(self):
+        groups = {}
+        for position, (name, group) in enumerate(zip(self.columns, self.groups)):
+            source, _, attr = name.rpartition('-')
+            entry = groups.setdefault(group, {'positions': [], 'sources': [], 'attrs': []})
+            entry['positions'].append(position)
+            entry['sources'].append(source)
+            entry['attrs'].append(attr)
+        return {'version': STORE_VERSION, 'columns': self.columns, 'groups': groups,
+                'partitions': {}}
+
+    def _write(self, df, first):
+        if first:
+            if self.output_file.exists():
+                if not (self.output_file / STORE_META).exists() and any(
+                        self.output_file.iterdir()):
+                    raise ValueError('%s exists and is not a results store' % self.output_file)
+                shutil.rmtree(self.output_file)
+            self.output_file.mkdir(parents=True)
+            self._meta = self._new_meta()
+
+        values = df.to_numpy(dtype=float)
+        days = df.index.floor('D')
+        bounds = np.flatnonzero(days[1:] != days[:-1]) + 1
+        for lo, hi in zip(np.r_[0, bounds], np.r_[bounds, len(df)]) if len(df) else ():
+            self._write_partition(days[lo].strftime(PARTITION_FORMAT),
+                                  df.index.values[lo:hi], values[lo:hi])
+        _save_atomic(self.output_file / STORE_META,
+                     lambda path: path.write_text(json.dumps(self._meta)))
+
+    def _write_partition(self, name, index, values):
+        directory = self.output_file / name
+        directory.mkdir(exist_ok=True)
+        arrays = {group: values[:, entry['positions']].T
+                  for group, entry in self._meta['groups'].items()}
+        if name in self._meta['partitions']:
+            index = np.concatenate([np.load(directory / STORE_INDEX), index])
+            arrays = {group: np.concatenate([np.load(directory / ('%s.npy' % group)), array],
+                                            axis=1)
+                      for group, array in arrays.items()}
+        for group, array in arrays.items():
+            _save_atomic(directory / ('%s.npy' % group),
+                         lambda path: np.save(path, np.ascontiguousarray(array)))
+        _save_atomic(directory / STORE_INDEX,
+                     lambda path: np.save(path, index.astype('datetime64[ns]')))
+        self._meta['partitions'][name] = len(index)
+
+    def position(self):
+        self.flush()
+        return sum(self._meta['partitions'].values()) if self._meta is not None else 0
+
+    def resume(self, position):
+        if position:
+            with open(self.output_file / STORE_META) as f:
+                self._meta = json.load(f)
+            rows = 0
+            for name in sorted(self._meta['partitions']):
+                n = self._meta['partitions'][name]
+                keep = min(max(position - rows, 0), n)
+                rows += n
+                directory = self.output_file / name
+                if keep == 0:
+                    shutil.rmtree(directory)
+                    del self._meta['partitions'][name]
+                elif keep < n:
+                    for path in directory.glob('*.npy'):
+                        array = np.load(path)
+                        _save_atomic(path, lambda tmp: np.save(
+                            tmp, np.ascontiguousarray(array[..., :keep])))
+                    self._meta['partitions'][name] = keep
+            if rows < position:
+                raise ValueError('%s is shorter than when it was checkpointed'
+                                 % self.output_file)
+            _save_atomic(self.output_file / STORE_META,
+                         lambda path: path.write_text(json.dumps(self._meta)))
+        self._flushes = int(bool(position))
+
+
+WRITERS = {
+    'csv': CSVWriter,
+    'parquet': ParquetWriter,
+    'hdf5': HDF5Writer,
+    'store': StoreWriter,
+}
+
+SUFFIXES = {
+    '.csv': 'csv',
+    '.parquet': 'parquet',
+    '.pq': 'parquet',
+    '.h5': 'hdf5',
+    '.hdf5': 'hdf5',
+    '.store': 'store',
+}
+
+
+def make_writer(output_file, columns, start_date, time_resolution,
+                output_format=None, buffer_size=1440, groups=None):
+    """Create the writer for *output_format*, or for the suffix of
+    *output_file* if no format is given. *groups* gives the entity group of
+    each column (see :class:`StoreWriter`)."""
+    if output_format is None:
+        output_format = SUFFIXES.get(Path(output_file).suffix.lower(), 'csv')
+    try:
+        cls = WRITERS[output_format]
+    except KeyError:
+        raise ValueError('Unknown output format "%s" (expected one of %s)'
+                         % (output_format, ', '.join(WRITERS))) from None
+    return cls(output_file, columns, start_date, time_resolution, buffer_size, groups)
@@ -0,0 +1,11 @@
+# Os controladores vetorizados (simulators.controller_batch) devem reproduzir o OpenDER
+# por agente; o controlador de frota (FleetCtrl) e a tabela de respostas dependem disso.
+import pytest
+
+from simulators.controller_batch import verify
+
+
+@pytest.mark.parametrize('fleet', [False, True], ids=['agents', 'fleet'])
+@pytest.mark.parametrize('mode', ['SEM', 'NO', 'VV', 'VW'])
+def test_batch_matches_opender(mode, fleet):
+    assert verify(mode, fleet=fleet) <= 1e-9
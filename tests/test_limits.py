@@ -0,0 +1,29 @@
+import pytest
+
+from simulators.limits import LimitViolation, Limits
+
+INPUTS = {'Limits': {'vm_pu': {'Grid-0.Feeder': [1.0, 1.07, 1.02]}}}
+
+
+def make_limits(**params):
+    sim = Limits()
+    sim.init('Limits-0', 1., **params)
+    sim.create(1, 'Limits', labels={'vm_pu': ['b0', 'b1', 'b2']})
+    return sim
+
+
+def test_violation_raises_without_end_run():
+    with pytest.raises(LimitViolation) as e:
+        make_limits().step(60, INPUTS, None)
+    assert (e.value.element, e.value.time) == ('b1', 60)
+
+
+def test_violation_ends_run_without_raising():
+    ended = []
+    sim = make_limits(end_run=ended.append)
+    assert sim.step(60, INPUTS, None) is None
+    assert ended == [60]
+    assert isinstance(sim.error, LimitViolation) and sim.error.element == 'b1'
+    # Passos seguintes não verificam nem encerram de novo
+    sim.step(120, INPUTS, None)
+    assert ended == [60] and sim.error.time == 60
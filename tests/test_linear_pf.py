@@ -0,0 +1,26 @@
+import pandapower as pp
+import pandapower.networks as ppn
+import pytest
+
+from simulators.grid_sim import Pandapower
+from simulators.linear_pf import unsupported
+
+
+def make_grid(**params):
+    sim = Pandapower()
+    sim.init('Grid-0', 1., 60, **params)
+    return sim
+
+
+def test_net_with_gen_is_rejected_before_the_run():
+    # cigre_hv tem geradores PV (gen): o erro vem do create, não do primeiro passo
+    with pytest.raises(ValueError, match='linear_pf cannot be used.*PV generators'):
+        make_grid(linear_pf=True).create(1, 'Grid', gridfile='cigre_hv')
+    assert make_grid().create(1, 'Grid', gridfile='cigre_hv')
+
+
+def test_more_than_one_slack_is_unsupported():
+    net = ppn.create_cigre_network_mv(with_der=False)
+    assert unsupported(net) is None
+    pp.create_ext_grid(net, bus=net.bus.index[-1])
+    assert 'slack' in unsupported(net)
@@ -0,0 +1,16 @@
+import numpy as np
+import pandas as pd
+
+from simulators.pv_model import PVFleet, PVpanel
+
+
+def test_fleet_matches_single_panels():
+    index = pd.date_range('2016-01-01', periods=3 * 1440, freq='min')
+    dni = np.linspace(0., 900., len(index))
+    params = {'lat': [53.05, 10., -20.], 'area': [1e4, 2e3, 5e3], 'efficiency': [0.2, 0.15, 0.18],
+              'el_tilt': [32., 0., 45.], 'az_tilt': [0., 30., -90.]}
+    fleet = PVFleet(**params).power_series(index, dni)
+    panels = np.stack([PVpanel(start_date='2016-01-01 00:00:00',
+                               **{key: values[i] for key, values in params.items()})
+                       .power_series(index, dni) for i in range(3)], axis=1)
+    np.testing.assert_array_equal(fleet, panels)
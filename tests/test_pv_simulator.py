@@ -0,0 +1,37 @@
+import numpy as np
+
+from simulators.pv_simulator import BLOCK_MINUTES, PvAdapter
+
+PANEL = {'lat': 53.05, 'area': 1e4, 'efficiency': 0.2, 'el_tilt': 32., 'az_tilt': 0.}
+
+
+def run_panels(sim, eids, steps, step_size=60, dni=500.):
+    power = []
+    for k in range(steps):
+        sim.step(k * step_size, {eid: {'DNI': {'DNI': dni}} for eid in eids}, None)
+        power.append([sim.get_data({eid: ['P_gen']})[eid]['P_gen'] for eid in eids])
+    return np.array(power)
+
+
+def test_incidence_blocks_are_bounded():
+    sim = PvAdapter()
+    sim.init('PV', 1., start_date='2016-01-01 00:00:00')
+    eid = sim.create(1, 'PV', **PANEL)[0]['eid']
+    run_panels(sim, [eid], 3 * BLOCK_MINUTES)
+    assert len(sim._incidence[eid]) <= 2
+
+
+def test_fleet_clock_matches_single_panels():
+    # Com time_res != 1, o relógio da frota deve avançar como o dos painéis individuais
+    panels, fleet = PvAdapter(), PvAdapter()
+    for sim in (panels, fleet):
+        sim.init('PV', 1., start_date='2016-01-01 10:00:00')
+    eids = [entity['eid'] for entity in panels.create(2, 'PV', time_res=2., **PANEL)]
+    fleet_eid = fleet.create(1, 'PVFleet', n_panels=2, time_res=2., **PANEL)[0]['eid']
+
+    expected = run_panels(panels, eids, 600)
+    actual = []
+    for k in range(600):
+        fleet.step(k * 60, {fleet_eid: {'DNI': {'DNI': 500.}}}, None)
+        actual.append(fleet.get_data({fleet_eid: ['P_gen']})[fleet_eid]['P_gen'])
+    np.testing.assert_array_equal(np.array(actual), expected)